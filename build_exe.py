@@ -38,7 +38,7 @@ def install_dependencies():
         subprocess.run([sys.executable, "-m", "pip", "install", "--user", "-r", requirements_file], check=True)
     else:
         print("未找到requirements.txt文件，使用默认依赖")
-        subprocess.run([sys.executable, "-m", "pip", "install", "--user", "PyQt5", "pynput", "pyautogui", "pyinstaller"], check=True)
+        subprocess.run([sys.executable, "-m", "pip", "install", "--user", "PyQt5", "pynput", "pyautogui", "numpy", "pyinstaller"], check=True)
     print("依赖安装完成！")
 
 
@@ -0,0 +1,109 @@
+# 鼠标移动采样策略
+# 功能：在录制线程中过滤高回报率鼠标产生的密集移动事件，减少录制数据量
+import math
+
+# 采样模式
+CAPTURE_MODE_ALL = 'all'            # 记录全部移动事件
+CAPTURE_MODE_FIXED = 'fixed'        # 固定频率上限 + 最小像素距离
+CAPTURE_MODE_ADAPTIVE = 'adaptive'  # 自适应：快速移动按频率上限密集采样，慢速移动稀疏采样，静止抖动丢弃
+CAPTURE_MODES = (CAPTURE_MODE_ALL, CAPTURE_MODE_FIXED, CAPTURE_MODE_ADAPTIVE)
+
+# 自适应模式参数
+ADAPTIVE_FAST_SPEED = 1000.0   # 达到该速度（像素/秒）视为快速移动，按频率上限采样
+ADAPTIVE_MAX_STRETCH = 4.0     # 慢速移动时采样间隔最多放大的倍数
+
+# 被丢弃的移动事件若在该时间（微秒）内没有后续移动，则视为停留位置，在下一次移动前补记
+REST_FLUSH_US = 50000
+
+# 单个鼠标移动操作序列化为JSON后的大致字节数（用于估算节省的数据量）
+MOVE_OP_JSON_BYTES = 90
+
+
+class MoveCapturePolicy:
+    """鼠标移动采样策略
+
+    offer() 决定每个移动事件是否保留；被丢弃的最后一个位置暂存起来，
+    在点击、按键等其他事件之前或录制结束时通过 take_pending() 补记，
+    保证点击前的指针位置总是精确的。
+    """
+
+    def __init__(self, mode=CAPTURE_MODE_ADAPTIVE, max_hz=125, min_distance=2):
+        if mode not in CAPTURE_MODES:
+            raise ValueError(f'未知的采样模式: {mode}')
+        self.mode = mode
+        self.max_hz = max_hz
+        self.min_distance = min_distance
+        # 频率上限对应的最小采样间隔（微秒），0 表示不限制
+        self._interval_us = int(1000000 / max_hz) if max_hz and max_hz > 0 else 0
+        self._last_kept = None   # 最后保留的位置 (timestamp_us, x, y)
+        self._pending = None     # 最后丢弃的位置 (timestamp_us, x, y)
+        # 统计
+        self.seen_count = 0      # 收到的移动事件数
+        self.kept_count = 0      # 直接保留的移动事件数
+        self.flushed_count = 0   # 因其他事件或停留而补记的移动事件数
+
+    def offer(self, timestamp, x, y):
+        """提交一个移动事件，返回 True 表示应立即记录"""
+        self.seen_count += 1
+        if self.mode == CAPTURE_MODE_ALL or self._last_kept is None:
+            return self._keep(timestamp, x, y)
+
+        last_t, last_x, last_y = self._last_kept
+        dt = timestamp - last_t
+        distance = math.hypot(x - last_x, y - last_y)
+
+        # 静止抖动：距离不足最小像素距离的移动直接丢弃
+        if distance < self.min_distance:
+            self._pending = None if distance == 0 else (timestamp, x, y)
+            return False
+
+        required_dt = self._interval_us
+        if self.mode == CAPTURE_MODE_ADAPTIVE and required_dt and dt > 0:
+            # 速度越慢，采样间隔越大；快速移动保持频率上限的密集采样
+            speed = distance * 1000000 / dt
+            stretch = ADAPTIVE_FAST_SPEED / speed if speed > 0 else ADAPTIVE_MAX_STRETCH
+            required_dt = int(required_dt * min(max(stretch, 1.0), ADAPTIVE_MAX_STRETCH))
+
+        if dt >= required_dt:
+            return self._keep(timestamp, x, y)
+        self._pending = (timestamp, x, y)
+        return False
+
+    def take_pending(self, before_timestamp=None):
+        """取出应补记的被丢弃位置，没有时返回 None
+
+        Args:
+            before_timestamp: 下一个移动事件的时间戳；为 None 表示即将记录非移动事件或录制结束，
+                此时无条件取出。否则只有暂存位置已停留超过 REST_FLUSH_US 时才取出。
+        """
+        pending = self._pending
+        if pending is None:
+            return None
+        if before_timestamp is not None and before_timestamp - pending[0] < REST_FLUSH_US:
+            return None
+        self._pending = None
+        self._last_kept = pending
+        self.flushed_count += 1
+        return pending
+
+    def _keep(self, timestamp, x, y):
+        """保留一个位置"""
+        self._last_kept = (timestamp, x, y)
+        self._pending = None
+        self.kept_count += 1
+        return True
+
+    def stats(self):
+        """返回本次录制的采样统计"""
+        recorded = self.kept_count + self.flushed_count
+        dropped = self.seen_count - recorded
+        return {
+            'mode': self.mode,
+            'max_hz': self.max_hz,
+            'min_distance': self.min_distance,
+            'seen': self.seen_count,
+            'recorded': recorded,
+            'dropped': dropped,
+            'saved_ratio': dropped / self.seen_count if self.seen_count else 0.0,
+            'saved_bytes': dropped * MOVE_OP_JSON_BYTES
+        }
@@ -0,0 +1,93 @@
+# 录制事件采集队列
+# 功能：在 pynput 钩子线程（生产者）和录制线程（消费者）之间传递原始事件元组
+
+
+class SpscRingBuffer:
+    """单生产者单消费者环形缓冲区
+
+    槽位在创建时一次性预分配，push/pop 不加锁：
+    写指针只由生产者修改，读指针只由消费者修改，
+    生产者先写槽位再发布写指针，依赖 GIL 保证单条赋值的原子性。
+    缓冲区满时丢弃新事件并计数，绝不阻塞钩子线程。
+    """
+
+    def __init__(self, capacity):
+        # 容量向上取整为2的幂，便于用位与代替取模
+        size = 1
+        while size < capacity:
+            size <<= 1
+        self._capacity = size
+        self._mask = size - 1
+        self._slots = [None] * size
+        self._head = 0              # 写指针（单调递增，只由生产者修改）
+        self._tail = 0              # 读指针（单调递增，只由消费者修改）
+        self._overflowing = False   # 当前是否处于溢出状态（只由生产者修改）
+        self.overflow_count = 0     # 溢出次数（从未满进入已满状态的次数）
+        self.dropped_count = 0      # 因缓冲区已满而丢弃的事件数
+        self.pushed_count = 0       # 成功写入的事件数
+        self.high_watermark = 0     # 观察到的最大队列深度
+
+    @property
+    def capacity(self):
+        """缓冲区容量"""
+        return self._capacity
+
+    def __len__(self):
+        """当前队列深度"""
+        return self._head - self._tail
+
+    def push(self, item):
+        """写入一个事件（生产者调用），缓冲区满时返回 False"""
+        head = self._head
+        depth = head - self._tail
+        if depth >= self._capacity:
+            # 缓冲区已满：丢弃事件并计数
+            if not self._overflowing:
+                self._overflowing = True
+                self.overflow_count += 1
+            self.dropped_count += 1
+            return False
+        self._overflowing = False
+        self._slots[head & self._mask] = item
+        # 槽位写入完成后再发布写指针
+        self._head = head + 1
+        self.pushed_count += 1
+        if depth >= self.high_watermark:
+            self.high_watermark = depth + 1
+        return True
+
+    def pop_all(self, out):
+        """取出当前所有事件追加到 out 列表（消费者调用），返回取出的数量"""
+        tail = self._tail
+        head = self._head
+        slots = self._slots
+        mask = self._mask
+        for i in range(tail, head):
+            index = i & mask
+            out.append(slots[index])
+            # 释放槽位引用，避免长时间持有已消费的对象
+            slots[index] = None
+        # 所有槽位读取完成后再移动读指针，把空间交还给生产者
+        self._tail = head
+        return head - tail
+
+    def reset(self):
+        """清空缓冲区和计数（仅在没有生产者写入时调用）"""
+        self._slots = [None] * self._capacity
+        self._head = 0
+        self._tail = 0
+        self._overflowing = False
+        self.overflow_count = 0
+        self.dropped_count = 0
+        self.pushed_count = 0
+        self.high_watermark = 0
+
+    def stats(self):
+        """返回计数信息字典"""
+        return {
+            'capacity': self._capacity,
+            'pushed': self.pushed_count,
+            'dropped': self.dropped_count,
+            'overflows': self.overflow_count,
+            'high_watermark': self.high_watermark
+        }
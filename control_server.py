@@ -0,0 +1,477 @@
+# 本机控制服务
+# 功能：让其他程序通过本机回环 TCP 或 Unix 套接字控制录制/播放引擎：列出和加载序列、播放、停止、查询状态，
+#      并向订阅者推送状态和播放进度事件
+#
+# 协议：每行一个 JSON 对象（UTF-8）
+#   请求：{"id": 1, "token": "...", "command": "play", "sequence": "登录", "loops": 2, "speed": 1.5}
+#   响应：{"id": 1, "ok": true, "result": {...}} 或 {"id": 1, "ok": false, "error": "..."}
+#   事件：{"event": "state", "state": "playing"}、{"event": "progress", ...}、{"event": "command", ...}
+#
+# 安全：每个请求都必须带令牌（默认为当前用户主目录下自动生成、只有本人可读的令牌文件中的令牌）。
+#      一行不是 JSON 对象或令牌不对时立即断开连接，浏览器等发来的 HTTP 请求无法夹带命令。
+#      能使用 Unix 套接字的平台默认监听 Unix 套接字（只有本人可读写），否则只监听本机回环地址；
+#      监听非回环地址时必须在 utils.control_server_token 或 --token 中明确设置令牌
+#
+# 会驱动鼠标键盘的命令（load、play）进入队列，由唯一的执行协程按顺序执行：前一个播放结束后才开始下一个，
+# 多个客户端同时发来的请求不会交错输入。其他命令（stop、pause、resume、status、list、subscribe、metrics）立即执行。
+#
+# 用法：python control_server.py [--unix 套接字路径 | --tcp [--host 地址] [--port 端口]] [--token 令牌]  无界面运行控制服务
+#      python control_server.py --send '{"command": "status"}' [--follow]  发送一条命令（自动带上令牌，--follow 持续输出事件）
+import argparse
+import asyncio
+import hmac
+import ipaddress
+import json
+import os
+import secrets
+import socket
+import stat
+import sys
+import threading
+
+import utils
+import metrics
+import sequence
+import playlist
+import player
+from engine import AutomationEngine, STATE_PLAYING, STATE_IDLE
+
+# 默认监听地址（只监听本机回环地址）
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = utils.control_server_port
+
+# 默认 Unix 套接字路径（asyncio 不支持 Unix 套接字的平台为 None，改用回环 TCP）
+if hasattr(socket, 'AF_UNIX') and not sys.platform.startswith('win'):
+    DEFAULT_UNIX_PATH = os.path.join(os.environ.get('XDG_RUNTIME_DIR') or os.path.expanduser('~'),
+                                     '.desktop_automation.sock')
+else:
+    DEFAULT_UNIX_PATH = None
+
+# 每个用户的令牌文件（只有本人可读写）
+TOKEN_FILE = os.path.join(os.path.expanduser('~'), '.desktop_automation_token')
+
+# 进入队列、由执行协程按顺序执行的命令
+QUEUED_COMMANDS = ('load', 'play')
+# 立即执行的命令
+IMMEDIATE_COMMANDS = ('list', 'status', 'stop', 'pause', 'resume', 'subscribe', 'metrics')
+
+# 每个订阅者最多积压的事件数，超过时丢弃最旧的事件（客户端读得太慢时不阻塞服务）
+MAX_PENDING_EVENTS = 1000
+
+
+class CommandError(Exception):
+    """命令参数错误或无法执行"""
+
+
+def load_token(path=TOKEN_FILE, create=True):
+    """读取令牌文件，不存在时（create 为 True）生成新的令牌并以只有本人可读写的权限创建
+
+    Returns:
+        str: 令牌；文件不存在且不创建时返回 None
+    """
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            token = f.read().strip()
+        if token:
+            return token
+    except FileNotFoundError:
+        if not create:
+            return None
+    token = secrets.token_hex(32)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, stat.S_IRUSR | stat.S_IWUSR)
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        f.write(token + '\n')
+    # 已存在的空文件不会按 os.open 的权限创建，再设置一次
+    os.chmod(path, stat.S_IRUSR | stat.S_IWUSR)
+    return token
+
+
+def is_loopback(host):
+    """地址是否为本机回环地址"""
+    if host == 'localhost':
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+class _Client:
+    """一个客户端连接"""
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.subscribed = False
+        self.events = asyncio.Queue(MAX_PENDING_EVENTS)
+
+    def send(self, message):
+        self.writer.write(json.dumps(message, ensure_ascii=False).encode('utf-8') + b'\n')
+
+    def push_event(self, event):
+        """放入待发送事件，积压过多时丢弃最旧的事件"""
+        if self.events.full():
+            self.events.get_nowait()
+        self.events.put_nowait(event)
+
+
+class ControlServer:
+    """本机控制服务
+
+    所有网络处理都在一个 asyncio 事件循环中进行；引擎在自己的工作线程中播放，
+    引擎事件通过 call_soon_threadsafe 转发到事件循环
+    """
+
+    def __init__(self, engine, host=DEFAULT_HOST, port=DEFAULT_PORT, unix_path=DEFAULT_UNIX_PATH, token=None,
+                 load_handler=None):
+        """unix_path 为 None 时监听 TCP；token 为空时使用 utils.control_server_token，再为空时使用令牌文件
+
+        load_handler(序列名) 返回结果为 (成功, 消息) 的 concurrent.futures.Future，用于界面程序：load 命令交给界面线程执行，
+        界面同时刷新操作列表；为 None 时（无界面运行）在线程池中直接调用 sequence.load_sequence
+
+        Raises:
+            ValueError: 监听非回环地址但没有明确设置令牌
+        """
+        token = token or utils.control_server_token
+        if not unix_path and not is_loopback(host) and not token:
+            raise ValueError(f'监听非回环地址 {host} 时必须设置令牌（utils.control_server_token 或 --token）')
+        self.engine = engine
+        self.host = host
+        self.port = port
+        self.unix_path = unix_path
+        self.token = token or load_token()
+        self.load_handler = load_handler
+        self._clients = set()
+        self._loop = None
+        self._queue = None
+        self._idle = None
+        self._server = None
+        self._owner_task = None
+        self._waiting = None  # 已取出、正在等待引擎空闲的命令
+
+    async def start(self):
+        """开始监听并启动命令执行协程"""
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        self._idle = asyncio.Event()
+        if self.engine.is_idle:
+            self._idle.set()
+        self.engine.add_listener(self._on_engine_event)
+        if self.unix_path:
+            # 删除上次异常退出留下的套接字文件
+            if os.path.exists(self.unix_path) and stat.S_ISSOCK(os.stat(self.unix_path).st_mode):
+                os.remove(self.unix_path)
+            old_umask = os.umask(0o177)
+            try:
+                self._server = await asyncio.start_unix_server(self._handle_client, path=self.unix_path)
+            finally:
+                os.umask(old_umask)
+            os.chmod(self.unix_path, stat.S_IRUSR | stat.S_IWUSR)
+            utils.logger.info("控制服务已启动: %s", self.unix_path)
+        else:
+            self._server = await asyncio.start_server(self._handle_client, self.host, self.port)
+            self.port = self._server.sockets[0].getsockname()[1]
+            utils.logger.info("控制服务已启动: %s:%s", self.host, self.port)
+        self._owner_task = asyncio.ensure_future(self._run_queue())
+
+    async def serve_forever(self):
+        """启动并一直运行"""
+        await self.start()
+        try:
+            await self._server.serve_forever()
+        finally:
+            self.engine.remove_listener(self._on_engine_event)
+
+    # 引擎事件（在引擎的线程中调用）
+    def _on_engine_event(self, event, fields):
+        message = dict(fields, event=event)
+        self._loop.call_soon_threadsafe(self._broadcast, message)
+
+    def _broadcast(self, message):
+        """在事件循环中分发事件"""
+        if message['event'] == 'state':
+            if message['state'] == STATE_IDLE:
+                self._idle.set()
+            else:
+                self._idle.clear()
+        for client in self._clients:
+            if client.subscribed:
+                client.push_event(message)
+
+    async def _handle_client(self, reader, writer):
+        client = _Client(writer)
+        self._clients.add(client)
+        sender = asyncio.ensure_future(self._send_events(client))
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if line.strip():
+                    keep = await self._handle_line(client, line)
+                    await writer.drain()
+                    if not keep:
+                        break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._clients.discard(client)
+            sender.cancel()
+            writer.close()
+
+    async def _send_events(self, client):
+        """把订阅的事件发送给客户端"""
+        while True:
+            event = await client.events.get()
+            client.send(event)
+            await client.writer.drain()
+
+    async def _handle_line(self, client, line):
+        """处理一行请求，返回是否保持连接（无法解析或令牌不对时断开）"""
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError('请求必须是 JSON 对象')
+        except ValueError as e:
+            client.send({'id': None, 'ok': False, 'error': f'无法解析请求: {e}'})
+            return False
+        request_id = request.get('id')
+        token = request.get('token')
+        if not isinstance(token, str) or not hmac.compare_digest(token.encode('utf-8'), self.token.encode('utf-8')):
+            utils.logger.warning("控制服务拒绝了令牌无效的请求")
+            client.send({'id': request_id, 'ok': False, 'error': '令牌无效'})
+            return False
+        command = request.get('command')
+        if command in QUEUED_COMMANDS:
+            # 排队执行，完成后再回复；客户端可以继续发送其他命令（如 stop）
+            done = self._loop.create_future()
+            await self._queue.put((request, done))
+            self._broadcast({'event': 'command', 'id': request_id, 'command': command,
+                             'status': 'queued', 'position': self._queue.qsize()})
+            asyncio.ensure_future(self._reply_when_done(client, request_id, done))
+            return True
+        try:
+            if command not in IMMEDIATE_COMMANDS:
+                raise CommandError(f'未知命令: {command!r}')
+            result = getattr(self, f'_command_{command}')(client, request)
+            client.send({'id': request_id, 'ok': True, 'result': result})
+        except CommandError as e:
+            client.send({'id': request_id, 'ok': False, 'error': str(e)})
+        return True
+
+    async def _reply_when_done(self, client, request_id, done):
+        try:
+            result = await done
+            client.send({'id': request_id, 'ok': True, 'result': result})
+        except CommandError as e:
+            client.send({'id': request_id, 'ok': False, 'error': str(e)})
+        except Exception as e:
+            utils.logger.error("控制命令执行失败: %s", e)
+            client.send({'id': request_id, 'ok': False, 'error': str(e)})
+        try:
+            await client.writer.drain()
+        except ConnectionError:
+            pass
+
+    async def _run_queue(self):
+        """唯一的命令执行协程：按顺序执行排队的命令，播放结束后才执行下一个"""
+        while True:
+            request, done = await self._queue.get()
+            # 等待引擎空闲（如界面启动的播放）后再执行，等待期间 stop 可以取消它
+            self._waiting = done
+            await self._idle.wait()
+            self._waiting = None
+            if done.done():
+                continue
+            command = request['command']
+            self._broadcast({'event': 'command', 'id': request.get('id'), 'command': command, 'status': 'started'})
+            try:
+                result = await getattr(self, f'_queued_{command}')(request)
+                done.set_result(result)
+            except Exception as e:
+                done.set_exception(e)
+                continue
+            if command == 'play':
+                # 播放期间不执行下一个命令
+                await self._idle.wait()
+                self._broadcast({'event': 'command', 'id': request.get('id'), 'command': command,
+                                 'status': 'finished', 'loop_count': self.engine.loop_count})
+
+    # 排队执行的命令
+    async def _queued_load(self, request):
+        name = request.get('sequence')
+        if not name:
+            raise CommandError('缺少 sequence 参数')
+        if self.load_handler is not None:
+            success, message = await asyncio.wrap_future(self.load_handler(name))
+        else:
+            success, message = await self._loop.run_in_executor(None, sequence.load_sequence, name, self.engine)
+        if not success:
+            raise CommandError(message)
+        return {'sequence': name, 'operations': len(self.engine.recorded_operations)}
+
+    async def _queued_play(self, request):
+        name = request.get('sequence')
+        try:
+            loops = int(request.get('loops', 1))
+            speed = float(request.get('speed', utils.playback_speed))
+        except (TypeError, ValueError):
+            raise CommandError('loops 必须是整数，speed 必须是数字')
+        if loops < 1 or speed <= 0:
+            raise CommandError('loops 至少为1，speed 必须大于0')
+        if not name and not self.engine.recorded_operations:
+            raise CommandError('没有可播放的操作序列')
+        item = playlist.make_item(name or self.engine.current_sequence, loops, speed)
+        # 在线程池中加载和编译，不阻塞事件循环
+        try:
+            if name:
+                compiled = await self._loop.run_in_executor(None, player.compile_playlist, [item])
+            else:
+                operations = list(self.engine.recorded_operations)
+                prepared = await self._loop.run_in_executor(None, player.prepare_plan, operations, speed,
+                                                            dict(self.engine.sequence_meta))
+                compiled = [(item,) + prepared]
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.engine.loop_count = 0
+        self._idle.clear()
+        if not self.engine.start(STATE_PLAYING, player.play_playlist, compiled):
+            if self.engine.is_idle:
+                self._idle.set()
+            raise CommandError('引擎正忙')
+        return {'started': True, 'sequence': item['sequence'], 'loops': loops, 'speed': speed}
+
+    # 立即执行的命令
+    def _command_list(self, client, request):
+        names = set(utils.sequences)
+        if os.path.isdir(utils.sequences_dir):
+            names.update(filename[:-5] for filename in os.listdir(utils.sequences_dir) if filename.endswith('.json'))
+        return {'sequences': sorted(names)}
+
+    def _command_status(self, client, request):
+        engine = self.engine
+        return {
+            'state': engine.state,
+            'current_sequence': engine.current_sequence,
+            'operations': len(engine.recorded_operations),
+            'loop_count': engine.loop_count,
+            'playlist_status': engine.playlist_status,
+            'queued': self._queue.qsize()
+        }
+
+    def _command_stop(self, client, request):
+        # 停止当前播放，并取消所有排队的命令
+        pending = []
+        while not self._queue.empty():
+            pending.append(self._queue.get_nowait()[1])
+        if self._waiting is not None:
+            pending.append(self._waiting)
+        cancelled = 0
+        for done in pending:
+            if not done.done():
+                done.set_exception(CommandError('已被 stop 取消'))
+                cancelled += 1
+        return {'stopped': self.engine.request_stop(), 'cancelled': cancelled}
+
+    def _command_pause(self, client, request):
+        return {'paused': self.engine.pause()}
+
+    def _command_resume(self, client, request):
+        return {'resumed': self.engine.resume()}
+
+    def _command_subscribe(self, client, request):
+        client.subscribed = bool(request.get('enabled', True))
+        return {'subscribed': client.subscribed}
+
+    def _command_metrics(self, client, request):
+        # format 为 'prometheus' 时返回 Prometheus 文本，否则返回 JSON 快照
+        if request.get('format') == 'prometheus':
+            return {'enabled': metrics.enabled, 'text': metrics.prometheus_text()}
+        return {'enabled': metrics.enabled, 'metrics': metrics.snapshot()}
+
+
+def start_in_thread(engine, host=DEFAULT_HOST, port=DEFAULT_PORT, unix_path=DEFAULT_UNIX_PATH, token=None,
+                    load_handler=None):
+    """在后台守护线程中运行控制服务（界面程序使用），返回 ControlServer（load_handler 见 ControlServer）"""
+    server = ControlServer(engine, host, port, unix_path, token, load_handler)
+
+    def run():
+        try:
+            asyncio.run(server.serve_forever())
+        except Exception as e:
+            utils.logger.error("控制服务异常退出: %s", e)
+
+    thread = threading.Thread(target=run)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def send_command(request, host=DEFAULT_HOST, port=DEFAULT_PORT, unix_path=DEFAULT_UNIX_PATH, follow=False,
+                 out=sys.stdout, token=None):
+    """发送一条命令并输出响应（命令行客户端），follow 为 True 时订阅并持续输出事件
+
+    token 为空时使用 utils.control_server_token，再为空时读取令牌文件
+    """
+    token = token or utils.control_server_token or load_token(create=False)
+    if not token:
+        out.write(f'没有找到令牌文件 {TOKEN_FILE}，请先启动控制服务或用 --token 指定令牌\n')
+        return 1
+    request = dict(request, token=token)
+    if unix_path:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(unix_path)
+    else:
+        sock = socket.create_connection((host, port))
+    with sock, sock.makefile('rwb') as stream:
+        if follow:
+            stream.write(json.dumps({'id': 0, 'token': token, 'command': 'subscribe'}).encode('utf-8') + b'\n')
+        stream.write(json.dumps(request, ensure_ascii=False).encode('utf-8') + b'\n')
+        stream.flush()
+        for line in stream:
+            message = json.loads(line)
+            if message.get('id') == 0 and 'event' not in message:
+                continue
+            out.write(json.dumps(message, ensure_ascii=False) + '\n')
+            out.flush()
+            if not follow and 'event' not in message:
+                return 0 if message.get('ok') else 1
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='本机控制服务')
+    parser.add_argument('--unix', default=DEFAULT_UNIX_PATH, help=f'Unix 套接字路径，默认 {DEFAULT_UNIX_PATH}')
+    parser.add_argument('--tcp', action='store_true', help='改为监听 TCP（指定 --host 或 --port 时也使用 TCP）')
+    parser.add_argument('--host', default=None, help=f'监听地址，默认 {DEFAULT_HOST}；非回环地址必须设置令牌')
+    parser.add_argument('--port', type=int, default=None, help=f'监听端口，默认 {DEFAULT_PORT}')
+    parser.add_argument('--token', default=None, help=f'令牌，默认使用 utils.control_server_token 或令牌文件 {TOKEN_FILE}')
+    parser.add_argument('--send', default=None, help='作为客户端发送一条 JSON 命令')
+    parser.add_argument('--follow', action='store_true', help='发送命令后持续输出事件')
+    parser.add_argument('--profile', action='store_true', help='每次播放时进行采样性能分析（结果写入 logs/profiles）')
+    args = parser.parse_args(argv)
+    host = args.host or DEFAULT_HOST
+    port = args.port or DEFAULT_PORT
+    unix_path = None if args.tcp or args.host or args.port else args.unix
+
+    if args.send:
+        return send_command(json.loads(args.send), host, port, unix_path, args.follow, token=args.token)
+
+    # 无界面运行：使用独立的引擎
+    utils.init_utils()
+    sequence.load_all_sequences()
+    engine = AutomationEngine()
+    engine.profile = args.profile
+    try:
+        server = ControlServer(engine, host, port, unix_path, args.token)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 1
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,329 @@
+# 录制/播放引擎
+# 功能：持有录制和播放的全部运行状态（当前状态、操作序列、循环计数、修饰键状态、统计等），
+#      状态转换都在锁内完成，同一个引擎同时只能进行一个录制或播放；不同的引擎实例之间互不影响，
+#      可以在同一进程中创建多个引擎（如测试或无界面运行）；
+#      播放中的等待都通过引擎进行，停止和暂停会立即唤醒正在等待的播放线程
+#
+# 用法：python engine.py  测量停止播放的响应延迟
+import threading
+import time
+
+import utils
+import profiler
+from capture_queue import SpscRingBuffer
+
+# 引擎状态
+STATE_IDLE = 'idle'            # 空闲
+STATE_RECORDING = 'recording'  # 正在录制
+STATE_PLAYING = 'playing'      # 正在播放
+STATE_PAUSED = 'paused'        # 播放已暂停
+STATE_STOPPING = 'stopping'    # 已请求停止，工作线程正在收尾
+
+# 允许的状态转换：当前状态 -> 可以转换到的状态
+TRANSITIONS = {
+    STATE_IDLE: (STATE_RECORDING, STATE_PLAYING),
+    STATE_RECORDING: (STATE_STOPPING, STATE_IDLE),
+    STATE_PLAYING: (STATE_PAUSED, STATE_STOPPING, STATE_IDLE),
+    STATE_PAUSED: (STATE_PLAYING, STATE_STOPPING, STATE_IDLE),
+    STATE_STOPPING: (STATE_IDLE,),
+}
+
+# 等待的最后一段用 time.sleep 精确休眠，之前的部分在可中断的 Event 上等待。
+# Event.wait 的超时精度受系统计时器粒度限制（Windows 默认约15.6毫秒），提前这么久醒来再精确休眠；
+# 这一段不可中断，因此停止的响应延迟不超过它
+PRECISE_SLEEP_MARGIN = 0.016
+
+# 停止响应延迟的目标（秒）
+STOP_LATENCY_BUDGET = 0.02
+
+# 修饰键名称
+MODIFIER_NAMES = ('ctrl', 'shift', 'alt', 'win')
+
+
+class AutomationEngine:
+    """录制/播放引擎
+
+    - 状态只能通过 start / request_stop / pause / resume / finish 按 TRANSITIONS 转换，转换在锁内完成
+    - start 在引擎空闲时原子地进入录制或播放状态并启动工作线程，引擎忙时返回 False，不会同时开始两个播放
+    - 其他字段只由当前的工作线程写入，界面线程只读取用于显示；工作线程结束后才允许开始新的录制或播放
+    - 播放的计划时间使用 clock()：它不计入暂停的时间，恢复后剩余的等待时间保持不变
+    - wait_until 在停止或暂停时立即被唤醒：停止时返回 False，暂停时阻塞到恢复后继续等待；
+      暂停和恢复时在播放线程中调用 on_pause / on_resume（如释放和恢复按下的按键）
+    """
+
+    def __init__(self, on_playback_completed=None, on_recording_stopped=None):
+        """
+        Args:
+            on_playback_completed: 播放结束时在工作线程中调用的函数（如发送界面信号）
+            on_recording_stopped: 录制结束时在工作线程中调用的函数
+        """
+        self._lock = threading.RLock()
+        self._changed = threading.Condition(self._lock)  # 状态变化时通知（暂停中的等待用它等待恢复）
+        self._interrupt = threading.Event()              # 请求停止或暂停时置位，唤醒正在等待的播放线程
+        self._state = STATE_IDLE
+        self._worker = None
+        self._paused_total = 0.0   # 本次播放累计暂停的时间（秒）
+        self._paused_at = None     # 当前暂停开始的 perf_counter 读数，未暂停时为 None
+        self.on_playback_completed = on_playback_completed
+        self.on_recording_stopped = on_recording_stopped
+        self.on_pause = None       # 播放线程进入暂停时调用的函数（由播放器设置）
+        self.on_resume = None      # 播放线程从暂停恢复时调用的函数（由播放器设置）
+        self._listeners = []       # 事件监听函数，见 add_listener
+        self._profiler = None      # 本次录制/播放的采样性能分析器
+        self.profile = False       # 录制和播放时是否进行采样性能分析（结果写入 logs/profiles）
+
+        # 操作序列
+        self.recorded_operations = []   # 当前操作序列
+        self.sequence_meta = {}         # 当前操作序列的元数据（录制开始墙上时间、时间单位等）
+        self.current_sequence = ''      # 当前选中的序列名称
+
+        # 录制状态
+        self.recording_start_time = 0       # 录制开始时间（time.perf_counter_ns() 读数，纳秒）
+        self.recording_start_wall_time = 0  # 录制开始的墙上时间（time.time()）
+        self.modifier_keys = dict.fromkeys(MODIFIER_NAMES, False)  # 录制时的修饰键状态
+        # 采集队列：每个 pynput 监听线程独占一个，保证单生产者
+        self.mouse_queue = SpscRingBuffer(utils.capture_queue_capacity)
+        self.keyboard_queue = SpscRingBuffer(utils.capture_queue_capacity)
+        self.move_policy = None         # 当前录制使用的鼠标移动采样策略
+        self.anchor_frames = None       # 点击前画面的持续截取（utils.anchor_clicks 开启时由录制器设置）
+        self.capture_stats = {}         # 最近一次录制的采集统计
+
+        # 播放状态
+        self.is_looping = False         # 是否启用循环播放
+        self.max_loop_count = 1         # 循环播放次数
+        self.loop_count = 0             # 当前循环次数
+        self.playlist_status = ''       # 正在播放的播放列表项说明，不在播放列表中时为空
+        self.playback_batch_stats = {}  # 最近一次播放的批次计时统计
+        self.playback_idle_saved_seconds = 0.0  # 最近一次播放中空闲间隔压缩每轮节省的时间（秒）
+        self.held_inputs = None         # 播放中按下未释放的按键和鼠标按钮（由播放器设置）
+        self.trace = None               # 播放跟踪（utils.playback_trace 或 utils.session_trace 开启时由播放器设置，见 log_utils.BinaryTrace）
+
+    @property
+    def state(self):
+        """当前状态"""
+        return self._state
+
+    @property
+    def is_recording(self):
+        return self._state == STATE_RECORDING
+
+    @property
+    def is_playing(self):
+        """是否正在播放（暂停中仍算正在播放）"""
+        return self._state in (STATE_PLAYING, STATE_PAUSED)
+
+    @property
+    def is_paused(self):
+        return self._state == STATE_PAUSED
+
+    @property
+    def is_idle(self):
+        return self._state == STATE_IDLE
+
+    def add_listener(self, listener):
+        """添加事件监听函数 listener(event, fields)
+
+        事件在状态转换或播放进度变化的线程中同步调用，监听函数应尽快返回（如转发到自己的事件循环）。
+        状态转换事件为 ('state', {'state': 新状态})，播放进度事件为 ('progress', {...})
+        """
+        with self._lock:
+            self._listeners = self._listeners + [listener]
+
+    def remove_listener(self, listener):
+        """移除事件监听函数"""
+        with self._lock:
+            self._listeners = [item for item in self._listeners if item is not listener]
+
+    def notify(self, event, **fields):
+        """通知所有监听函数，监听函数的异常只记录日志"""
+        for listener in self._listeners:
+            try:
+                listener(event, fields)
+            except Exception as e:
+                utils.logger.error("引擎事件监听函数出错: %s", e)
+
+    def _transition(self, target):
+        """在锁内转换状态，不允许的转换返回 False"""
+        with self._lock:
+            if target not in TRANSITIONS[self._state]:
+                return False
+            self._state = target
+            if target == STATE_PLAYING or target == STATE_RECORDING:
+                self._interrupt.clear()
+            else:
+                self._interrupt.set()
+            self._changed.notify_all()
+        self.notify('state', state=target)
+        return True
+
+    def start(self, state, target, *args):
+        """进入录制或播放状态，并在新的守护线程中运行 target(self, *args)
+
+        Args:
+            state: STATE_RECORDING 或 STATE_PLAYING
+            target: 工作函数，结束时必须调用 finish
+
+        Returns:
+            bool: 是否已开始（引擎不空闲时返回 False）
+        """
+        with self._lock:
+            if not self._transition(state):
+                return False
+            self._paused_total = 0.0
+            self._paused_at = None
+            if self.profile:
+                self._profiler = profiler.SamplingProfiler(kind='recording' if state == STATE_RECORDING else 'playback')
+                self._profiler.start()
+            self._worker = threading.Thread(target=target, args=(self,) + args)
+            self._worker.daemon = True
+            self._worker.start()
+            return True
+
+    def request_stop(self):
+        """请求停止正在进行的录制或播放，返回是否有需要停止的工作"""
+        return self._transition(STATE_STOPPING)
+
+    def pause(self):
+        """暂停播放，返回是否已暂停"""
+        with self._lock:
+            if self._state != STATE_PLAYING or not self._transition(STATE_PAUSED):
+                return False
+            self._paused_at = time.perf_counter()
+            return True
+
+    def resume(self):
+        """恢复暂停的播放，暂停的时间不计入播放时钟，返回是否已恢复"""
+        with self._lock:
+            if self._state != STATE_PAUSED:
+                return False
+            self._paused_total += time.perf_counter() - self._paused_at
+            self._paused_at = None
+            return self._transition(STATE_PLAYING)
+
+    def toggle_pause(self):
+        """暂停或恢复播放，返回操作后是否处于暂停状态"""
+        with self._lock:
+            if self._state == STATE_PAUSED:
+                self.resume()
+            else:
+                self.pause()
+            return self._state == STATE_PAUSED
+
+    def finish(self):
+        """工作线程结束时回到空闲状态"""
+        with self._lock:
+            self._transition(STATE_IDLE)
+            self._worker = None
+            session_profiler, self._profiler = self._profiler, None
+        if session_profiler is not None:
+            self._write_profile(session_profiler)
+
+    def _write_profile(self, session_profiler):
+        """停止采样并写入性能分析文件"""
+        session_profiler.stop()
+        try:
+            sequence_name = self.current_sequence if session_profiler.kind == 'playback' else ''
+            path = profiler.profile_path(session_profiler.kind, sequence_name)
+            session_profiler.write(path)
+        except OSError as e:
+            utils.logger.error("写入性能分析文件失败: %s", e)
+            return
+        utils.logger.info("性能分析：%d 轮采样，%.1f秒，已写入 %s",
+                          session_profiler.sample_count, session_profiler.duration, path)
+
+    def clock(self):
+        """播放时钟（秒）：perf_counter 减去累计暂停的时间，暂停期间停止走动"""
+        with self._lock:
+            now = self._paused_at if self._paused_at is not None else time.perf_counter()
+            return now - self._paused_total
+
+    def wait_until(self, deadline):
+        """等待到播放时钟的截止时间
+
+        停止时立即返回；暂停时阻塞到恢复，恢复后按剩余时间继续等待。
+
+        Returns:
+            bool: 到达截止时间返回 True，被停止返回 False
+        """
+        while True:
+            state = self._state
+            if state == STATE_PAUSED:
+                if self.on_pause is not None:
+                    self.on_pause()
+                with self._lock:
+                    while self._state == STATE_PAUSED:
+                        self._changed.wait()
+                if self._state == STATE_PLAYING and self.on_resume is not None:
+                    self.on_resume()
+                continue
+            if state != STATE_PLAYING and state != STATE_RECORDING:
+                return False
+            remaining = deadline - self.clock()
+            if remaining <= 0:
+                return True
+            if remaining > PRECISE_SLEEP_MARGIN:
+                self._interrupt.wait(remaining - PRECISE_SLEEP_MARGIN)
+            else:
+                time.sleep(remaining)
+
+    def sleep(self, seconds):
+        """按播放时钟休眠，返回值同 wait_until"""
+        return self.wait_until(self.clock() + seconds)
+
+    def join(self, timeout=None):
+        """等待当前工作线程结束，返回是否已结束"""
+        worker = self._worker
+        if worker is not None and worker is not threading.current_thread():
+            worker.join(timeout)
+            return not worker.is_alive()
+        return True
+
+    def reset_modifier_keys(self):
+        """重置录制时的修饰键状态"""
+        self.modifier_keys = dict.fromkeys(MODIFIER_NAMES, False)
+
+
+def measure_stop_latency(trials=20, wait_seconds=30.0, seed=0):
+    """测量停止播放的响应延迟
+
+    每次试验在一个独立引擎的工作线程中等待 wait_seconds（模拟操作之间很长的间隔），
+    随机等待一小段时间后请求停止，记录从请求停止到等待返回的时间。
+
+    Returns:
+        dict: 延迟（毫秒）的均值和最大值，以及是否全部在 STOP_LATENCY_BUDGET 之内
+    """
+    import random
+    rng = random.Random(seed)
+    latencies = []
+    for _ in range(trials):
+        returned = []
+
+        def worker(engine):
+            engine.sleep(wait_seconds)
+            returned.append(time.perf_counter())
+            engine.finish()
+
+        engine = AutomationEngine()
+        engine.start(STATE_PLAYING, worker)
+        time.sleep(rng.uniform(0.005, 0.05))
+        requested = time.perf_counter()
+        engine.request_stop()
+        engine.join(wait_seconds)
+        latencies.append((returned[0] - requested) * 1000)
+    return {
+        'trials': trials,
+        'mean_ms': sum(latencies) / len(latencies),
+        'max_ms': max(latencies),
+        'within_budget': max(latencies) < STOP_LATENCY_BUDGET * 1000
+    }
+
+
+# 界面使用的默认引擎，结束时通过 Qt 信号通知界面
+default_engine = AutomationEngine(utils.playback_signals.completed.emit, utils.recording_signals.stopped.emit)
+
+
+if __name__ == '__main__':
+    # 测量停止播放的响应延迟：python engine.py
+    result = measure_stop_latency()
+    print(f"停止响应延迟 {result['trials']} 次：平均 {result['mean_ms']:.2f}毫秒，最大 {result['max_ms']:.2f}毫秒"
+          f"（目标 {STOP_LATENCY_BUDGET * 1000:.0f}毫秒以内：{'通过' if result['within_budget'] else '未通过'}）")
@@ -0,0 +1,108 @@
+# 编辑历史
+# 功能：以结构化增量记录操作序列的编辑，支持撤销/重做，并按内存预算淘汰最早的记录
+import op_store
+
+# 内存估算（字节）
+OP_ENTRY_BYTES = 400        # 增量中保存的一个操作（字典及其字段）
+TIMESTAMP_ENTRY_BYTES = 64  # 时间戳补丁中的一对新旧整数（NumPy 数组约16字节，按整数列表保守估算）
+PATCH_BYTES = 200           # 一个字段补丁
+
+
+def estimate_delta_bytes(delta):
+    """估算一个增量占用的内存"""
+    kind = delta[0]
+    if kind in (op_store.DELTA_REMOVE, op_store.DELTA_INSERT):
+        return sum(len(ops) for _, ops in delta[1]) * OP_ENTRY_BYTES
+    if kind == op_store.DELTA_TIMESTAMPS:
+        return len(delta[2]) * TIMESTAMP_ENTRY_BYTES
+    return PATCH_BYTES
+
+
+class HistoryEntry:
+    """一次编辑：说明文字、增量列表，以及编辑前后的附加状态（如当前序列名称）"""
+
+    def __init__(self, label, deltas, state_before=None, state_after=None):
+        self.label = label
+        self.deltas = deltas
+        self.state_before = state_before
+        self.state_after = state_after
+        self.cost = sum(estimate_delta_bytes(delta) for delta in deltas)
+
+
+class EditHistory:
+    """撤销/重做历史
+
+    每条记录只保存增量（插入/删除的区段、时间戳补丁、字段补丁），不保存整个序列的快照。
+    撤销一次删除 k 个操作的编辑只需把这 k 个操作插回去。
+    撤销栈和重做栈的估算内存总和超过预算时，从最早的记录开始淘汰。
+    """
+
+    def __init__(self, memory_budget, max_entries=200):
+        self.memory_budget = memory_budget
+        self.max_entries = max_entries
+        self._undo = []
+        self._redo = []
+        self._cost = 0
+
+    @property
+    def memory_used(self):
+        """当前估算的内存占用（字节）"""
+        return self._cost
+
+    def can_undo(self):
+        """是否可以撤销"""
+        return bool(self._undo)
+
+    def can_redo(self):
+        """是否可以重做"""
+        return bool(self._redo)
+
+    def undo_label(self):
+        """下一次撤销的说明文字"""
+        return self._undo[-1].label if self._undo else ''
+
+    def redo_label(self):
+        """下一次重做的说明文字"""
+        return self._redo[-1].label if self._redo else ''
+
+    def clear(self):
+        """清空历史（操作序列被整体替换时调用）"""
+        self._undo = []
+        self._redo = []
+        self._cost = 0
+
+    def record(self, label, deltas, state_before=None, state_after=None):
+        """记录一次已经应用的编辑，同时清空重做栈"""
+        if not deltas:
+            return
+        for entry in self._redo:
+            self._cost -= entry.cost
+        self._redo = []
+        entry = HistoryEntry(label, deltas, state_before, state_after)
+        self._undo.append(entry)
+        self._cost += entry.cost
+        self._trim()
+
+    def undo(self, operations):
+        """撤销最近一次编辑，返回该记录（没有可撤销的编辑时返回 None）"""
+        if not self._undo:
+            return None
+        entry = self._undo.pop()
+        op_store.revert_deltas(operations, entry.deltas)
+        self._redo.append(entry)
+        return entry
+
+    def redo(self, operations):
+        """重做最近一次撤销的编辑，返回该记录（没有可重做的编辑时返回 None）"""
+        if not self._redo:
+            return None
+        entry = self._redo.pop()
+        op_store.apply_deltas(operations, entry.deltas)
+        self._undo.append(entry)
+        return entry
+
+    def _trim(self):
+        """按内存预算和条数上限淘汰最早的撤销记录"""
+        while self._undo and (self._cost > self.memory_budget or len(self._undo) > self.max_entries):
+            entry = self._undo.pop(0)
+            self._cost -= entry.cost
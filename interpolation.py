@@ -0,0 +1,137 @@
+# 鼠标移动插值
+# 功能：把稀疏的鼠标移动关键帧按目标刷新率展开为平滑路径，供播放时批量驱动指针
+
+# 插值模式
+INTERPOLATION_EXACT = 'exact'              # 不插值，只播放录制的关键帧
+INTERPOLATION_LINEAR = 'linear'            # 线性插值
+INTERPOLATION_CATMULL_ROM = 'catmull_rom'  # Catmull-Rom 样条，经过每个关键帧，限制在相邻关键帧之间不越界
+INTERPOLATION_BEZIER = 'bezier'            # 二次贝塞尔平滑，以中点为端点、关键帧为控制点，只保证首尾关键帧精确
+INTERPOLATION_MODES = (INTERPOLATION_EXACT, INTERPOLATION_LINEAR, INTERPOLATION_CATMULL_ROM, INTERPOLATION_BEZIER)
+
+
+def _lerp(a, b, u):
+    """线性插值"""
+    return a + (b - a) * u
+
+
+def _catmull_rom(p0, p1, p2, p3, u):
+    """均匀 Catmull-Rom 样条在 p1 到 p2 之间参数 u 处的值"""
+    u2 = u * u
+    u3 = u2 * u
+    return 0.5 * ((2 * p1) + (p2 - p0) * u + (2 * p0 - 5 * p1 + 4 * p2 - p3) * u2 + (3 * p1 - p0 - 3 * p2 + p3) * u3)
+
+
+def _clamp_between(value, a, b):
+    """把 value 限制在 a、b 之间（a、b 大小不限）"""
+    if a > b:
+        a, b = b, a
+    return min(max(value, a), b)
+
+
+def _quadratic_bezier(a, c, b, u):
+    """二次贝塞尔曲线在参数 u 处的值（a、b 为端点，c 为控制点）"""
+    v = 1 - u
+    return v * v * a + 2 * v * u * c + u * u * b
+
+
+def _bezier_pieces(keyframes):
+    """构造贝塞尔平滑的分段：每段为 (t0, t1, 起点, 控制点, 终点)
+
+    相邻关键帧的中点作为分段端点，关键帧本身作为控制点，首尾端点替换为首尾关键帧
+    """
+    n = len(keyframes)
+    mids = []
+    for i in range(n - 1):
+        t_a, x_a, y_a = keyframes[i]
+        t_b, x_b, y_b = keyframes[i + 1]
+        mids.append(((t_a + t_b) / 2, (x_a + x_b) / 2, (y_a + y_b) / 2))
+    mids[0] = keyframes[0]
+    mids[-1] = keyframes[-1]
+    pieces = []
+    for i in range(1, n - 1):
+        start, control, end = mids[i - 1], keyframes[i], mids[i]
+        pieces.append((start[0], end[0], start, control, end))
+    return pieces
+
+
+def sample_path(keyframes, mode=INTERPOLATION_LINEAR, rate_hz=120):
+    """把关键帧展开为按刷新率均匀分布的路径样本
+
+    Args:
+        keyframes: [(timestamp_us, x, y), ...]，时间戳非递减
+        mode: 插值模式，见 INTERPOLATION_MODES
+        rate_hz: 目标刷新率（次/秒）
+
+    Returns:
+        list: [(timestamp_us, x, y), ...]，坐标为整数像素，
+              相邻重复坐标已合并，最后一个样本与最后一个关键帧一致
+    """
+    if mode not in INTERPOLATION_MODES:
+        raise ValueError(f'未知的插值模式: {mode}')
+    n = len(keyframes)
+    if n == 0:
+        return []
+    if n == 1 or mode == INTERPOLATION_EXACT or rate_hz <= 0:
+        return _dedupe([(t, round(x), round(y)) for t, x, y in keyframes])
+    if mode == INTERPOLATION_BEZIER and n == 2:
+        mode = INTERPOLATION_LINEAR
+
+    step = 1000000 / rate_hz
+    t_start = keyframes[0][0]
+    t_end = keyframes[-1][0]
+    samples = [(t_start, round(keyframes[0][1]), round(keyframes[0][2]))]
+
+    if mode == INTERPOLATION_BEZIER:
+        pieces = _bezier_pieces(keyframes)
+        piece = 0
+        t = t_start + step
+        while t < t_end:
+            # 找到包含时间 t 的分段
+            while piece < len(pieces) - 1 and t > pieces[piece][1]:
+                piece += 1
+            t0, t1, a, c, b = pieces[piece]
+            u = (t - t0) / (t1 - t0) if t1 > t0 else 1.0
+            u = min(max(u, 0.0), 1.0)
+            samples.append((int(t), round(_quadratic_bezier(a[1], c[1], b[1], u)),
+                            round(_quadratic_bezier(a[2], c[2], b[2], u))))
+            t += step
+    else:
+        segment = 0
+        t = t_start + step
+        while t < t_end:
+            # 找到包含时间 t 的关键帧区间 [segment, segment + 1]
+            while segment < n - 2 and t > keyframes[segment + 1][0]:
+                segment += 1
+            t1, x1, y1 = keyframes[segment]
+            t2, x2, y2 = keyframes[segment + 1]
+            u = (t - t1) / (t2 - t1) if t2 > t1 else 1.0
+            if mode == INTERPOLATION_LINEAR:
+                x = _lerp(x1, x2, u)
+                y = _lerp(y1, y2, u)
+            else:
+                # 首尾区间用端点重复作为外侧控制点
+                _, x0, y0 = keyframes[segment - 1] if segment > 0 else keyframes[segment]
+                _, x3, y3 = keyframes[segment + 2] if segment + 2 < n else keyframes[segment + 1]
+                # 样条在拐角处会冲出两个关键帧的范围（可能到屏幕外或点到别的控件），
+                # 限制在本区间两端关键帧围成的矩形内
+                x = _clamp_between(_catmull_rom(x0, x1, x2, x3, u), x1, x2)
+                y = _clamp_between(_catmull_rom(y0, y1, y2, y3, u), y1, y2)
+            samples.append((int(t), round(x), round(y)))
+            t += step
+
+    samples.append((t_end, round(keyframes[-1][1]), round(keyframes[-1][2])))
+    return _dedupe(samples)
+
+
+def _dedupe(samples):
+    """合并相邻的重复坐标样本（保留最后一个样本）"""
+    result = []
+    for sample in samples:
+        if result and result[-1][1] == sample[1] and result[-1][2] == sample[2]:
+            continue
+        result.append(sample)
+    last = samples[-1]
+    if result[-1] is not last:
+        # 最后一个样本被合并掉时，用它的时间戳替换，保证路径在关键帧时间结束
+        result[-1] = last
+    return result
@@ -0,0 +1,328 @@
+# 日志工具
+# 功能：按大小或时间轮转的日志文件处理器、JSON 行格式的结构化日志，以及播放时逐操作事件的紧凑二进制跟踪文件
+#
+# 结构化日志每行一个 JSON 对象：{"time", "level", "logger", "file", "line", "thread", "msg", "args", "message"}，
+# 其中 msg 为 %-风格的消息模板，args 为参数，便于按模板统计和筛选。
+# 调用方应使用 logger.info('... %s', value) 的形式，消息只在确实要写出时才格式化
+#
+# 播放跟踪：播放中的每个事件（发送操作、鼠标移动路径、画面同步点、调用子序列）由 BinaryTrace 打包为一条
+# 固定长度的 TRACE_RECORD 记录，写入一个或多个输出：追加写入的跟踪文件（TraceFileSink，logs/playback.trace）和
+# 每次播放的会话跟踪环形缓冲（见 session_trace.py），两者共用同一种记录，每个事件只打包一次。
+# 跟踪文件：8字节文件头（TRACE_MAGIC、版本、保留），之后逐条追加记录；
+# 每次播放以一条 TRACE_START 记录开始，其序列时间字段为开始的墙上时间（微秒）
+#
+# 用法：python log_utils.py dump 跟踪文件 [--format text|jsonl]   把二进制跟踪文件转换为文本
+import argparse
+import json
+import logging
+import logging.handlers
+import os
+import struct
+import sys
+import time
+
+# 日志轮转方式
+ROTATION_SIZE = 'size'  # 按大小轮转
+ROTATION_TIME = 'time'  # 按时间轮转
+ROTATION_NONE = 'none'  # 不轮转
+
+# 二进制跟踪文件头：魔数、版本、保留
+TRACE_MAGIC = b'ATRC'
+TRACE_VERSION = 2
+TRACE_HEADER = struct.Struct('<4sHH')
+# 跟踪记录：(事件, 操作类型, 结果, 遍数, 序列编号, 操作序号, 序列时间, 计划时间, 发送时间, 返回时间, x, y)
+# 序列时间为操作的时间戳（微秒）；计划、发送、返回时间为引擎播放时钟（不计暂停）相对跟踪开始的微秒数；
+# 序列编号为 BinaryTrace.sequences 的下标，操作序号为操作在该序列中的下标（鼠标移动路径等为 -1）
+TRACE_RECORD = struct.Struct('<BBBxHHiqqqqii')
+
+# 跟踪事件
+TRACE_START = 0   # 一次播放开始，序列时间字段为墙上时间（微秒）
+TRACE_OP = 1      # 发送了一个操作，计划时间为所在批次的计划时间
+TRACE_PATH = 2    # 播放完一条鼠标移动路径，x 为样本数，计划/发送时间为首个样本的计划/实际时间
+TRACE_WAIT = 3    # 画面同步点结束，返回时间 - 发送时间为等待时间
+TRACE_CALL = 4    # 开始调用子序列
+TRACE_EVENT_NAMES = {TRACE_START: 'start', TRACE_OP: 'op', TRACE_PATH: 'path', TRACE_WAIT: 'wait', TRACE_CALL: 'call'}
+
+# 结果
+RESULT_OK = 0       # 已发送
+RESULT_ERROR = 1    # 发送时出错
+RESULT_TIMEOUT = 2  # 画面同步点超时
+RESULT_NAMES = {RESULT_OK: 'ok', RESULT_ERROR: 'error', RESULT_TIMEOUT: 'timeout'}
+
+# 操作类型编码
+OP_TYPE_CODES = {
+    'mousemove': 1,
+    'mousedown': 2,
+    'mouseup': 3,
+    'keydown': 4,
+    'keyup': 5,
+    'waitscreen': 6,
+    'call': 7,
+}
+OP_TYPE_NAMES = {code: name for name, code in OP_TYPE_CODES.items()}
+
+# 跟踪记录先写入内存缓冲，累计到这么多字节再写入文件
+TRACE_BUFFER_BYTES = 64 * 1024
+
+# 写入文件时保留的标准 LogRecord 属性之外的字段（通过 extra 传入）
+_STANDARD_RECORD_FIELDS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+def _json_value(value):
+    """把日志参数转换为 JSON 可表示的值"""
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, (list, tuple)):
+        return [_json_value(item) for item in value]
+    if isinstance(value, dict):
+        return {str(key): _json_value(item) for key, item in value.items()}
+    return str(value)
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """JSON 行格式：每条日志一行 JSON，保留消息模板和参数"""
+
+    def format(self, record):
+        data = {
+            'time': round(record.created, 6),
+            'level': record.levelname,
+            'logger': record.name,
+            'file': record.filename,
+            'line': record.lineno,
+            'thread': record.threadName,
+            'msg': str(record.msg),
+            'args': _json_value(record.args) if record.args else [],
+            'message': record.getMessage()
+        }
+        # extra 传入的字段原样保留
+        for key, value in vars(record).items():
+            if key not in _STANDARD_RECORD_FIELDS:
+                data[key] = _json_value(value)
+        if record.exc_info:
+            data['exc'] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False)
+
+
+def make_file_handler(path, rotation=ROTATION_SIZE, max_bytes=10 * 1024 * 1024, backup_count=5, when='midnight'):
+    """创建日志文件处理器
+
+    Args:
+        path: 日志文件路径
+        rotation: ROTATION_SIZE 按大小、ROTATION_TIME 按时间、ROTATION_NONE 不轮转
+        max_bytes: 按大小轮转时单个文件的最大字节数
+        backup_count: 保留的历史文件数，更早的文件被删除
+        when: 按时间轮转的周期（同 TimedRotatingFileHandler，如 'midnight'、'H'）
+    """
+    if rotation == ROTATION_SIZE:
+        return logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count,
+                                                    encoding='utf-8')
+    if rotation == ROTATION_TIME:
+        return logging.handlers.TimedRotatingFileHandler(path, when=when, backupCount=backup_count,
+                                                         encoding='utf-8')
+    return logging.FileHandler(path, encoding='utf-8')
+
+
+def rotate_file(path, backup_count):
+    """把 path 依次改名为 path.1、path.2 ...，超过 backup_count 的最旧文件被删除"""
+    if not os.path.exists(path):
+        return
+    if backup_count <= 0:
+        os.remove(path)
+        return
+    for index in range(backup_count - 1, 0, -1):
+        source = f'{path}.{index}'
+        if os.path.exists(source):
+            os.replace(source, f'{path}.{index + 1}')
+    os.replace(path, f'{path}.1')
+
+
+def _trace_file_version(path):
+    """跟踪文件的格式版本，不是跟踪文件时返回 None"""
+    with open(path, 'rb') as f:
+        header = f.read(TRACE_HEADER.size)
+    if len(header) < TRACE_HEADER.size:
+        return None
+    magic, version, _ = TRACE_HEADER.unpack(header)
+    return version if magic == TRACE_MAGIC else None
+
+
+class TraceFileSink:
+    """跟踪记录的追加输出：logs/playback.trace
+
+    每次打开时如果已有文件超过 max_bytes，先按 backup_count 轮转。记录先写入内存缓冲，累计到
+    TRACE_BUFFER_BYTES 或关闭时才写入文件
+    """
+
+    def __init__(self, path, max_bytes=16 * 1024 * 1024, backup_count=3):
+        if os.path.exists(path) and (os.path.getsize(path) >= max_bytes or _trace_file_version(path) != TRACE_VERSION):
+            # 超过大小或为旧版本格式（不能追加新格式的记录）时轮转
+            rotate_file(path, backup_count)
+        new_file = not os.path.exists(path)
+        self._file = open(path, 'ab')
+        self._buffer = bytearray()
+        if new_file:
+            self._buffer += TRACE_HEADER.pack(TRACE_MAGIC, TRACE_VERSION, 0)
+        self.path = path
+
+    def write(self, record):
+        self._buffer += record
+        if len(self._buffer) >= TRACE_BUFFER_BYTES:
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            self._file.write(self._buffer)
+            self._buffer.clear()
+        self._file.flush()
+
+    def close(self, trace):
+        self.flush()
+        self._file.close()
+
+
+class BinaryTrace:
+    """播放跟踪：由播放器在播放线程中写入，每个事件打包一条 TRACE_RECORD，依次交给各个输出
+
+    输出需提供 write(记录字节) 和 close(跟踪)。set_sequence 登记当前播放的序列，enter / leave 进出被调用的子序列，
+    记录中的序列编号和操作序号据此确定
+    """
+
+    def __init__(self, engine, sinks):
+        self.engine = engine
+        self.sinks = list(sinks)
+        self.record_count = 0
+        self.start_wall_time = time.time()
+        self.sequences = []      # [{'name', 'operations'}, ...]，operations 为登记的原操作列表
+        self._sequence_ids = {}  # 序列名 -> 编号
+        self._indexes = []       # 编号 -> {id(操作): 下标}
+        self._stack = []         # 当前的序列编号栈（调用子序列时压入）
+        self._origin = engine.clock()
+        self._write_record(TRACE_START, 0, int(self.start_wall_time * 1000000), self._origin, self._origin, self._origin)
+
+    def _register(self, name, operations, played=None):
+        sequence_id = self._sequence_ids.get(name)
+        if sequence_id is None:
+            sequence_id = len(self.sequences)
+            self._sequence_ids[name] = sequence_id
+            self.sequences.append({'name': name, 'operations': operations})
+            self._indexes.append({id(op): index for index, op in enumerate(operations if played is None else played)})
+        return sequence_id
+
+    def set_sequence(self, name, operations, played=None):
+        """设置当前播放的顶层序列
+
+        played 为实际播放的操作列表（如坐标换算到当前屏幕后的列表），与 operations 一一对应，默认与 operations 相同
+        """
+        self._stack = [self._register(name, operations, played)]
+
+    def enter(self, name, operations, played=None):
+        """开始播放被调用的子序列（参数同 set_sequence）"""
+        self._stack.append(self._register(name, operations, played))
+
+    def leave(self):
+        """被调用的子序列播放结束"""
+        if len(self._stack) > 1:
+            self._stack.pop()
+
+    def write(self, event, op, scheduled, dispatched, returned, result=RESULT_OK, x=0, y=0):
+        """写入一个操作的事件（时间为引擎播放时钟的秒数，坐标等超出范围时截断）"""
+        sequence_id = self._stack[-1] if self._stack else 0
+        index = self._indexes[sequence_id].get(id(op), -1) if self._indexes else -1
+        self._write_record(event, OP_TYPE_CODES.get(op['type'], 0), op.get('timestamp_us', 0),
+                           scheduled, dispatched, returned, result, index, x, y)
+
+    def write_path(self, sequence_us, samples, scheduled, dispatched, returned):
+        """写入一条鼠标移动路径（操作序号为 -1，x 为样本数）"""
+        self._write_record(TRACE_PATH, OP_TYPE_CODES['mousemove'], sequence_us, scheduled, dispatched, returned,
+                           x=samples)
+
+    def _write_record(self, event, op_type, sequence_us, scheduled, dispatched, returned, result=RESULT_OK,
+                      index=-1, x=0, y=0):
+        origin = self._origin
+        record = TRACE_RECORD.pack(event, op_type, result, min(self.engine.loop_count, 0xffff),
+                                   self._stack[-1] if self._stack else 0, index, int(sequence_us),
+                                   int((scheduled - origin) * 1000000), int((dispatched - origin) * 1000000),
+                                   int((returned - origin) * 1000000),
+                                   max(min(int(x), 0x7fffffff), -0x80000000), max(min(int(y), 0x7fffffff), -0x80000000))
+        for sink in self.sinks:
+            sink.write(record)
+        self.record_count += 1
+
+    @property
+    def duration_us(self):
+        """从跟踪开始到现在的播放时钟微秒数"""
+        return int((self.engine.clock() - self._origin) * 1000000)
+
+    def close(self):
+        """关闭所有输出（一个输出失败不影响其他输出，最后抛出第一个错误）"""
+        error = None
+        for sink in self.sinks:
+            try:
+                sink.close(self)
+            except OSError as e:
+                error = error or e
+        if error is not None:
+            raise error
+
+
+def unpack_record(fields):
+    """把 TRACE_RECORD 解包的元组转换为记录字典"""
+    event, op_type, result, loop, sequence_id, index, sequence_us, scheduled, dispatched, returned, x, y = fields
+    return {
+        'event': TRACE_EVENT_NAMES.get(event, str(event)),
+        'type': OP_TYPE_NAMES.get(op_type, ''),
+        'result': RESULT_NAMES.get(result, str(result)),
+        'loop': loop,
+        'sequence': sequence_id,
+        'index': index,
+        'sequence_us': sequence_us,
+        'scheduled_us': scheduled,
+        'dispatched_us': dispatched,
+        'returned_us': returned,
+        'x': x,
+        'y': y
+    }
+
+
+def read_trace(path):
+    """读取播放跟踪文件，逐条返回记录字典
+
+    Raises:
+        ValueError: 不是播放跟踪文件或版本不支持
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    if len(data) < TRACE_HEADER.size:
+        raise ValueError('文件太短，不是播放跟踪文件')
+    magic, version, _ = TRACE_HEADER.unpack_from(data, 0)
+    if magic != TRACE_MAGIC or version != TRACE_VERSION:
+        raise ValueError('不是播放跟踪文件或版本不支持')
+    # 最后一条记录可能因程序异常退出而不完整，忽略
+    for fields in TRACE_RECORD.iter_unpack(
+            data[TRACE_HEADER.size:len(data) - (len(data) - TRACE_HEADER.size) % TRACE_RECORD.size]):
+        yield unpack_record(fields)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='日志工具')
+    commands = parser.add_subparsers(dest='command', required=True)
+    dump = commands.add_parser('dump', help='把二进制播放跟踪文件转换为文本')
+    dump.add_argument('path')
+    dump.add_argument('--format', choices=('text', 'jsonl'), default='text')
+    args = parser.parse_args(argv)
+
+    for record in read_trace(args.path):
+        if args.format == 'jsonl':
+            print(json.dumps(record, ensure_ascii=False))
+        elif record['event'] == 'start':
+            wall_time = record['sequence_us'] / 1000000
+            print(f"--- 播放开始 {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(wall_time))}")
+        else:
+            print(f"{record['dispatched_us']:>12} {record['event']:<5} {record['type']:<10} 序列时间 {record['sequence_us']:>10} "
+                  f"延迟 {record['dispatched_us'] - record['scheduled_us']:>6} "
+                  f"耗时 {record['returned_us'] - record['dispatched_us']:>6} {record['result']:<7} ({record['x']}, {record['y']})")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
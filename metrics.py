@@ -0,0 +1,303 @@
+# 运行指标
+# 功能：录制和播放热路径上的计数器、仪表、直方图和计时区间，可导出为 Prometheus 文本格式或 JSON 快照
+#
+# 默认关闭（utils.metrics_enabled）。关闭时调用方在热路径上只检查一次 metrics.enabled，不读时钟也不更新指标；
+# span() 返回共用的空上下文管理器。指标在首次使用时注册，只使用标准库
+#
+# 用法：
+#   if metrics.enabled:
+#       metrics.PLAYBACK_LATENESS.observe(seconds)
+#   with metrics.span(metrics.SEQUENCE_LOAD_SECONDS):
+#       ...
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+
+# 是否记录指标（用 set_enabled 修改）
+enabled = False
+
+# 默认直方图区间上限（秒）：从10微秒到10秒
+DEFAULT_BUCKETS = (0.00001, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                   0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# 队列深度直方图区间上限（个）
+DEPTH_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 4096, 16384, 65536)
+
+# 名称 -> 指标（按注册顺序导出）
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def set_enabled(value):
+    """开启或关闭指标记录"""
+    global enabled
+    enabled = bool(value)
+
+
+class _Metric:
+    """指标基类：可带标签，labels(...) 返回对应标签值的子指标"""
+
+    kind = ''
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children = {}  # 标签值元组 -> 子指标（无标签时为 () -> 自身的值）
+        if not self.labelnames:
+            self._children[()] = self._new_value()
+
+    def _new_value(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        """返回标签值对应的子指标"""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f'指标 {self.name} 需要标签 {self.labelnames}')
+            with self._lock:
+                child = self._children.setdefault(values, self._new_value())
+        return child
+
+    def reset(self):
+        with self._lock:
+            for values in list(self._children):
+                self._children[values] = self._new_value()
+
+
+class _CounterValue:
+    __slots__ = ('value', '_lock')
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+
+class Counter(_Metric):
+    """只增不减的计数器"""
+
+    kind = 'counter'
+    _new_value = _CounterValue
+
+    def inc(self, amount=1):
+        self._children[()].inc(amount)
+
+
+class _GaugeValue:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+
+class Gauge(_Metric):
+    """当前值（如队列深度）"""
+
+    kind = 'gauge'
+    _new_value = _GaugeValue
+
+    def set(self, value):
+        self._children[()].set(value)
+
+
+class _HistogramValue:
+    __slots__ = ('buckets', 'counts', 'count', 'sum', 'max', '_lock')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # 最后一个为超出所有上限的观测
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+            if value > self.max:
+                self.max = value
+
+
+class Histogram(_Metric):
+    """分布直方图：按区间上限计数，并记录总数、总和和最大值"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help_text, labelnames)
+
+    def _new_value(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value):
+        self._children[()].observe(value)
+
+
+def _register(cls, name, help_text, *args, **kwargs):
+    with _registry_lock:
+        metric = _registry.get(name)
+        if metric is None:
+            metric = _registry[name] = cls(name, help_text, *args, **kwargs)
+        elif not isinstance(metric, cls):
+            raise ValueError(f'指标 {name} 已注册为 {metric.kind}')
+        return metric
+
+
+def counter(name, help_text, labelnames=()):
+    """注册（或取已注册的）计数器"""
+    return _register(Counter, name, help_text, labelnames)
+
+
+def gauge(name, help_text, labelnames=()):
+    """注册（或取已注册的）仪表"""
+    return _register(Gauge, name, help_text, labelnames)
+
+
+def histogram(name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+    """注册（或取已注册的）直方图"""
+    return _register(Histogram, name, help_text, labelnames, buckets)
+
+
+class _Span:
+    """计时区间：退出时把经过的秒数记入直方图"""
+
+    __slots__ = ('histogram', 'started')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started)
+        return False
+
+
+class _NullSpan:
+    """关闭指标时使用的空计时区间"""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def span(histogram):
+    """返回计时区间上下文管理器，关闭指标时返回空上下文管理器"""
+    if enabled:
+        return _Span(histogram)
+    return _NULL_SPAN
+
+
+def reset():
+    """清零所有指标"""
+    for metric in list(_registry.values()):
+        metric.reset()
+
+
+def snapshot():
+    """返回所有指标的 JSON 可序列化快照"""
+    result = {}
+    for metric in list(_registry.values()):
+        samples = []
+        for values, child in list(metric._children.items()):
+            sample = {'labels': dict(zip(metric.labelnames, values))}
+            if metric.kind == 'histogram':
+                sample.update(count=child.count, sum=child.sum, max=child.max,
+                              buckets=dict(zip([str(bound) for bound in metric.buckets] + ['+Inf'], child.counts)))
+            else:
+                sample['value'] = child.value
+            samples.append(sample)
+        result[metric.name] = {'type': metric.kind, 'help': metric.help, 'samples': samples}
+    return result
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [(name, str(value)) for name, value in zip(names, values)]
+    if extra is not None:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = ['{}="{}"'.format(name, value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+               for name, value in pairs]
+    return '{' + ','.join(escaped) + '}'
+
+
+def prometheus_text():
+    """返回 Prometheus 文本格式（0.0.4）的所有指标"""
+    lines = []
+    for metric in list(_registry.values()):
+        lines.append(f'# HELP {metric.name} {metric.help}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        for values, child in list(metric._children.items()):
+            if metric.kind != 'histogram':
+                lines.append(f'{metric.name}{_format_labels(metric.labelnames, values)} {child.value}')
+                continue
+            cumulative = 0
+            bounds = [repr(float(bound)) for bound in metric.buckets] + ['+Inf']
+            for bound, count in zip(bounds, child.counts):
+                cumulative += count
+                labels = _format_labels(metric.labelnames, values, ('le', bound))
+                lines.append(f'{metric.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(metric.labelnames, values)
+            lines.append(f'{metric.name}_sum{labels} {child.sum}')
+            lines.append(f'{metric.name}_count{labels} {child.count}')
+    return '\n'.join(lines) + '\n'
+
+
+def write_files(directory, basename='metrics'):
+    """把所有指标写入目录下的 metrics.prom 和 metrics.json（先写临时文件再替换）
+
+    metrics.prom 可以由 node_exporter 的文本文件收集器读取
+    """
+    for extension, content in (('prom', prometheus_text()),
+                               ('json', json.dumps(snapshot(), ensure_ascii=False, indent=2))):
+        path = os.path.join(directory, f'{basename}.{extension}')
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            f.write(content)
+        os.replace(path + '.tmp', path)
+
+
+# 录制
+RECORDER_CALLBACK_SECONDS = histogram('automation_recorder_callback_seconds',
+                                      '录制钩子回调的耗时（秒）', ('event',))
+CAPTURE_QUEUE_DEPTH = histogram('automation_capture_queue_depth',
+                                '录制线程每次取出时采集队列中的事件数', ('queue',), DEPTH_BUCKETS)
+CAPTURE_QUEUE_DROPPED = gauge('automation_capture_queue_dropped',
+                              '最近一次录制中因采集队列已满而丢弃的事件数', ('queue',))
+
+# 播放
+PLAYBACK_LATENESS_SECONDS = histogram('automation_playback_lateness_seconds',
+                                      '播放批次实际开始时间相对计划时间的延迟（秒）')
+PLAYBACK_BATCH_SECONDS = histogram('automation_playback_batch_seconds', '播放批次发送耗时（秒）')
+BACKEND_CALL_SECONDS = histogram('automation_backend_call_seconds',
+                                 '发送单个操作的输入后端调用耗时（秒）', ('type',))
+PLAYBACK_OPERATIONS = counter('automation_playback_operations_total', '播放发送的操作数', ('type',))
+PLAYBACK_PATH_SAMPLES = counter('automation_playback_path_samples_total', '播放发送的鼠标路径样本数')
+
+# 序列库
+SEQUENCE_LOAD_SECONDS = histogram('automation_sequence_load_seconds', '读取序列文件的耗时（秒）')
+SEQUENCE_SAVE_SECONDS = histogram('automation_sequence_save_seconds', '写入序列文件的耗时（秒）')
@@ -0,0 +1,318 @@
+# 操作序列批量编辑
+# 功能：对操作列表按区间批量删除、复制、移动，按区段原地切片删除和插入（不复制整个列表），
+#      并返回可逆的增量记录，用于撤销
+
+# 增量类型
+DELTA_REMOVE = 'remove'          # (DELTA_REMOVE, [(start, ops), ...])，start 为删除前列表中的下标，升序
+DELTA_INSERT = 'insert'          # (DELTA_INSERT, [(start, ops), ...])，start 为插入后列表中的下标，升序
+DELTA_TIMESTAMPS = 'timestamps'  # (DELTA_TIMESTAMPS, start, 旧时间戳列表, 新时间戳列表)
+DELTA_PATCH = 'patch'            # (DELTA_PATCH, index, 旧字段字典, 新字段字典)，值为 MISSING 表示该字段不存在
+
+# 区段数不超过该值时逐段切片删除/插入，更多时一次遍历重建列表尾部（逐段切片为 O(n·k)）
+SLICE_SEGMENT_LIMIT = 8
+
+# 字段补丁中表示字段不存在的标记
+MISSING = object()
+
+# 编辑版本号：每应用一个增量（编辑、撤销、重做、时间变换）加1，
+# 与 utils.sequences_version 一起用于使按序列缓存的播放计划和坐标换算失效
+edit_version = 0
+
+
+def indices_to_ranges(indices):
+    """把下标集合转换为升序、不重叠的半开区间列表 [(start, end), ...]"""
+    ranges = []
+    for index in sorted(set(indices)):
+        if ranges and ranges[-1][1] == index:
+            ranges[-1][1] = index + 1
+        else:
+            ranges.append([index, index + 1])
+    return [(start, end) for start, end in ranges]
+
+
+def copy_op(op):
+    """复制一个操作（字典浅拷贝，列表字段单独复制），比 copy.deepcopy 快得多"""
+    copied = dict(op)
+    if 'modifiers' in copied:
+        copied['modifiers'] = list(copied['modifiers'])
+    return copied
+
+
+def copy_operations(operations):
+    """复制操作列表（每个操作用 copy_op 复制），编辑副本不影响原列表"""
+    return [copy_op(op) for op in operations]
+
+
+def _gap_before(operations, index):
+    """返回操作与前一个操作之间的时间间隔（微秒），第一个操作为0"""
+    if index <= 0:
+        return 0
+    return operations[index]['timestamp_us'] - operations[index - 1]['timestamp_us']
+
+
+# 基本增量的应用
+def _apply_remove(operations, segments):
+    """删除若干区段（原地修改）
+
+    区段不多时从后向前逐段删除；区段很多（如隔一个删一个）时从第一个区段起一次遍历重建列表尾部，
+    只做一次切片赋值，总耗时 O(n)
+    """
+    if len(segments) <= SLICE_SEGMENT_LIMIT:
+        for start, ops in reversed(segments):
+            del operations[start:start + len(ops)]
+        return
+    first = segments[0][0]
+    tail = []
+    pos = first
+    for start, ops in segments:
+        tail.extend(operations[pos:start])
+        pos = start + len(ops)
+    tail.extend(operations[pos:])
+    operations[first:] = tail
+
+
+def _apply_insert(operations, segments):
+    """插入若干区段（原地修改，start 为插入后列表中的下标）
+
+    区段不多时按下标升序逐段插入；区段很多时从第一个区段起一次遍历重建列表尾部，总耗时 O(n)
+    """
+    if len(segments) <= SLICE_SEGMENT_LIMIT:
+        for start, ops in segments:
+            operations[start:start] = ops
+        return
+    first = segments[0][0]
+    tail = []
+    pos = first
+    for start, ops in segments:
+        # start 为插入后的下标，插入后的列表中 first + len(tail) 处对应原列表的 pos
+        take = start - first - len(tail)
+        tail.extend(operations[pos:pos + take])
+        pos += take
+        tail.extend(ops)
+    tail.extend(operations[pos:])
+    operations[first:] = tail
+
+
+def _apply_timestamps(operations, start, values):
+    """从 start 开始依次设置时间戳（values 可以是整数列表或 NumPy 数组）"""
+    if hasattr(values, 'tolist'):
+        # NumPy 数组先转换为 Python 整数，保证操作可以直接序列化为JSON
+        values = values.tolist()
+    for op, value in zip(operations[start:start + len(values)], values):
+        op['timestamp_us'] = value
+
+
+def _apply_patch(operations, index, fields):
+    """按字段补丁修改一个操作"""
+    op = operations[index]
+    for key, value in fields.items():
+        if value is MISSING:
+            op.pop(key, None)
+        else:
+            op[key] = value
+
+
+def apply_delta(operations, delta):
+    """应用一个增量"""
+    global edit_version
+    edit_version += 1
+    kind = delta[0]
+    if kind == DELTA_REMOVE:
+        _apply_remove(operations, delta[1])
+    elif kind == DELTA_INSERT:
+        _apply_insert(operations, delta[1])
+    elif kind == DELTA_TIMESTAMPS:
+        _apply_timestamps(operations, delta[1], delta[3])
+    elif kind == DELTA_PATCH:
+        _apply_patch(operations, delta[1], delta[3])
+    else:
+        raise ValueError(f'未知的增量类型: {kind}')
+
+
+def invert_delta(delta):
+    """返回增量的逆增量"""
+    kind = delta[0]
+    if kind == DELTA_REMOVE:
+        return (DELTA_INSERT, delta[1])
+    if kind == DELTA_INSERT:
+        return (DELTA_REMOVE, delta[1])
+    if kind == DELTA_TIMESTAMPS:
+        return (DELTA_TIMESTAMPS, delta[1], delta[3], delta[2])
+    if kind == DELTA_PATCH:
+        return (DELTA_PATCH, delta[1], delta[3], delta[2])
+    raise ValueError(f'未知的增量类型: {kind}')
+
+
+def apply_deltas(operations, deltas):
+    """按顺序应用一组增量（重做）"""
+    for delta in deltas:
+        apply_delta(operations, delta)
+
+
+def revert_deltas(operations, deltas):
+    """按相反顺序应用一组增量的逆增量（撤销）"""
+    for delta in reversed(deltas):
+        apply_delta(operations, invert_delta(delta))
+
+
+# 单个操作编辑
+def insert_operation(operations, index, op):
+    """在 index 处插入一个操作，返回增量列表"""
+    delta = (DELTA_INSERT, [(index, [op])])
+    apply_delta(operations, delta)
+    return [delta]
+
+
+def patch_operation(operations, index, new_op):
+    """把 operations[index] 的字段更新为 new_op 的字段，只记录发生变化的字段
+
+    Returns:
+        list: 增量列表，没有变化时为空
+    """
+    op = operations[index]
+    old_fields = {}
+    new_fields = {}
+    for key in set(op) | set(new_op):
+        old_value = op.get(key, MISSING)
+        new_value = new_op.get(key, MISSING)
+        if old_value is MISSING or new_value is MISSING or old_value != new_value:
+            old_fields[key] = old_value
+            new_fields[key] = new_value
+    if not new_fields:
+        return []
+    delta = (DELTA_PATCH, index, old_fields, new_fields)
+    apply_delta(operations, delta)
+    return [delta]
+
+
+# 批量编辑
+def delete_ranges(operations, ranges):
+    """删除若干区间内的操作
+
+    Args:
+        operations: 操作列表（原地修改）
+        ranges: 升序、不重叠的半开区间列表
+
+    Returns:
+        list: 本次编辑的增量列表
+    """
+    segments = [(start, operations[start:end]) for start, end in ranges if end > start]
+    if not segments:
+        return []
+    delta = (DELTA_REMOVE, segments)
+    apply_delta(operations, delta)
+    return [delta]
+
+
+def duplicate_ranges(operations, ranges, insert_at=None, time_shift_us=None):
+    """复制若干区间内的操作并插入到 insert_at 处
+
+    Args:
+        operations: 操作列表（原地修改）
+        ranges: 升序、不重叠的半开区间列表
+        insert_at: 插入位置，默认追加到末尾
+        time_shift_us: 副本时间戳的平移量（微秒）。为 None 时保持时间轴连续：
+            副本沿用原操作之间的时间间隔接在插入位置之后，插入位置之后的操作整体后移
+
+    Returns:
+        list: 本次编辑的增量列表
+    """
+    if insert_at is None:
+        insert_at = len(operations)
+    sources = [i for start, end in ranges for i in range(start, end)]
+    if not sources:
+        return []
+
+    deltas = []
+    copies = []
+    if time_shift_us is not None:
+        # 指定平移量：副本时间戳整体平移，不调整其他操作
+        for i in sources:
+            copied = copy_op(operations[i])
+            copied['timestamp_us'] += time_shift_us
+            copies.append(copied)
+    else:
+        # 保持时间轴连续：每个副本沿用原操作与其前一个操作的时间间隔
+        if insert_at > 0:
+            anchor = operations[insert_at - 1]['timestamp_us']
+        elif operations:
+            anchor = operations[0]['timestamp_us']
+        else:
+            anchor = 0
+        t = anchor
+        for n, i in enumerate(sources):
+            if n > 0 or insert_at > 0:
+                t += _gap_before(operations, i)
+            copied = copy_op(operations[i])
+            copied['timestamp_us'] = t
+            copies.append(copied)
+        # 插入位置之后的操作整体后移副本所占的时长
+        if insert_at < len(operations):
+            shift = t - anchor
+            if insert_at == 0:
+                shift += _gap_before(operations, sources[0])
+            old = [op['timestamp_us'] for op in operations[insert_at:]]
+            new = [value + shift for value in old]
+            deltas.append((DELTA_TIMESTAMPS, insert_at + len(copies), old, new))
+
+    insert = (DELTA_INSERT, [(insert_at, copies)])
+    apply_delta(operations, insert)
+    for delta in deltas:
+        apply_delta(operations, delta)
+    return [insert] + deltas
+
+
+def move_ranges(operations, ranges, dest):
+    """把若干区间内的操作移动到 dest 之前（dest 为移动前列表中的下标）
+
+    移动后按每个操作原有的前置时间间隔重新计算受影响区段的时间戳，
+    受影响区段的结束时间不变，之后的操作无需调整。
+
+    Returns:
+        list: 本次编辑的增量列表
+    """
+    ranges = [(start, end) for start, end in ranges if end > start]
+    if not ranges:
+        return []
+    for start, end in ranges:
+        if start < dest < end:
+            raise ValueError('目标位置不能位于被移动的区间内部')
+
+    span_start = min(ranges[0][0], dest)
+    span_end = max(ranges[-1][1], dest)
+    # 受影响区段内，被选中的和未被选中的操作（保持原顺序），以及各自的前置时间间隔
+    selected = []
+    remaining = []
+    insert_pos = 0
+    range_index = 0
+    for i in range(span_start, span_end):
+        while range_index < len(ranges) and ranges[range_index][1] <= i:
+            range_index += 1
+        entry = (operations[i], _gap_before(operations, i))
+        if range_index < len(ranges) and ranges[range_index][0] <= i:
+            selected.append(entry)
+        else:
+            remaining.append(entry)
+            if i < dest:
+                insert_pos += 1
+    new_span = remaining[:insert_pos] + selected + remaining[insert_pos:]
+    old_span = operations[span_start:span_end]
+    if [op for op, _ in new_span] == old_span:
+        return []
+
+    # 重新计算时间戳
+    t = operations[span_start - 1]['timestamp_us'] if span_start > 0 else operations[0]['timestamp_us']
+    old_ts = []
+    new_ts = []
+    for op, gap in new_span:
+        t += gap
+        old_ts.append(op['timestamp_us'])
+        new_ts.append(t)
+
+    deltas = [
+        (DELTA_REMOVE, [(span_start, old_span)]),
+        (DELTA_INSERT, [(span_start, [op for op, _ in new_span])]),
+        (DELTA_TIMESTAMPS, span_start, old_ts, new_ts)
+    ]
+    apply_deltas(operations, deltas)
+    return deltas
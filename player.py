@@ -1,4 +1,8 @@
-# 导入时间模块，用于处理延迟
+# 导入 os 模块，用于拼接播放跟踪文件路径
+import os
+# 导入线程模块，用于保护子序列播放计划缓存
+import threading
+# 导入时间模块，用于组合键各键之间的短暂延时
 import time
 # 导入 pyautogui 模块，用于执行鼠标和键盘操作
 import pyautogui
@@ -6,210 +10,849 @@ import pyautogui
 from pynput import keyboard
 # 导入工具模块，用于访问全局变量和信号
 import utils
+# 导入鼠标移动插值
+import interpolation
+# 导入画面同步
+import screen_sync
+# 导入图像锚定
+import template_match
+# 导入截图服务
+import screen_capture
+# 导入序列管理，用于播放列表加载序列
+import sequence
+# 导入运行指标
+import metrics
+# 导入播放跟踪文件
+import log_utils
+# 导入播放会话跟踪
+import session_trace
+# 导入屏幕配置，播放前把坐标换算到当前屏幕
+import screen_geometry
+# 导入录制/播放引擎
+from engine import default_engine
+
+# 每播放多少个路径样本检查一次 pyautogui 安全机制（鼠标移到屏幕角落）
+FAILSAFE_CHECK_INTERVAL = 8
+
+# 播放步骤类型
+STEP_PATH = 'path'    # 连续鼠标移动展开的插值路径，负载为 [(timestamp_us, x, y), ...]
+STEP_BATCH = 'batch'  # 计划时间落在同一个量子内的操作批次，负载为操作列表
+STEP_WAIT = 'wait'    # 等待画面匹配的同步点，负载为“等待画面”操作
+STEP_CALL = 'call'    # 调用子序列，负载为 (“调用序列”操作, 子序列的播放计划)
+
+# 播放时暂停/继续的热键
+PAUSE_RESUME_KEY = keyboard.Key.f9
+
+# 特殊键名映射：如'page_up' -> 'pageup'
+KEY_MAPPINGS = {
+    'page_up': 'pageup',
+    'page_down': 'pagedown'
+}
+
+
+def _raw_move_to(x, y):
+    """直接调用 pyautogui 平台后端移动指针
+
+    跳过 pyautogui.moveTo 每次调用都有的 PAUSE 休眠、坐标换算和安全检查，
+    由调用方按批次自行做安全检查
+    """
+    platform_module = getattr(pyautogui, 'platformModule', None)
+    if platform_module is not None and hasattr(platform_module, '_moveTo'):
+        platform_module._moveTo(x, y)
+    else:
+        pyautogui.moveTo(x, y, _pause=False)
+
+
+def find_move_run_end(operations, start):
+    """返回从 start 开始的连续鼠标移动操作的结束下标（不含）"""
+    end = start
+    while end < len(operations) and operations[end]['type'] == 'mousemove':
+        end += 1
+    return end
+
+
+def _pyautogui_key_name(base_key):
+    """将录制的基础键转换为 pyautogui 可识别的键名"""
+    # 处理基础键格式：将'Key.tab'转换为'tab'
+    if base_key.startswith('Key.'):
+        base_key = base_key[4:]
+    return KEY_MAPPINGS.get(base_key, base_key)
+
+
+def _pyautogui_modifier_name(mod):
+    """将修饰键统一转换为 pyautogui 可识别的格式"""
+    return 'win' if mod in ('win', 'cmd') else mod
+
+
+def compress_idle_gaps(operations, max_gap_us):
+    """计算压缩空闲间隔后的时间戳
+
+    相邻操作的间隔超过 max_gap_us 时按 max_gap_us 计，较短的间隔（如同一手势内的操作）保持不变。
+
+    Args:
+        operations: 操作列表
+        max_gap_us: 最大间隔（序列时间，微秒），0 或 None 表示不压缩
+
+    Returns:
+        tuple: (时间戳列表, 节省的序列时间微秒数)
+    """
+    timestamps = []
+    saved_us = 0
+    prev = None
+    t = 0
+    for op in operations:
+        timestamp = op['timestamp_us']
+        if prev is None:
+            t = timestamp
+        else:
+            gap = timestamp - prev
+            if max_gap_us and gap > max_gap_us:
+                saved_us += gap - max_gap_us
+                gap = max_gap_us
+            t += gap
+        timestamps.append(t)
+        prev = timestamp
+    return timestamps, saved_us
+
+
+# 编译播放计划
+# 功能：把操作序列转换为按计划时间排列的播放步骤，每次播放只编译一次
+def compile_plan(operations, quantum_us=None, timestamps=None, max_gap_us=0, calling=()):
+    """把操作序列编译为播放步骤列表
+
+    - 两个及以上连续的鼠标移动展开为一条插值路径（STEP_PATH）
+    - “等待画面”操作单独成为同步点（STEP_WAIT）
+    - “调用序列”操作通过子序列播放计划缓存取得子序列的计划（STEP_CALL），多处调用共用同一个计划
+    - 其余操作中，计划时间与批次首个操作相差不超过 quantum_us 的，合并为一个批次（STEP_BATCH），
+      批次内的操作背靠背发送，中间不休眠
+
+    Args:
+        operations: 操作列表
+        quantum_us: 批次量子（微秒），默认使用 utils.batch_quantum_us
+        timestamps: 各操作的计划时间（微秒），默认使用操作自身的时间戳
+        max_gap_us: 编译子序列时使用的空闲间隔上限（序列时间，微秒）
+        calling: 正在编译的调用链（序列名元组），用于检测循环调用
+
+    Returns:
+        list: [(start_us, 步骤类型, 负载), ...]，start_us 为序列时间（微秒）
+
+    Raises:
+        ValueError: 被调用的序列无法加载或存在循环调用
+    """
+    if quantum_us is None:
+        quantum_us = utils.batch_quantum_us
+    if timestamps is None:
+        timestamps = [op['timestamp_us'] for op in operations]
+    plan = []
+    batch = None
+    batch_start = 0
+    i = 0
+    while i < len(operations):
+        op = operations[i]
+        timestamp = timestamps[i]
+        if op['type'] == 'mousemove':
+            run_end = find_move_run_end(operations, i)
+            if run_end - i > 1:
+                keyframes = [(timestamps[k], operations[k]['x'], operations[k]['y']) for k in range(i, run_end)]
+                samples = interpolation.sample_path(keyframes, utils.interpolation_mode, utils.playback_refresh_hz)
+                plan.append((timestamp, STEP_PATH, samples))
+                batch = None
+                i = run_end
+                continue
+        if op['type'] == screen_sync.OP_WAIT_SCREEN:
+            plan.append((timestamp, STEP_WAIT, op))
+            batch = None
+            i += 1
+            continue
+        if op['type'] == sequence.OP_CALL:
+            plan.append((timestamp, STEP_CALL, (op, get_call_plan(op['sequence'], max_gap_us, calling))))
+            batch = None
+            i += 1
+            continue
+        if batch is not None and timestamp - batch_start <= quantum_us:
+            batch.append(op)
+        else:
+            batch = [op]
+            batch_start = timestamp
+            plan.append((timestamp, STEP_BATCH, batch))
+        i += 1
+    return plan
+
+
+# 子序列播放计划缓存：(序列名, 编译参数) -> 播放计划
+# 序列库发生变化（sequence.library_version() 改变：保存、删除、重命名、重新加载或原地编辑）时整体清空
+_call_plans = {}
+_call_plans_version = None
+_call_plans_lock = threading.RLock()
+# 缓存统计：命中次数和编译次数
+call_plan_stats = {'hits': 0, 'compiles': 0}
+
+
+def get_call_plan(name, max_gap_us=0, calling=()):
+    """取被调用序列的播放计划
+
+    按序列名、编译参数和屏幕配置缓存，同一进程中每个共用的子序列只加载和编译一次；子序列中的调用在编译时递归解析。
+    子序列的坐标按其保存的屏幕配置换算到当前屏幕。
+
+    Raises:
+        ValueError: 序列无法加载或存在循环调用
+    """
+    global _call_plans_version
+    if name in calling:
+        raise ValueError(f'序列循环调用: {" -> ".join(calling + (name,))}')
+    geometry = screen_geometry.current_geometry()
+    key = (name, max_gap_us, utils.interpolation_mode, utils.playback_refresh_hz, utils.batch_quantum_us,
+           utils.adapt_coordinates, screen_geometry.geometry_key(geometry))
+    with _call_plans_lock:
+        version = sequence.library_version()
+        if _call_plans_version != version:
+            _call_plans.clear()
+            _call_plans_version = version
+        plan = _call_plans.get(key)
+        if plan is not None:
+            call_plan_stats['hits'] += 1
+            return plan
+        try:
+            operations = screen_geometry.adapt_sequence(name, geometry)
+        except Exception as e:
+            raise ValueError(f'被调用的序列 "{name}" 无法加载: {e}')
+        timestamps, _ = compress_idle_gaps(operations, max_gap_us)
+        plan = compile_plan(operations, timestamps=timestamps, max_gap_us=max_gap_us, calling=calling + (name,))
+        _call_plans[key] = plan
+        call_plan_stats['compiles'] += 1
+        return plan
+
+
+class BatchStats:
+    """播放批次计时统计，用于调整批次量子"""
+
+    def __init__(self, quantum_us):
+        self.quantum_us = quantum_us
+        self.batch_count = 0       # 批次数
+        self.op_count = 0          # 批次中的操作总数
+        self.max_size = 0          # 最大批次大小
+        self.total_lateness_us = 0 # 批次实际开始时间相对计划时间的总延迟
+        self.max_lateness_us = 0   # 最大延迟
+        self.total_dispatch_us = 0 # 批次发送耗时总和
+        self.max_dispatch_us = 0   # 最大发送耗时
+
+    def add(self, size, lateness_us, dispatch_us):
+        """记录一个批次"""
+        self.batch_count += 1
+        self.op_count += size
+        if size > self.max_size:
+            self.max_size = size
+        self.total_lateness_us += lateness_us
+        if lateness_us > self.max_lateness_us:
+            self.max_lateness_us = lateness_us
+        self.total_dispatch_us += dispatch_us
+        if dispatch_us > self.max_dispatch_us:
+            self.max_dispatch_us = dispatch_us
+
+    def snapshot(self):
+        """返回统计字典"""
+        count = self.batch_count or 1
+        return {
+            'quantum_us': self.quantum_us,
+            'batches': self.batch_count,
+            'ops': self.op_count,
+            'mean_size': self.op_count / count,
+            'max_size': self.max_size,
+            'mean_lateness_us': self.total_lateness_us / count,
+            'max_lateness_us': self.max_lateness_us,
+            'mean_dispatch_us': self.total_dispatch_us / count,
+            'max_dispatch_us': self.max_dispatch_us
+        }
+
+
+def resolve_anchor(op, translate=(0, 0)):
+    """查找鼠标按下操作的图像锚点，返回本次点击的坐标偏移 (dx, dy)
+
+    translate 为子序列的坐标平移，在平移后的位置周围查找；没有找到锚点时使用平移后的录制位置
+    """
+    try:
+        found = template_match.find_anchor(op['anchor'], op['x'] + translate[0], op['y'] + translate[1])
+    except Exception as e:
+        utils.logger.error("查找点击锚点失败: %s", e)
+        return translate
+    if found is None:
+        utils.logger.warning("未找到点击锚点，使用录制位置 (%d, %d)", op['x'] + translate[0], op['y'] + translate[1])
+        return translate
+    x, y, _ = found
+    return (x - op['x'], y - op['y'])
+
+
+def _chord_settle():
+    """组合键中相邻两个键之间的延时（utils.chord_settle_us），与批次量子无关"""
+    if utils.chord_settle_us > 0:
+        time.sleep(utils.chord_settle_us / 1000000)
+
+
+def dispatch_operation(op, offset=(0, 0)):
+    """立即执行一个操作（不休眠，不记录日志）
+
+    offset 为图像锚点得到的坐标偏移，加到鼠标操作的坐标上
+    """
+    op_type = op['type']
+    if op_type == 'mousemove':
+        # 单个鼠标移动直接由后端移动指针
+        _raw_move_to(round(op['x'] + offset[0]), round(op['y'] + offset[1]))
+
+    elif op_type == 'mousedown':
+        # 鼠标按下操作
+        x, y = op['x'] + offset[0], op['y'] + offset[1]
+        if 'left' in op['button']:
+            # 左键按下
+            pyautogui.mouseDown(x=x, y=y, button='left', _pause=False)
+        elif 'right' in op['button']:
+            # 右键按下
+            pyautogui.mouseDown(x=x, y=y, button='right', _pause=False)
+
+    elif op_type == 'mouseup':
+        # 鼠标释放操作
+        x, y = op['x'] + offset[0], op['y'] + offset[1]
+        if 'left' in op['button']:
+            # 左键释放
+            pyautogui.mouseUp(x=x, y=y, button='left', _pause=False)
+        elif 'right' in op['button']:
+            # 右键释放
+            pyautogui.mouseUp(x=x, y=y, button='right', _pause=False)
+
+    elif op_type == 'keydown':
+        # 键盘按键按下操作
+        try:
+            # 按下所有修饰键，再按下基础键；组合键的每个修饰键按下后短暂延时，确保目标程序先看到修饰键
+            for mod in op.get('modifiers', []):
+                pyautogui.keyDown(_pyautogui_modifier_name(mod), _pause=False)
+                _chord_settle()
+            pyautogui.keyDown(_pyautogui_key_name(op['base_key']), _pause=False)
+        except pyautogui.FailSafeException:
+            raise
+        except Exception as e:
+            # 捕获按键执行异常
+            utils.logger.error("按键按下失败: %s: %s", op['key'], e)
+
+    elif op_type == 'keyup':
+        # 键盘按键释放操作
+        try:
+            # 释放基础键，再按反向顺序释放所有修饰键（每个键释放后短暂延时，与按下时对称）
+            pyautogui.keyUp(_pyautogui_key_name(op['base_key']), _pause=False)
+            for mod in reversed(op.get('modifiers', [])):
+                _chord_settle()
+                pyautogui.keyUp(_pyautogui_modifier_name(mod), _pause=False)
+        except pyautogui.FailSafeException:
+            raise
+        except Exception as e:
+            # 捕获按键执行异常
+            utils.logger.error("按键释放失败: %s: %s", op['key'], e)
+
+
+class HeldInputs:
+    """播放中已按下、尚未释放的按键和鼠标按钮
+
+    暂停时全部释放并记住指针位置，方便用户在暂停期间操作电脑；恢复时把指针移回原位并按原顺序重新按下，
+    之后录制的释放操作照常生效（如拖动到一半时暂停）。播放结束或被停止时释放全部输入，避免按键残留。
+    """
+
+    def __init__(self):
+        self.keys = []       # pyautogui 键名，按按下顺序
+        self.buttons = []    # 'left' / 'right'，按按下顺序
+        self.pointer = None  # 暂停时的指针位置
+        self.released = False
+
+    def track(self, op):
+        """根据刚刚发送的操作更新按下状态"""
+        op_type = op['type']
+        if op_type == 'keydown':
+            for name in [_pyautogui_modifier_name(mod) for mod in op.get('modifiers', [])] + [_pyautogui_key_name(op['base_key'])]:
+                if name not in self.keys:
+                    self.keys.append(name)
+        elif op_type == 'keyup':
+            for name in [_pyautogui_key_name(op['base_key'])] + [_pyautogui_modifier_name(mod) for mod in op.get('modifiers', [])]:
+                if name in self.keys:
+                    self.keys.remove(name)
+        elif op_type in ('mousedown', 'mouseup'):
+            button = 'left' if 'left' in op['button'] else 'right' if 'right' in op['button'] else None
+            if button is None:
+                return
+            if op_type == 'mousedown' and button not in self.buttons:
+                self.buttons.append(button)
+            elif op_type == 'mouseup' and button in self.buttons:
+                self.buttons.remove(button)
+
+    def release(self):
+        """按反向顺序释放所有按下的输入（暂停或结束时）"""
+        if self.released or not (self.keys or self.buttons):
+            return
+        try:
+            self.pointer = pyautogui.position()
+            for button in reversed(self.buttons):
+                pyautogui.mouseUp(button=button, _pause=False)
+            for name in reversed(self.keys):
+                pyautogui.keyUp(name, _pause=False)
+            self.released = True
+        except Exception as e:
+            utils.logger.error("释放按下的输入失败: %s", e)
+
+    def restore(self):
+        """恢复暂停前按下的输入"""
+        if not self.released:
+            return
+        self.released = False
+        try:
+            if self.pointer is not None:
+                _raw_move_to(self.pointer[0], self.pointer[1])
+            for name in self.keys:
+                pyautogui.keyDown(name, _pause=False)
+            for button in self.buttons:
+                pyautogui.mouseDown(button=button, _pause=False)
+        except Exception as e:
+            utils.logger.error("恢复按下的输入失败: %s", e)
+
+
+def _traced_operations(name):
+    """取会话跟踪登记序列用的 (原操作列表, 播放的操作列表)
+
+    播放的操作列表为坐标换算缓存中的列表，与播放计划中的操作是同一批对象
+    """
+    try:
+        return sequence.get_sequence_operations(name), screen_geometry.adapt_sequence(name)
+    except Exception:
+        return (), ()
+
+
+def _dispatch_measured(engine, op, deadline, offset=(0, 0)):
+    """发送一个操作，按需记录输入后端耗时指标和播放跟踪（deadline 为所在批次的计划时间）"""
+    trace = engine.trace
+    if not metrics.enabled and trace is None:
+        dispatch_operation(op, offset)
+        return
+    dispatched = engine.clock()
+    try:
+        dispatch_operation(op, offset)
+    except Exception:
+        if trace is not None:
+            trace.write(log_utils.TRACE_OP, op, deadline, dispatched, engine.clock(), log_utils.RESULT_ERROR)
+        raise
+    returned = engine.clock()
+    if metrics.enabled:
+        metrics.BACKEND_CALL_SECONDS.labels(op['type']).observe(returned - dispatched)
+        metrics.PLAYBACK_OPERATIONS.labels(op['type']).inc()
+    if trace is not None:
+        if 'x' in op:
+            trace.write(log_utils.TRACE_OP, op, deadline, dispatched, returned, log_utils.RESULT_OK,
+                        op['x'] + offset[0], op['y'] + offset[1])
+        else:
+            trace.write(log_utils.TRACE_OP, op, deadline, dispatched, returned)
+
+
+def play_path(engine, samples, origin, base_us, speed, offset=(0, 0)):
+    """按截止时间批量驱动指针经过路径样本（offset 为图像锚点得到的坐标偏移）
+
+    origin 为引擎播放时钟的起点，等待可被停止和暂停立即打断
+
+    Returns:
+        bool: 是否完整播放（播放被停止时返回 False）
+    """
+    pyautogui.failSafeCheck()
+    first_moved = None
+    for n, (t_us, x, y) in enumerate(samples):
+        if not engine.wait_until(origin + utils.us_to_seconds(t_us - base_us) / speed):
+            if metrics.enabled:
+                metrics.PLAYBACK_PATH_SAMPLES.inc(n)
+            return False
+        if first_moved is None:
+            first_moved = engine.clock()
+        _raw_move_to(round(x + offset[0]), round(y + offset[1]))
+        if n % FAILSAFE_CHECK_INTERVAL == FAILSAFE_CHECK_INTERVAL - 1:
+            pyautogui.failSafeCheck()
+    pyautogui.failSafeCheck()
+    if metrics.enabled:
+        metrics.PLAYBACK_PATH_SAMPLES.inc(len(samples))
+    if engine.trace is not None:
+        # 路径记为一条记录：计划时间为首个样本的计划时间，发送时间为首个样本的实际时间
+        engine.trace.write_path(samples[0][0], len(samples), origin + utils.us_to_seconds(samples[0][0] - base_us) / speed,
+                                first_moved, engine.clock())
+    return True
+
+
+def run_plan(engine, plan, stats, speed, translate=(0, 0)):
+    """按计划时间执行一遍播放计划
+
+    所有步骤的截止时间都相对同一个起点计算，单个步骤的执行耗时不会累积成漂移。
+    时间使用引擎的播放时钟，所有等待都可被停止和暂停立即打断，暂停的时间不计入计划时间。
+    同步点不等待计划时间，到达后立即开始轮询画面，匹配后以匹配时刻为同步点的计划时间重新计算起点，
+    之后的操作保持录制时相对同步点的间隔。
+    带图像锚点的鼠标按下在发送前查找锚点，得到的偏移作用于从按下到释放之间的所有鼠标操作（如拖动）。
+    调用子序列时等待调用的时间偏移后递归播放子序列，结束后与同步点一样重新计算起点。
+
+    Args:
+        engine: 录制/播放引擎，停止播放后尽快返回
+        plan: compile_plan 编译的播放计划
+        stats: 批次计时统计
+        speed: 播放速度倍数
+        translate: 坐标平移 (dx, dy)，作用于所有鼠标操作、锚点查找和画面同步区域
+
+    Returns:
+        bool: 是否完整播放（播放被停止时返回 False）
+    """
+    if not plan:
+        return True
+    base_us = plan[0][0]
+    origin = engine.clock()
+    offset = translate
+    trace = engine.trace
+    for start_us, step_type, payload in plan:
+        # 检查是否应该停止播放
+        if not engine.is_playing:
+            return False
+        if step_type == STEP_PATH:
+            if not play_path(engine, payload, origin, base_us, speed, offset):
+                return False
+            continue
+        if step_type == STEP_CALL:
+            op, sub_plan = payload
+            deadline = origin + utils.us_to_seconds(start_us + op.get('offset_us', 0) - base_us) / speed
+            if not engine.wait_until(deadline):
+                return False
+            utils.logger.info("调用序列 %s", op['sequence'])
+            if trace is not None:
+                called = engine.clock()
+                trace.write(log_utils.TRACE_CALL, op, deadline, called, called)
+                trace.enter(op['sequence'], *_traced_operations(op['sequence']))
+            sub_translate = (translate[0] + op.get('dx', 0), translate[1] + op.get('dy', 0))
+            completed = run_plan(engine, sub_plan, stats, speed, sub_translate)
+            if trace is not None:
+                trace.leave()
+            if not completed:
+                return False
+            # 子序列结束的时刻作为调用的计划时间，之后的操作保持录制时相对调用的间隔
+            origin = engine.clock() - utils.us_to_seconds(start_us - base_us) / speed
+            continue
+        if step_type == STEP_WAIT:
+            wait_op = payload
+            wait_started = engine.clock()
+            if translate != (0, 0):
+                left, top, width, height = payload['region']
+                payload = dict(payload, region=[left + translate[0], top + translate[1], width, height])
+            try:
+                matched, distance, polls, waited = screen_sync.wait_for_operation(payload, lambda: engine.is_playing,
+                                                                                   engine.clock, engine.sleep)
+            except Exception as e:
+                # 截图失败时无法判断画面状态，停止播放
+                utils.logger.error("画面同步点截图失败: %s", e)
+                engine.request_stop()
+                return False
+            if not engine.is_playing:
+                return False
+            if trace is not None:
+                trace.write(log_utils.TRACE_WAIT, wait_op, wait_started, wait_started, engine.clock(),
+                            log_utils.RESULT_OK if matched else log_utils.RESULT_TIMEOUT)
+            if matched:
+                utils.logger.info("画面同步点匹配，等待 %.0f毫秒，轮询 %d 次", waited * 1000, polls)
+            elif payload.get('on_timeout', screen_sync.ON_TIMEOUT_STOP) == screen_sync.ON_TIMEOUT_STOP:
+                utils.logger.warning("画面同步点超时（距离 %s），停止播放", distance)
+                engine.request_stop()
+                return False
+            else:
+                utils.logger.warning("画面同步点超时（距离 %s），继续播放", distance)
+            # 以当前时刻作为同步点的计划时间
+            origin = engine.clock() - utils.us_to_seconds(start_us - base_us) / speed
+            continue
+        # 等待到批次的计划时间，然后背靠背发送批次中的所有操作
+        deadline = origin + utils.us_to_seconds(start_us - base_us) / speed
+        if not engine.wait_until(deadline):
+            return False
+        started = engine.clock()
+        for op in payload:
+            try:
+                if 'anchor' in op:
+                    offset = resolve_anchor(op, translate)
+                _dispatch_measured(engine, op, deadline, offset)
+                engine.held_inputs.track(op)
+                if op['type'] == 'mouseup':
+                    offset = translate
+            except pyautogui.FailSafeException:
+                raise
+            except Exception as e:
+                # 捕获其他异常
+                # 处理执行操作时可能出现的其他错误
+                utils.logger.error("执行操作时出错: %s", e)
+                # 继续执行下一个操作，不中断整个播放过程
+        finished = engine.clock()
+        # 发送的操作可能改变了画面，之后的画面检查不能再使用之前的截图
+        screen_capture.capture_service.invalidate()
+        stats.add(len(payload), int((started - deadline) * 1000000), int((finished - started) * 1000000))
+        if metrics.enabled:
+            metrics.PLAYBACK_LATENESS_SECONDS.observe(max(started - deadline, 0.0))
+            metrics.PLAYBACK_BATCH_SECONDS.observe(finished - started)
+    return True
+
 
 # 键盘事件处理函数
-# 功能：处理播放时的键盘事件，按esc键停止播放
-def on_play_press(key):
+# 功能：处理播放时的键盘事件，按esc键停止播放，按F9暂停/继续
+def on_play_press(engine, key):
     """处理播放时的键盘按下事件"""
     # 检查是否按下了Esc键
     if key == keyboard.Key.esc:
         # 按下Esc键，停止播放
-        stop_playback()
+        stop_playback(engine)
         # 弹出提示框：播放已停止
         #pyautogui.alert(text='播放已停止', title='提示', button='确定')
         return
+    # 检查是否按下了暂停/继续热键
+    if key == PAUSE_RESUME_KEY:
+        toggle_pause(engine)
 
-# 播放操作
-# 功能：执行录制的操作序列
-def play_operations():
-    """执行录制的操作序列"""
-    # 设置播放状态为 True
-    utils.is_playing = True
-    # 初始化当前循环次数为 0
-    current_loop = 0
-    
-    # 启动键盘监听器
+def prepare_plan(operations, speed, meta=None):
+    """压缩空闲间隔并编译播放计划
+
+    空闲间隔上限按实际等待时间配置，按播放速度换算为序列时间。
+    给出序列元数据 meta 时，先按其中保存的屏幕配置把坐标换算到当前屏幕
+
+    Returns:
+        tuple: (播放计划, 每遍节省的实际时间秒数)
+    """
+    if meta is not None:
+        operations = screen_geometry.adapt_operations(operations, meta)
+    max_gap_us = int(utils.max_idle_gap_us * speed)
+    timestamps, saved_us = compress_idle_gaps(operations, max_gap_us)
+    plan = compile_plan(operations, timestamps=timestamps, max_gap_us=max_gap_us)
+    return plan, utils.us_to_seconds(saved_us) / speed
+
+
+def _start_play_listener(engine, sequence_name='', trace_meta=None):
+    """准备播放：跟踪按下的输入（暂停时释放、恢复时重新按下），按配置打开播放跟踪（跟踪文件和/或会话跟踪文件，
+    两者共用一个 log_utils.BinaryTrace，每个事件只打包一次），启动键盘监听器（Esc 停止，F9 暂停/继续）
+
+    sequence_name 和 trace_meta 用于会话跟踪文件的文件名和元数据
+    """
+    engine.held_inputs = HeldInputs()
+    engine.trace = None
+    sinks = []
+    if utils.playback_trace:
+        try:
+            sinks.append(log_utils.TraceFileSink(os.path.join(utils.logs_dir, 'playback.trace')))
+        except OSError as e:
+            utils.logger.error("打开播放跟踪文件失败: %s", e)
+    if utils.session_trace:
+        try:
+            sinks.append(session_trace.SessionTrace(session_trace.trace_path(sequence_name),
+                                                    utils.session_trace_capacity, trace_meta))
+        except (OSError, ValueError) as e:
+            utils.logger.error("打开会话跟踪文件失败: %s", e)
+    if sinks:
+        engine.trace = log_utils.BinaryTrace(engine, sinks)
+    engine.on_pause = engine.held_inputs.release
+    engine.on_resume = engine.held_inputs.restore
     keyboard_listener = keyboard.Listener(
-        on_press=on_play_press  # 键盘按下事件处理
+        on_press=lambda key: on_play_press(engine, key)  # 键盘按下事件处理
     )
     # 设置为守护线程
     keyboard_listener.daemon = True
     # 启动键盘监听器
     keyboard_listener.start()
-    
-    # 异常处理块，确保即使出现错误也能正确清理状态
+    return keyboard_listener
+
+
+def _finish_playback(engine, keyboard_listener, stats):
+    """播放结束时的清理：停止监听器，记录统计，通知界面"""
+    # 停止键盘监听器
+    try:
+        keyboard_listener.stop()
+    except:
+        pass
+
+    # 释放仍然按下的按键和鼠标按钮（如在拖动中途停止）
+    engine.held_inputs.release()
+    engine.on_pause = None
+    engine.on_resume = None
+    if engine.trace is not None:
+        try:
+            engine.trace.close()
+        except OSError as e:
+            utils.logger.error("写入播放跟踪文件失败: %s", e)
+        for sink in engine.trace.sinks:
+            if isinstance(sink, session_trace.SessionTrace):
+                utils.logger.info("会话跟踪：%d 条记录，%s", sink.count, sink.path)
+                session_trace.prune_traces(utils.session_trace_keep)
+        engine.trace = None
+
+    # 记录批次计时统计
+    engine.playback_batch_stats = stats.snapshot()
+    batch_stats = engine.playback_batch_stats
+    utils.logger.info("播放结束，批次 %d 个（量子 %d微秒），平均大小 %.2f，最大 %d，平均延迟 %.0f微秒，最大延迟 %d微秒",
+                      batch_stats['batches'], batch_stats['quantum_us'], batch_stats['mean_size'],
+                      batch_stats['max_size'], batch_stats['mean_lateness_us'], batch_stats['max_lateness_us'])
+    # 记录截图统计（只有用到画面同步或图像锚点时才会截图）
+    capture_stats = screen_capture.capture_service.stats()
+    if capture_stats['captures']:
+        latency = capture_stats['latency']
+        utils.logger.info("截图 %d 次，缓存命中 %d 次，缓冲区分配 %d 次，平均耗时 %.1f毫秒，最大 %.1f毫秒",
+                          capture_stats['captures'], capture_stats['cache_hits'], capture_stats['allocations'],
+                          latency['mean_ms'], latency['max_ms'])
+    # 记录子序列播放计划缓存统计（只有用到调用序列时才有）
+    if call_plan_stats['hits'] or call_plan_stats['compiles']:
+        utils.logger.info("子序列播放计划缓存：编译 %d 次，命中 %d 次", call_plan_stats['compiles'], call_plan_stats['hits'])
+    if metrics.enabled:
+        utils.write_metrics()
+    # 无论播放是否正常完成，都会执行的清理工作
+    # 回到空闲状态，之后才允许开始新的录制或播放
+    engine.finish()
+    # 播放完成，通知界面恢复窗口
+    # 默认引擎会触发 ui.py 中的 on_playback_completed 方法
+    if engine.on_playback_completed is not None:
+        engine.on_playback_completed()
+
+
+# 播放操作
+# 功能：执行录制的操作序列
+def play_operations(engine=None):
+    """执行引擎当前的操作序列
+
+    由 AutomationEngine.start 在播放线程中调用（引擎已处于播放状态）
+    """
+    if engine is None:
+        engine = default_engine
+    # 初始化当前循环次数为 0
+    current_loop = 0
+
+    # 启动键盘监听器
+    keyboard_listener = _start_play_listener(engine, engine.current_sequence, {'speed': utils.playback_speed})
+    stats = BatchStats(utils.batch_quantum_us)
+
+    # 异常处理块，确保即使出现错误（包括编译播放计划出错）也能正确清理状态、回到空闲状态
     try:
+        # 编译播放计划（所有循环共用），坐标按录制时的屏幕配置换算到当前屏幕
+        try:
+            operations = screen_geometry.adapt_current(engine.current_sequence, engine.recorded_operations,
+                                                       engine.sequence_meta)
+            if engine.trace is not None:
+                engine.trace.set_sequence(engine.current_sequence, engine.recorded_operations, operations)
+            plan, engine.playback_idle_saved_seconds = prepare_plan(operations, utils.playback_speed)
+        except Exception as e:
+            # 被调用的序列无法加载、存在循环调用或操作格式错误，不开始播放
+            utils.logger.error("编译播放计划失败: %s", e)
+            return
+        if engine.playback_idle_saved_seconds:
+            utils.logger.info("空闲间隔上限 %.3f秒，每轮节省 %.3f秒",
+                              utils.us_to_seconds(utils.max_idle_gap_us), engine.playback_idle_saved_seconds)
+
         # 主循环：控制播放过程
         # 循环条件：
-        # 1. utils.is_playing 为 True（未被停止）
+        # 1. engine.is_playing 为 True（未被停止）
         # 2. 未开启循环时：current_loop < 1（只播放一遍）
-        # 3. 开启循环时：current_loop < utils.max_loop_count（按设置的次数循环）
-        while utils.is_playing and ((utils.is_looping == False and current_loop < 1) or (utils.is_looping and current_loop < utils.max_loop_count)):
-            # 遍历操作序列中的每个操作
-            for i, op in enumerate(utils.recorded_operations):
-                # 检查是否应该停止播放
-                if not utils.is_playing:
-                    # 如果播放被停止，跳出循环
-                    break
-                
-                # 计算延迟时间（从第二个操作开始）
-                if i > 0:
-                    # 获取前一个操作
-                    prev_op = utils.recorded_operations[i-1]
-                    # 计算两个操作之间的时间差
-                    delay = op['timestamp'] - prev_op['timestamp']
-                    # 如果时间差大于0（有延迟）
-                    if delay > 0:
-                        # 根据播放速度调整延迟时间
-                        # 播放速度 > 1.0 时，延迟减少（播放加速），播放速度 < 1.0 时，延迟增加（播放减速）
-                        adjusted_delay = delay / utils.playback_speed
-                        # 执行延迟
-                        time.sleep(adjusted_delay)
-                        # 打印延迟信息
-                        utils.logger.info(f"原始延迟: {delay:.3f}秒, 调整后: {adjusted_delay:.3f}秒, 速度: {utils.playback_speed}倍")
-
-
-                # 执行操作
-                try:
-                    # 根据操作类型执行相应的操作
-                    
-                    # 将鼠标移动到指定坐标 (op['x'], op['y'])
-                    if op['type'] == 'mousemove':
-                        pyautogui.moveTo(op['x'], op['y'])
-                    
-                    elif op['type'] == 'mousedown':
-                        # 鼠标按下操作
-                        if 'left' in op['button']:
-                            # 左键按下
-                            pyautogui.mouseDown(x=op['x'], y=op['y'], button='left')
-                        elif 'right' in op['button']:
-                            # 右键按下
-                            pyautogui.mouseDown(x=op['x'], y=op['y'], button='right')
-                    
-                    elif op['type'] == 'mouseup':
-                        # 鼠标释放操作
-                        if 'left' in op['button']:
-                            # 左键释放
-                            pyautogui.mouseUp(x=op['x'], y=op['y'], button='left')
-                        elif 'right' in op['button']:
-                            # 右键释放
-                            pyautogui.mouseUp(x=op['x'], y=op['y'], button='right')
-                    
-                    elif op['type'] == 'keydown':
-                        # 键盘按键按下操作
-                        try:
-                            # 处理基础键格式：将'Key.tab'转换为'tab'等pyautogui可识别的格式
-                            base_key = op['base_key']
-                            if base_key.startswith('Key.'):
-                                # 移除'Key.'前缀，提取实际键名
-                                base_key = base_key[4:]  # 'Key.tab' -> 'tab'
-                            
-                            # 处理特殊映射：如'page_up' -> 'pageup'
-                            key_mappings = {
-                                'page_up': 'pageup',
-                                'page_down': 'pagedown'
-                            }
-                            if base_key in key_mappings:
-                                base_key = key_mappings[base_key]
-                            
-                            # 按下所有修饰键
-                            for mod in op.get('modifiers', []):
-                                # 将修饰键统一转换为pyautogui可识别的格式
-                                press_mod = mod
-                                if press_mod in ['win', 'cmd']:
-                                    press_mod = 'win'
-                                utils.logger.info(f"按下修饰键: {press_mod}")
-                                pyautogui.keyDown(press_mod)
-                                time.sleep(0.05)  # 短暂延时确保键被按下
-                            
-                            # 按下基础键
-                            utils.logger.info(f"按下基础键: {base_key}")
-                            pyautogui.keyDown(base_key)
-                            time.sleep(0.05)  # 短暂延时确保键被按下
-                            
-                            utils.logger.info(f"按键按下成功: {op['key']}")
-                        except Exception as e:
-                            # 捕获按键执行异常
-                            utils.logger.error(f"按键按下失败: {e}")
-                    elif op['type'] == 'keyup':
-                        # 键盘按键释放操作
-                        try:
-                            # 处理基础键格式：将'Key.tab'转换为'tab'等pyautogui可识别的格式
-                            base_key = op['base_key']
-                            if base_key.startswith('Key.'):
-                                # 移除'Key.'前缀，提取实际键名
-                                base_key = base_key[4:]  # 'Key.tab' -> 'tab'
-                            
-                            # 处理特殊映射：如'page_up' -> 'pageup'
-                            key_mappings = {
-                                'page_up': 'pageup',
-                                'page_down': 'pagedown'
-                            }
-                            if base_key in key_mappings:
-                                base_key = key_mappings[base_key]
-                            
-                            # 释放基础键
-                            utils.logger.info(f"释放基础键: {base_key}")
-                            pyautogui.keyUp(base_key)
-                            time.sleep(0.05)  # 短暂延时确保键被释放
-                            
-                            # 释放所有修饰键（按反向顺序）
-                            for mod in reversed(op.get('modifiers', [])):
-                                # 将修饰键统一转换为pyautogui可识别的格式
-                                press_mod = mod
-                                if press_mod in ['win', 'cmd']:
-                                    press_mod = 'win'
-                                utils.logger.info(f"释放修饰键: {press_mod}")
-                                pyautogui.keyUp(press_mod)
-                                time.sleep(0.05)  # 短暂延时确保键被释放
-                            
-                            utils.logger.info(f"按键释放成功: {op['key']}")
-                        except Exception as e:
-                            # 捕获按键执行异常
-                            utils.logger.error(f"按键释放失败: {e}")
-                except pyautogui.FailSafeException:
-                    # 捕获安全机制异常
-                    # 当用户将鼠标移动到屏幕角落时，pyautogui 会触发 FailSafeException
-                    # 这是一个安全机制，允许用户在紧急情况下停止自动化操作
-                    utils.logger.warning("检测到安全机制触发")
-                    # 设置播放状态为 False，停止播放
-                    utils.is_playing = False
-                    
-                    # 跳出当前循环
-                    break
-                except Exception as e:
-                    # 捕获其他异常
-                    # 处理执行操作时可能出现的其他错误
-                    utils.logger.error(f"执行操作时出错: {e}")
-                    # 继续执行下一个操作，不中断整个播放过程
-                    continue
-            
+        # 3. 开启循环时：current_loop < engine.max_loop_count（按设置的次数循环）
+        while engine.is_playing and ((engine.is_looping == False and current_loop < 1) or (engine.is_looping and current_loop < engine.max_loop_count)):
+            try:
+                run_plan(engine, plan, stats, utils.playback_speed)
+            except pyautogui.FailSafeException:
+                # 捕获安全机制异常
+                # 当用户将鼠标移动到屏幕角落时，pyautogui 会触发 FailSafeException
+                # 这是一个安全机制，允许用户在紧急情况下停止自动化操作
+                utils.logger.warning("检测到安全机制触发")
+                # 请求停止播放
+                engine.request_stop()
+                break
+
             # 增加循环计数
-            # 更新全局循环计数（用于UI显示）
-            utils.loop_count += 1
+            # 更新引擎的循环计数（用于UI显示）
+            engine.loop_count += 1
+            engine.notify('progress', loop_count=engine.loop_count)
             # 更新当前函数内的循环计数（用于控制循环条件）
             current_loop += 1
-            
-    
+
     finally:
-        # 停止键盘监听器
-        try:
-            keyboard_listener.stop()
-        except:
-            pass
-        
-        utils.logger.info(f"播放结束")
-        # 无论播放是否正常完成，都会执行的清理工作
-        # 设置播放状态为 False，确保播放已停止
-        utils.is_playing = False
-        # 播放完成，发送信号给UI，通知其恢复窗口
-        # 这会触发 ui.py 中的 on_playback_completed 方法
-        utils.playback_signals.completed.emit()
+        _finish_playback(engine, keyboard_listener, stats)
+
+
+def compile_playlist(items):
+    """预先加载并编译播放列表的所有项
+
+    同一序列以同一速度出现多次时只编译一次。播放开始前完成全部加载、坐标换算和编译，播放时项与项之间没有解析或加载停顿。
+
+    Args:
+        items: 播放列表项，见 playlist.make_item
+
+    Returns:
+        list: [(项, 播放计划, 每遍节省的实际时间秒数), ...]
+
+    Raises:
+        ValueError: 有序列无法加载
+    """
+    compiled = []
+    plans = {}
+    for item in items:
+        key = (item['sequence'], item['speed'])
+        if key not in plans:
+            try:
+                operations = screen_geometry.adapt_sequence(item['sequence'])
+            except Exception as e:
+                raise ValueError(f'序列 "{item["sequence"]}" 无法加载: {e}')
+            plans[key] = prepare_plan(operations, item['speed'])
+        compiled.append((item,) + plans[key])
+    return compiled
+
+
+# 播放列表
+# 功能：按顺序播放预先编译好的多个序列
+def play_playlist(engine, compiled):
+    """播放 compile_playlist 编译好的播放列表
+
+    由 AutomationEngine.start 在播放线程中调用（引擎已处于播放状态）
+    """
+    keyboard_listener = _start_play_listener(engine, compiled[0][0]['sequence'] if compiled else '',
+                                             {'playlist': [item['sequence'] for item, _, _ in compiled],
+                                              'speeds': [item['speed'] for item, _, _ in compiled]})
+    stats = BatchStats(utils.batch_quantum_us)
+    # 整个播放列表播放一遍节省的实际时间
+    engine.playback_idle_saved_seconds = sum(saved * item['loops'] for item, _, saved in compiled)
+
+    try:
+        for index, (item, plan, _) in enumerate(compiled):
+            if not engine.is_playing:
+                break
+            # 项开始前的延迟
+            if item['delay_us'] > 0:
+                engine.playlist_status = f'第 {index + 1}/{len(compiled)} 项：{item["sequence"]}（等待）'
+                engine.sleep(utils.us_to_seconds(item['delay_us']))
+            for loop in range(item['loops']):
+                if not engine.is_playing:
+                    break
+                engine.playlist_status = (f'第 {index + 1}/{len(compiled)} 项：{item["sequence"]}'
+                                          f'（第 {loop + 1}/{item["loops"]} 遍）')
+                utils.logger.info("播放列表%s", engine.playlist_status)
+                if engine.trace is not None:
+                    engine.trace.set_sequence(item['sequence'], *_traced_operations(item['sequence']))
+                engine.notify('progress', loop_count=engine.loop_count, item=index, status=engine.playlist_status)
+                run_plan(engine, plan, stats, item['speed'])
+                engine.loop_count += 1
+    except pyautogui.FailSafeException:
+        utils.logger.warning("检测到安全机制触发")
+        engine.request_stop()
+    finally:
+        engine.playlist_status = ''
+        _finish_playback(engine, keyboard_listener, stats)
+
 
 # 停止播放
 # 功能：停止正在进行的播放操作
-def stop_playback():
+def stop_playback(engine=None):
     """停止正在进行的播放操作"""
-    # 设置播放状态为 False
-    # 这会导致 play_operations 函数中的循环条件不满足，从而停止播放
-    utils.is_playing = False
+    if engine is None:
+        engine = default_engine
+    # 请求停止，播放线程在检查到状态变化后结束并通知界面
+    engine.request_stop()
+
+
+# 暂停/继续播放
+# 功能：暂停时保留播放位置，继续时从暂停处按原来的时间间隔接着播放
+def toggle_pause(engine=None):
+    """暂停或继续正在进行的播放，返回操作后是否处于暂停状态"""
+    if engine is None:
+        engine = default_engine
+    if not engine.is_playing:
+        return False
+    paused = engine.toggle_pause()
+    utils.logger.info("播放已暂停" if paused else "播放已继续")
+    return paused
@@ -0,0 +1,116 @@
+import json
+import math
+import os
+import utils
+
+# 播放列表文件格式版本
+# 版本1：{'format_version', 'items': [{'sequence', 'loops', 'speed', 'delay_us'}, ...]}
+PLAYLIST_FORMAT_VERSION = 1
+
+# 检查播放速度
+def check_speed(speed):
+    """把播放速度转换为浮点数
+
+    Raises:
+        ValueError: 不是数字，或不是大于0的有限数（速度为0或负数时计划时间无法换算）
+    """
+    speed = float(speed)
+    if not (speed > 0 and math.isfinite(speed)):
+        raise ValueError(f'播放速度必须大于0: {speed}')
+    return speed
+
+# 创建播放列表项
+def make_item(sequence_name, loops=1, speed=1.0, delay_us=0):
+    """创建播放列表项
+
+    Args:
+        sequence_name: 序列名称
+        loops: 该项连续播放的遍数
+        speed: 播放速度倍数
+        delay_us: 该项开始前的等待时间（微秒）
+
+    Raises:
+        ValueError: 参数不是数字或速度不大于0
+    """
+    return {
+        'sequence': sequence_name,
+        'loops': max(int(loops), 1),
+        'speed': check_speed(speed),
+        'delay_us': max(int(delay_us), 0)
+    }
+
+# 读取播放列表文件
+def read_playlist_file(path):
+    """读取播放列表文件，返回项列表（缺少的字段使用默认值）
+
+    Raises:
+        ValueError: 有项的参数无效（如速度不大于0）
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    return [make_item(item['sequence'], item.get('loops', 1), item.get('speed', 1.0), item.get('delay_us', 0))
+            for item in data.get('items', [])]
+
+# 写入播放列表文件
+def write_playlist_file(path, items):
+    """以当前格式写入播放列表文件"""
+    data = {
+        'format_version': PLAYLIST_FORMAT_VERSION,
+        'items': items
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+
+# 保存播放列表
+def save_playlist(name, items):
+    if not name:
+        return False, '播放列表名称不能为空'
+    if not items:
+        return False, '播放列表为空'
+
+    # 确保playlists目录存在
+    if not os.path.exists(utils.playlists_dir):
+        os.makedirs(utils.playlists_dir)
+
+    try:
+        write_playlist_file(os.path.join(utils.playlists_dir, f'{name}.json'), items)
+        utils.playlists[name] = items
+        return True, f'播放列表 "{name}" 已保存'
+    except Exception as e:
+        return False, f'保存失败: {str(e)}'
+
+# 删除播放列表
+def delete_playlist(name):
+    if not name:
+        return False, '播放列表名称不能为空'
+
+    utils.playlists.pop(name, None)
+    try:
+        path = os.path.join(utils.playlists_dir, f'{name}.json')
+        if os.path.exists(path):
+            os.remove(path)
+        return True, f'播放列表 "{name}" 已删除'
+    except Exception as e:
+        return False, f'删除失败: {str(e)}'
+
+# 加载所有播放列表
+def load_all_playlists():
+    utils.playlists = {}
+
+    if os.path.exists(utils.playlists_dir):
+        for filename in os.listdir(utils.playlists_dir):
+            if filename.endswith('.json'):
+                name = filename[:-5]  # 移除.json后缀
+                try:
+                    utils.playlists[name] = read_playlist_file(os.path.join(utils.playlists_dir, filename))
+                except Exception as e:
+                    utils.logger.warning("加载播放列表文件失败: %s: %s", filename, e)
+    return list(utils.playlists.keys())
+
+# 播放列表项的显示文本
+def describe_item(item):
+    """返回播放列表项的显示文本"""
+    text = f'{item["sequence"]} ×{item["loops"]}遍，{item["speed"]}倍速'
+    if item['delay_us']:
+        text += f'，开始前等待 {utils.us_to_seconds(item["delay_us"]):.1f}秒'
+    return text
@@ -0,0 +1,213 @@
+# 采样性能分析
+# 功能：录制或播放期间在后台线程中定时对所有线程（播放/录制线程、pynput 监听线程、Qt 界面线程等）的调用栈采样，
+#      结束时以火焰图工具通用的折叠栈格式（每行 '线程;外层函数;...;内层函数 采样次数'）写入 logs/profiles 目录，
+#      可以用 flamegraph.pl、speedscope 等工具查看
+#
+# 采样只读取 sys._current_frames()，不在被分析的线程中插桩，开销与采样频率成正比，与被分析代码的调用次数无关
+#
+# 用法：python profiler.py list              列出已保存的性能分析文件
+#      python profiler.py open [文件名]      用系统默认程序打开（默认为最新的一个）
+#      python profiler.py top [文件名] [-n 20]  按自身采样数列出最耗时的函数
+import argparse
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import utils
+
+# 默认采样间隔（秒）
+DEFAULT_INTERVAL = 0.005
+
+# 每个调用栈最多记录的层数（从最内层算起）
+MAX_STACK_DEPTH = 128
+
+# 性能分析文件扩展名
+PROFILE_EXTENSION = '.folded'
+
+
+def _frame_label(code, cache):
+    """函数的显示名称：'文件名:函数名'（同一代码对象只计算一次）"""
+    label = cache.get(code)
+    if label is None:
+        label = f'{os.path.basename(code.co_filename)}:{code.co_name}'.replace(';', ':').replace(' ', '_')
+        cache[code] = label
+    return label
+
+
+class SamplingProfiler:
+    """采样性能分析器
+
+    start 后在守护线程中每隔 interval 秒采样一次，stop 后用 write 写入折叠栈文件
+    """
+
+    def __init__(self, interval=DEFAULT_INTERVAL, kind='playback'):
+        self.interval = interval
+        self.kind = kind         # 'playback' 或 'recording'，用于文件名
+        self.samples = {}        # 折叠栈 -> 采样次数
+        self.sample_count = 0    # 采样轮数
+        self.started_at = None
+        self.duration = 0.0
+        self._labels = {}        # 代码对象 -> 显示名称
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.started_at = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name='profiler')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """停止采样（可在被分析的线程中调用）"""
+        if self._thread is None:
+            return
+        self._stop.set()
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+        self.duration = time.perf_counter() - self.started_at
+
+    def _run(self):
+        own_id = threading.get_ident()
+        next_time = time.perf_counter()
+        while not self._stop.is_set():
+            self._sample(own_id)
+            # 按固定节拍采样，采样本身的耗时不累积
+            next_time += self.interval
+            delay = next_time - time.perf_counter()
+            if delay < 0:
+                next_time = time.perf_counter()
+                delay = 0
+            self._stop.wait(delay)
+
+    def _sample(self, own_id):
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        labels = self._labels
+        samples = self.samples
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_id:
+                continue
+            stack = []
+            while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                stack.append(_frame_label(frame.f_code, labels))
+                frame = frame.f_back
+            stack.append(names.get(thread_id, f'thread-{thread_id}').replace(';', ':').replace(' ', '_'))
+            stack.reverse()
+            key = ';'.join(stack)
+            samples[key] = samples.get(key, 0) + 1
+        self.sample_count += 1
+
+    def write(self, path):
+        """以折叠栈格式写入文件（按采样次数从多到少）"""
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in sorted(self.samples.items(), key=lambda item: -item[1]):
+                f.write(f'{stack} {count}\n')
+
+
+def profile_path(kind, sequence_name=''):
+    """新的性能分析文件路径：logs/profiles/时间（到毫秒）-类型[-序列名].folded"""
+    if not os.path.exists(utils.profiles_dir):
+        os.makedirs(utils.profiles_dir)
+    now = time.time()
+    name = f'{time.strftime("%Y%m%d-%H%M%S", time.localtime(now))}{int(now * 1000) % 1000:03d}-{kind}'
+    if sequence_name:
+        safe = ''.join(ch if ch.isalnum() or ch in '-_' else '_' for ch in sequence_name)
+        name += f'-{safe}'
+    return os.path.join(utils.profiles_dir, name + PROFILE_EXTENSION)
+
+
+def list_profiles():
+    """列出已保存的性能分析文件，返回 [(文件名, 大小字节, 修改时间), ...]，最新的在前"""
+    if not os.path.isdir(utils.profiles_dir):
+        return []
+    profiles = []
+    with os.scandir(utils.profiles_dir) as entries:
+        for entry in entries:
+            if entry.name.endswith(PROFILE_EXTENSION) and entry.is_file():
+                stat = entry.stat()
+                profiles.append((entry.name, stat.st_size, stat.st_mtime))
+    profiles.sort(key=lambda item: item[2], reverse=True)
+    return profiles
+
+
+def open_path(path):
+    """用系统默认程序打开文件或目录"""
+    if sys.platform.startswith('win'):
+        os.startfile(path)
+    elif sys.platform == 'darwin':
+        subprocess.Popen(['open', path])
+    else:
+        subprocess.Popen(['xdg-open', path])
+
+
+def read_profile(path):
+    """读取折叠栈文件，返回 {折叠栈: 采样次数}"""
+    samples = {}
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            stack, _, count = line.rstrip('\n').rpartition(' ')
+            if stack and count.isdigit():
+                samples[stack] = samples.get(stack, 0) + int(count)
+    return samples
+
+
+def top_functions(samples, limit=20):
+    """按自身采样数（函数位于栈顶的次数）排序，返回 [(函数, 自身采样数, 总采样数), ...]
+
+    总采样数为函数出现在栈中的次数（递归调用只计一次）
+    """
+    self_counts = {}
+    total_counts = {}
+    for stack, count in samples.items():
+        frames = stack.split(';')
+        self_counts[frames[-1]] = self_counts.get(frames[-1], 0) + count
+        for frame in set(frames[1:]):
+            total_counts[frame] = total_counts.get(frame, 0) + count
+    ranked = sorted(self_counts.items(), key=lambda item: -item[1])[:limit]
+    return [(frame, count, total_counts.get(frame, count)) for frame, count in ranked]
+
+
+def _resolve(name):
+    """命令行参数中的文件名：省略时为最新的一个"""
+    if name:
+        return name if os.path.isabs(name) else os.path.join(utils.profiles_dir, name)
+    profiles = list_profiles()
+    if not profiles:
+        return None
+    return os.path.join(utils.profiles_dir, profiles[0][0])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='查看录制/播放的性能分析文件')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('list', help='列出性能分析文件')
+    open_parser = commands.add_parser('open', help='用系统默认程序打开')
+    open_parser.add_argument('name', nargs='?', default=None)
+    top_parser = commands.add_parser('top', help='列出最耗时的函数')
+    top_parser.add_argument('name', nargs='?', default=None)
+    top_parser.add_argument('-n', type=int, default=20, help='列出的函数数')
+    args = parser.parse_args(argv)
+
+    if args.command == 'list':
+        for name, size, mtime in list_profiles():
+            print(f'{time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(mtime))}  {size / 1024:8.1f} KB  {name}')
+        return 0
+    path = _resolve(args.name)
+    if path is None or not os.path.exists(path):
+        print('没有找到性能分析文件', file=sys.stderr)
+        return 1
+    if args.command == 'open':
+        open_path(path)
+        return 0
+    samples = read_profile(path)
+    total = sum(samples.values()) or 1
+    print(f'{os.path.basename(path)}：共 {total} 个采样')
+    for frame, self_count, total_count in top_functions(samples, args.n):
+        print(f'{self_count / total:7.1%} {total_count / total:7.1%}  {frame}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,63 +1,83 @@
 # 导入时间模块，用于计算时间戳
 import time
+# 导入 itemgetter，用于按时间排序原始事件
+from operator import itemgetter
 # 从 pynput 库导入键盘和鼠标监听器
 from pynput import keyboard, mouse
 # 导入工具模块，用于访问全局变量
 import utils
+# 导入鼠标移动采样策略
+from capture_policy import MoveCapturePolicy
+# 导入图像锚定
+import template_match
+# 导入运行指标
+import metrics
+# 导入屏幕配置，保存到序列元数据
+import screen_geometry
+
+# 导入录制/播放引擎
+from engine import default_engine, MODIFIER_NAMES
 
 # 常量定义
-MODIFIER_KEYS = ('ctrl', 'shift', 'alt', 'win')  # 修饰键名称列表
+MODIFIER_KEYS = MODIFIER_NAMES  # 修饰键名称列表
+
+# 原始事件类型（钩子线程写入队列的元组第一个元素）
+EVENT_MOVE = 0      # (EVENT_MOVE, t_ns, x, y)
+EVENT_CLICK = 1     # (EVENT_CLICK, t_ns, x, y, button, pressed)
+EVENT_PRESS = 2     # (EVENT_PRESS, t_ns, key)
+EVENT_RELEASE = 3   # (EVENT_RELEASE, t_ns, key)
+
+# 消费者处理原始事件时的保留窗口（纳秒）
+# 两个队列分别由鼠标和键盘线程写入，晚于该窗口的事件才按时间顺序写入操作序列，避免跨队列乱序
+CONSUMER_HOLDBACK_NS = 2000000  # 2毫秒
+
+# 按时间戳取值的函数
+_event_time = itemgetter(1)
+
+# 各类钩子回调的耗时直方图
+_MOVE_CALLBACK = metrics.RECORDER_CALLBACK_SECONDS.labels('move')
+_CLICK_CALLBACK = metrics.RECORDER_CALLBACK_SECONDS.labels('click')
+_PRESS_CALLBACK = metrics.RECORDER_CALLBACK_SECONDS.labels('press')
+_RELEASE_CALLBACK = metrics.RECORDER_CALLBACK_SECONDS.labels('release')
 
-# 鼠标事件处理
+
+def elapsed_us(engine, t_ns=None):
+    """返回从录制开始到 t_ns（默认为现在）经过的整数微秒
+
+    使用 time.perf_counter_ns 单调时钟，不受系统时间调整（NTP、夏令时）影响
+    """
+    if t_ns is None:
+        t_ns = time.perf_counter_ns()
+    return (t_ns - engine.recording_start_time) // 1000
+
+# 鼠标事件处理（运行在 pynput 钩子线程中，只写入原始元组）
 # 功能：处理鼠标移动事件
-def on_move(x, y):
+def on_move(engine, x, y):
     """处理鼠标移动事件"""
     # 检查是否正在录制
-    if utils.is_recording:
-        # 计算相对时间戳（从录制开始到现在的时间差）
-        timestamp = time.time() - utils.recording_start_time
-        # 将鼠标移动操作添加到操作序列
-        utils.recorded_operations.append({
-            'type': 'mousemove',      # 操作类型：鼠标移动
-            'x': x,                   # 鼠标X坐标
-            'y': y,                   # 鼠标Y坐标
-            'timestamp': timestamp     # 时间戳
-        })
+    if engine.is_recording:
+        t_ns = time.perf_counter_ns()
+        engine.mouse_queue.push((EVENT_MOVE, t_ns, x, y))
+        if metrics.enabled:
+            _MOVE_CALLBACK.observe((time.perf_counter_ns() - t_ns) / 1e9)
 
 
-def on_click(x, y, button, pressed):
+def on_click(engine, x, y, button, pressed):
     """处理鼠标点击事件"""
     # 检查是否正在录制
-    if utils.is_recording:
-        # 计算相对时间戳
-        timestamp = time.time() - utils.recording_start_time
-        # 根据 pressed 参数判断是按下还是释放
-        if pressed:
-            # 鼠标按下操作
-            utils.recorded_operations.append({
-                'type': 'mousedown',    # 操作类型：鼠标按下
-                'x': x,                 # 鼠标X坐标
-                'y': y,                 # 鼠标Y坐标
-                'button': str(button),  # 按钮类型（左键/右键）
-                'timestamp': timestamp   # 时间戳
-            })
-        else:
-            # 鼠标释放操作
-            utils.recorded_operations.append({
-                'type': 'mouseup',      # 操作类型：鼠标释放
-                'x': x,                 # 鼠标X坐标
-                'y': y,                 # 鼠标Y坐标
-                'button': str(button),  # 按钮类型（左键/右键）
-                'timestamp': timestamp   # 时间戳
-            })
+    if engine.is_recording:
+        t_ns = time.perf_counter_ns()
+        engine.mouse_queue.push((EVENT_CLICK, t_ns, x, y, button, pressed))
+        if metrics.enabled:
+            _CLICK_CALLBACK.observe((time.perf_counter_ns() - t_ns) / 1e9)
 
 # 辅助函数：获取修饰键名称
 def get_modifier_name(key):
     """根据键盘按键对象获取修饰键名称
-    
+
     Args:
         key: keyboard.Key对象
-        
+
     Returns:
         str: 修饰键名称，如 'ctrl', 'shift', 'alt', 'win'，如果不是修饰键返回None
     """
@@ -71,46 +91,117 @@ def get_modifier_name(key):
         return 'win'
     return None
 
-# 键盘事件处理
+# 键盘事件处理（运行在 pynput 钩子线程中，只写入原始元组）
 # 功能：处理键盘按下事件
-def on_press(key):
+def on_press(engine, key):
     """处理键盘按下事件"""
-    print(f"key press: {key}")
-
     # 首先检查是否需要停止录制
     # 检查Esc键
     if key == keyboard.Key.esc:
         # 按下Esc键，停止录制
-        stop_recording()
-        return
-    
-    # 如果未在录制，直接返回
-    if not utils.is_recording:
+        stop_recording(engine)
         return
 
-    # 计算相对时间戳
-    timestamp = time.time() - utils.recording_start_time
+    # 如果正在录制，写入采集队列
+    if engine.is_recording:
+        t_ns = time.perf_counter_ns()
+        engine.keyboard_queue.push((EVENT_PRESS, t_ns, key))
+        if metrics.enabled:
+            _PRESS_CALLBACK.observe((time.perf_counter_ns() - t_ns) / 1e9)
+
+
+def on_release(engine, key):
+    """处理键盘释放事件"""
+    # 如果正在录制，写入采集队列
+    if engine.is_recording:
+        t_ns = time.perf_counter_ns()
+        engine.keyboard_queue.push((EVENT_RELEASE, t_ns, key))
+        if metrics.enabled:
+            _RELEASE_CALLBACK.observe((time.perf_counter_ns() - t_ns) / 1e9)
+
 
+# 事件规范化（运行在录制线程中）
+# 功能：将原始事件元组转换为操作字典，并跟踪修饰键状态
+def _store_move(engine, timestamp, x, y):
+    """记录鼠标移动操作"""
+    operations = engine.recorded_operations
+    # 压缩：坐标与上一个鼠标移动相同的事件不再重复记录
+    if operations:
+        last = operations[-1]
+        if last['type'] == 'mousemove' and last['x'] == x and last['y'] == y:
+            return
+    # 将鼠标移动操作添加到操作序列
+    operations.append({
+        'type': 'mousemove',      # 操作类型：鼠标移动
+        'x': x,                   # 鼠标X坐标
+        'y': y,                   # 鼠标Y坐标
+        'timestamp_us': timestamp     # 时间戳
+    })
+
+
+def _capture_click_anchor(engine, timestamp, x, y):
+    """生成鼠标按下位置的图像锚点
+
+    优先从按下之前持续截取的画面（engine.anchor_frames）中裁出模板；没有包含该位置的帧时（如指针移动太快）
+    在录制线程中截图。frame_age_us 为按下时刻减去截图时刻（微秒），负数表示截图晚于按下
+    """
+    t_ns = engine.recording_start_time + timestamp * 1000
+    cropped = engine.anchor_frames.crop(x, y, t_ns) if engine.anchor_frames is not None else None
+    if cropped is not None:
+        grabbed, captured_ns = cropped
+    else:
+        grabbed = template_match.grab_anchor_region(x, y, utils.anchor_template_size)
+        captured_ns = time.perf_counter_ns()
+    anchor = template_match.make_anchor(x, y, grabbed, utils.anchor_search_radius)
+    if anchor is not None:
+        anchor['frame_age_us'] = (t_ns - captured_ns) // 1000
+    return anchor
+
+
+def _store_click(engine, timestamp, x, y, button, pressed):
+    """记录鼠标按下/释放操作"""
+    # 根据 pressed 参数判断是按下还是释放
+    op = {
+        'type': 'mousedown' if pressed else 'mouseup',  # 操作类型：鼠标按下/释放
+        'x': x,                 # 鼠标X坐标
+        'y': y,                 # 鼠标Y坐标
+        'button': str(button),  # 按钮类型（左键/右键）
+        'timestamp_us': timestamp   # 时间戳
+    }
+    if pressed and utils.anchor_clicks:
+        # 截取按下位置的图像锚点（在录制线程中处理，不阻塞监听回调）
+        try:
+            anchor = _capture_click_anchor(engine, timestamp, x, y)
+        except Exception as e:
+            utils.logger.warning("截取点击锚点失败: %s", e)
+            anchor = None
+        if anchor is not None:
+            op['anchor'] = anchor
+    engine.recorded_operations.append(op)
+
+
+def _store_press(engine, timestamp, key):
+    """记录键盘按下操作"""
     # 获取修饰键名称
     modifier_name = get_modifier_name(key)
     if modifier_name:
-        utils.modifier_keys[modifier_name] = True
+        engine.modifier_keys[modifier_name] = True
 
     # 通过循环收集当前按下的修饰键
     modifiers = []
-    for name, pressed in utils.modifier_keys.items():
+    for name, pressed in engine.modifier_keys.items():
         if pressed:
             modifiers.append(name)
 
     # 如果是修饰键，记录操作并返回
     if modifier_name:
         key_string = '+'.join(modifiers) if len(modifiers) > 1 else modifier_name
-        utils.recorded_operations.append({
+        engine.recorded_operations.append({
             'type': 'keydown',
             'key': key_string,
             'modifiers': modifiers,
             'base_key': modifier_name,
-            'timestamp': timestamp
+            'timestamp_us': timestamp
         })
         return
 
@@ -127,40 +218,30 @@ def on_press(key):
     key_string = '+'.join(modifiers) + '+' + key_char if modifiers else key_char
 
     # 记录按键按下操作
-    utils.recorded_operations.append({
+    engine.recorded_operations.append({
         'type': 'keydown',
         'key': key_string,
         'modifiers': modifiers,
         'base_key': key_char,
-        'timestamp': timestamp
+        'timestamp_us': timestamp
     })
 
 
-def on_release(key):
-    """处理键盘释放事件"""
-
-    print(f"key release: {key}")
-
-    # 如果未在录制，直接返回
-    if not utils.is_recording:
-        return    
-
+def _store_release(engine, timestamp, key):
+    """记录键盘释放操作"""
     # 先记录释放前的修饰键状态
-    modifiers_before = [name for name in MODIFIER_KEYS if utils.modifier_keys[name]]
-    
+    modifiers_before = [name for name in MODIFIER_KEYS if engine.modifier_keys[name]]
+
     # 获取修饰键名称
     modifier_name = get_modifier_name(key)
-    
+
     # 更新修饰键状态
     if modifier_name:
         # 修饰键释放
-        utils.modifier_keys[modifier_name] = False  
-
-    # 计算相对时间戳
-    timestamp = time.time() - utils.recording_start_time
+        engine.modifier_keys[modifier_name] = False
 
     # 检查释放的是否为修饰键
-    if modifier_name:    
+    if modifier_name:
         # 记录修饰键释放操作
         # 构建键字符串
         if len(modifiers_before) > 1:
@@ -169,20 +250,20 @@ def on_release(key):
         else:
             # 单个修饰键
             key_string = modifier_name
-        
+
         # 记录修饰键释放操作
-        utils.recorded_operations.append({
+        engine.recorded_operations.append({
             'type': 'keyup',          # 操作类型：按键释放
             'key': key_string,        # 完整的键字符串
             'modifiers': modifiers_before,    # 修饰键列表
             'base_key': modifier_name,      # 基础键（最后释放的修饰键）
-            'timestamp': timestamp      # 时间戳
+            'timestamp_us': timestamp      # 时间戳
         })
         return  # 修饰键处理完成，直接返回，避免后续的普通键处理
-    
+
     # 检测当前仍按下的修饰键
-    modifiers = [name for name in MODIFIER_KEYS if utils.modifier_keys[name]]
-    
+    modifiers = [name for name in MODIFIER_KEYS if engine.modifier_keys[name]]
+
     # 获取按键字符
     try:
         # 尝试获取普通字符键
@@ -190,7 +271,7 @@ def on_release(key):
     except AttributeError:
         # 对于特殊键，使用字符串表示
         key_char = str(key)
-    
+
     # 构建组合键字符串
     if modifiers:
         # 如果有修饰键，构建形如 "ctrl+shift+c" 的字符串
@@ -198,56 +279,146 @@ def on_release(key):
     else:
         # 如果没有修饰键，直接使用键字符
         key_string = key_char
-    
+
     # 记录按键释放操作
-    utils.recorded_operations.append({
+    engine.recorded_operations.append({
         'type': 'keyup',          # 操作类型：按键释放
         'key': key_string,        # 完整的键字符串（包含修饰键）
         'modifiers': modifiers,    # 修饰键列表
         'base_key': key_char,      # 基础键（不包含修饰键）
-        'timestamp': timestamp      # 时间戳
+        'timestamp_us': timestamp      # 时间戳
     })
-    
+
+
+def _flush_pending_move(engine, before_timestamp=None):
+    """补记采样策略暂存的最后一个移动位置"""
+    pending = engine.move_policy.take_pending(before_timestamp)
+    if pending is not None:
+        _store_move(engine, *pending)
+
+
+def _store_event(engine, event):
+    """根据事件类型分发原始事件"""
+    kind = event[0]
+    timestamp = elapsed_us(engine, event[1])
+    if kind == EVENT_MOVE:
+        # 先补记已停留的位置，再按采样策略决定是否记录当前位置
+        _flush_pending_move(engine, timestamp)
+        if engine.move_policy.offer(timestamp, event[2], event[3]):
+            _store_move(engine, timestamp, event[2], event[3])
+        return
+    # 其他事件之前总是补记最后的精确指针位置
+    _flush_pending_move(engine)
+    if kind == EVENT_CLICK:
+        _store_click(engine, timestamp, event[2], event[3], event[4], event[5])
+    elif kind == EVENT_PRESS:
+        _store_press(engine, timestamp, event[2])
+    elif kind == EVENT_RELEASE:
+        _store_release(engine, timestamp, event[2])
+
+
+def drain_capture_queues(engine, pending, flush=False):
+    """从采集队列取出事件，按时间顺序写入操作序列
+
+    Args:
+        engine: 录制/播放引擎
+        pending: 尚未写入的事件列表（跨调用保留）
+        flush: 为 True 时写入全部事件，否则只写入早于保留窗口的事件
+    """
+    if metrics.enabled:
+        metrics.CAPTURE_QUEUE_DEPTH.labels('mouse').observe(len(engine.mouse_queue))
+        metrics.CAPTURE_QUEUE_DEPTH.labels('keyboard').observe(len(engine.keyboard_queue))
+    engine.mouse_queue.pop_all(pending)
+    engine.keyboard_queue.pop_all(pending)
+    if not pending:
+        return
+    # 两个队列各自有序，合并排序接近线性
+    pending.sort(key=_event_time)
+    if flush:
+        ready = len(pending)
+    else:
+        cutoff = time.perf_counter_ns() - CONSUMER_HOLDBACK_NS
+        ready = len(pending)
+        while ready > 0 and pending[ready - 1][1] > cutoff:
+            ready -= 1
+    for i in range(ready):
+        _store_event(engine, pending[i])
+    del pending[:ready]
+
+
+def get_capture_stats(engine):
+    """返回采集队列的计数信息"""
+    mouse_stats = engine.mouse_queue.stats()
+    keyboard_stats = engine.keyboard_queue.stats()
+    return {
+        'mouse': mouse_stats,
+        'keyboard': keyboard_stats,
+        'dropped': mouse_stats['dropped'] + keyboard_stats['dropped'],
+        'overflows': mouse_stats['overflows'] + keyboard_stats['overflows'],
+        'moves': engine.move_policy.stats()
+    }
+
 
 # 录制函数
-# 功能：开始录制操作序列
-def start_recording():
-    """开始录制操作序列"""
-    # 设置录制状态为 True
-    utils.is_recording = True
-    # 清空之前的操作序列
-    utils.recorded_operations = []
-    # 记录录制开始时间
-    utils.recording_start_time = time.time()
-    
+# 功能：开始录制操作序列，并在当前线程中消费采集队列
+def start_recording(engine=None):
+    """开始录制操作序列
+
+    由 AutomationEngine.start 在录制线程中调用（引擎已处于录制状态），直到录制被停止才返回
+    """
+    if engine is None:
+        engine = default_engine
+    # 按当前配置创建鼠标移动采样策略
+    engine.move_policy = MoveCapturePolicy(utils.capture_mode, utils.capture_max_hz, utils.capture_min_distance)
+    # 清空之前的操作序列和采集队列（钩子线程只在监听器启动后写入队列）
+    engine.recorded_operations = []
+    engine.mouse_queue.reset()
+    engine.keyboard_queue.reset()
+    # 记录录制开始时间：单调时钟用于计算时间戳，墙上时间只保存在序列元数据中
+    engine.recording_start_time = time.perf_counter_ns()
+    engine.recording_start_wall_time = time.time()
+    engine.sequence_meta = {
+        'start_wall_time': engine.recording_start_wall_time,  # 录制开始的墙上时间
+        'time_unit': 'us',                                    # 时间戳单位：微秒
+        'clock': 'perf_counter_ns',                           # 时间戳来源的时钟
+        screen_geometry.META_KEY: screen_geometry.current_geometry(0)  # 录制时的屏幕配置（重新枚举），播放时据此换算坐标
+    }
+
+    # 点击图像锚定：在后台持续截取指针周围的画面，按下时使用按下之前的画面
+    engine.anchor_frames = None
+    if utils.anchor_clicks:
+        engine.anchor_frames = template_match.PreClickFrames(utils.anchor_template_size)
+        engine.anchor_frames.start()
+
     # 启动鼠标监听器
     # 创建鼠标监听器，绑定移动和点击事件处理函数
     mouse_listener = mouse.Listener(
-        on_move=on_move,      # 鼠标移动事件处理
-        on_click=on_click      # 鼠标点击事件处理
+        on_move=lambda x, y: on_move(engine, x, y),      # 鼠标移动事件处理
+        on_click=lambda x, y, button, pressed: on_click(engine, x, y, button, pressed)  # 鼠标点击事件处理
     )
     # 设置为守护线程，主程序退出时自动退出
     mouse_listener.daemon = True
     # 启动鼠标监听器
     mouse_listener.start()
-    
+
     # 启动键盘监听器
     # 创建键盘监听器，绑定按下和释放事件处理函数
     keyboard_listener = keyboard.Listener(
-        on_press=on_press,     # 键盘按下事件处理
-        on_release=on_release  # 键盘释放事件处理
+        on_press=lambda key: on_press(engine, key),     # 键盘按下事件处理
+        on_release=lambda key: on_release(engine, key)  # 键盘释放事件处理
     )
     # 设置为守护线程
     keyboard_listener.daemon = True
     # 启动键盘监听器
     keyboard_listener.start()
-    
-    # 等待录制结束
-    # 循环检查录制状态，直到录制被停止
-    while utils.is_recording:
+
+    # 消费采集队列，直到录制被停止
+    pending = []
+    while engine.is_recording:
+        drain_capture_queues(engine, pending)
         # 短暂休眠，减少CPU占用，同时保持响应速度
-        time.sleep(0.01)  # 10毫秒
-    
+        time.sleep(0.005)  # 5毫秒
+
     # 确保监听器停止
     try:
         # 停止鼠标监听器
@@ -258,21 +429,40 @@ def start_recording():
         # 捕获可能的异常，确保程序不会崩溃
         pass
 
-# 停止录制函数
-# 功能：停止录制操作序列
-def stop_recording():
-    """停止录制操作序列"""
-    # 立即设置录制状态为 False
-    utils.is_recording = False
+    # 写入剩余事件，并补记最后的指针位置
+    drain_capture_queues(engine, pending, flush=True)
+    _flush_pending_move(engine)
+    if engine.anchor_frames is not None:
+        engine.anchor_frames.stop()
+        engine.anchor_frames = None
+
     # 确保修饰键状态被重置
     # 防止修饰键状态残留影响后续操作
-    utils.modifier_keys = {
-        'ctrl': False,   # 重置Ctrl键状态
-        'shift': False,  # 重置Shift键状态
-        'alt': False,    # 重置Alt键状态
-        'win': False     # 重置Win键状态
-    }
-    # 发送录制停止信号
-    utils.recording_signals.stopped.emit()
-    
+    engine.reset_modifier_keys()
+
+    # 记录采集统计
+    engine.capture_stats = get_capture_stats(engine)
+    move_stats = engine.capture_stats['moves']
+    utils.logger.info("录制结束，共 %d 个操作，丢弃事件 %d 个，溢出 %d 次", len(engine.recorded_operations),
+                      engine.capture_stats['dropped'], engine.capture_stats['overflows'])
+    utils.logger.info("鼠标移动采样（%s）：收到 %d 个，记录 %d 个，节省 %.1f%%（约 %.1f KB）", move_stats['mode'],
+                      move_stats['seen'], move_stats['recorded'], move_stats['saved_ratio'] * 100,
+                      move_stats['saved_bytes'] / 1024)
+    if metrics.enabled:
+        metrics.CAPTURE_QUEUE_DROPPED.labels('mouse').set(engine.capture_stats['mouse']['dropped'])
+        metrics.CAPTURE_QUEUE_DROPPED.labels('keyboard').set(engine.capture_stats['keyboard']['dropped'])
+        utils.write_metrics()
 
+    # 回到空闲状态后通知界面（所有事件写入完成后再通知）
+    engine.finish()
+    if engine.on_recording_stopped is not None:
+        engine.on_recording_stopped()
+
+# 停止录制函数
+# 功能：停止录制操作序列
+def stop_recording(engine=None):
+    """停止录制操作序列"""
+    if engine is None:
+        engine = default_engine
+    # 请求停止，录制线程会写入剩余事件、重置修饰键状态并发送录制停止信号
+    engine.request_stop()
@@ -0,0 +1,589 @@
+# 定时播放
+# 功能：按类似 cron 的触发规则定时或周期性地播放序列或播放列表。任务保存在 schedule.json 中，程序重启后继续按计划运行；
+#      所有任务共用同一套鼠标键盘，同一时刻只运行一个任务，到期的任务按优先级排队；
+#      程序未运行或前一个任务占用输入设备而错过的运行，按任务的错过策略处理
+#
+# 触发规则：
+#   cron 表达式（分 时 日 月 周）：'*/15 * * * *' 每15分钟，'0 9 * * 1-5' 工作日9点
+#   '@every 15m'（单位 s/m/h/d）按固定间隔，'@hourly'、'@daily'、'@weekly'、'@monthly'
+#
+# 错过策略：
+#   'skip' 跳过错过的运行，等下一次；'once' 补运行一次；'all' 错过几次补运行几次（最多 MAX_CATCH_UP_RUNS 次）
+#
+# 用法：python scheduler.py run                                        无界面运行定时任务
+#      python scheduler.py list                                       列出任务
+#      python scheduler.py add 名称 --sequence 序列 --trigger '0 9 * * *' [--priority N] [--missed skip|once|all]
+#      python scheduler.py remove 名称
+#      python scheduler.py next '*/15 * * * *' [--count 5]           显示触发规则接下来的触发时间
+import argparse
+import heapq
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+import utils
+import sequence
+import playlist
+import player
+from engine import AutomationEngine, STATE_PLAYING, STATE_STOPPING
+
+# 任务文件格式版本
+# 版本1：{'format_version', 'jobs': [任务, ...]}，任务字段见 make_job
+SCHEDULE_FORMAT_VERSION = 1
+
+# 任务目标类型
+TARGET_SEQUENCE = 'sequence'
+TARGET_PLAYLIST = 'playlist'
+
+# 错过策略
+MISSED_SKIP = 'skip'
+MISSED_ONCE = 'once'
+MISSED_ALL = 'all'
+MISSED_POLICIES = (MISSED_SKIP, MISSED_ONCE, MISSED_ALL)
+
+# 'all' 策略最多补运行的次数（如程序停了一整夜的 '@every 1m' 任务）
+MAX_CATCH_UP_RUNS = 10
+
+# 计划线程最长的等待时间（秒）：计划按墙上时间计算，系统休眠或调整时钟后最迟这么久重新检查
+MAX_WAIT_SECONDS = 60
+
+# cron 各字段的取值范围
+CRON_FIELDS = (
+    ('分', 0, 59),
+    ('时', 0, 23),
+    ('日', 1, 31),
+    ('月', 1, 12),
+    ('周', 0, 7),  # 0 和 7 都是周日
+)
+
+CRON_ALIASES = {
+    '@hourly': '0 * * * *',
+    '@daily': '0 0 * * *',
+    '@weekly': '0 0 * * 0',
+    '@monthly': '0 0 1 * *',
+}
+
+INTERVAL_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+# 查找下一个触发时间时最多向后查找的年数（如 '0 0 31 2 *' 永远不会触发）
+MAX_SEARCH_YEARS = 5
+
+
+class CronTrigger:
+    """cron 表达式触发规则（本地时间，精确到分钟）"""
+
+    def __init__(self, text):
+        parts = text.split()
+        if len(parts) != 5:
+            raise ValueError(f'cron 表达式应有5个字段（分 时 日 月 周）: {text!r}')
+        fields = [_parse_cron_field(part, name, low, high) for part, (name, low, high) in zip(parts, CRON_FIELDS)]
+        self.minutes, self.hours, self.days, self.months, weekdays = fields
+        self.weekdays = {day % 7 for day in weekdays}
+        # 日和周都有限制时满足其一即可（与 cron 相同），否则两者都要满足
+        self.days_restricted = parts[2] != '*'
+        self.weekdays_restricted = parts[4] != '*'
+        self.text = text
+
+    def _day_matches(self, dt):
+        weekday = (dt.weekday() + 1) % 7  # cron 中周日为0
+        if self.days_restricted and self.weekdays_restricted:
+            return dt.day in self.days or weekday in self.weekdays
+        return dt.day in self.days and weekday in self.weekdays
+
+    def next_after(self, timestamp):
+        """返回 timestamp 之后的第一个触发时间（time.time() 读数），永远不会触发时返回 None"""
+        dt = datetime.fromtimestamp(timestamp).replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = dt.replace(year=dt.year + MAX_SEARCH_YEARS, day=1)
+        # 从大到小逐个字段跳到下一个可能的值，而不是逐分钟检查
+        while dt < limit:
+            if dt.month not in self.months:
+                dt = (dt.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+            elif not self._day_matches(dt):
+                dt = dt.replace(hour=0, minute=0) + timedelta(days=1)
+            elif dt.hour not in self.hours:
+                dt = dt.replace(minute=0) + timedelta(hours=1)
+            elif dt.minute not in self.minutes:
+                dt += timedelta(minutes=1)
+            else:
+                return dt.timestamp()
+        return None
+
+
+class IntervalTrigger:
+    """固定间隔触发规则"""
+
+    def __init__(self, seconds, text):
+        if seconds <= 0:
+            raise ValueError(f'间隔必须大于0: {text!r}')
+        self.seconds = seconds
+        self.text = text
+
+    def next_after(self, timestamp):
+        """返回 timestamp 之后一个间隔的时间"""
+        return timestamp + self.seconds
+
+
+def _parse_cron_field(text, name, low, high):
+    """解析 cron 字段（支持 *、a-b、列表和 /步长），返回取值集合"""
+    values = set()
+    for part in text.split(','):
+        step = 1
+        if '/' in part:
+            part, step_text = part.split('/', 1)
+            if not step_text.isdigit() or int(step_text) < 1:
+                raise ValueError(f'{name}字段步长无效: {text!r}')
+            step = int(step_text)
+        if part == '*':
+            start, end = low, high
+        elif '-' in part:
+            start_text, end_text = part.split('-', 1)
+            if not start_text.isdigit() or not end_text.isdigit():
+                raise ValueError(f'{name}字段范围无效: {text!r}')
+            start, end = int(start_text), int(end_text)
+        elif part.isdigit():
+            start = int(part)
+            # 'a/n' 表示从 a 开始每 n 个
+            end = high if step > 1 else start
+        else:
+            raise ValueError(f'{name}字段无效: {text!r}')
+        if start < low or end > high or start > end:
+            raise ValueError(f'{name}字段超出范围 {low}-{high}: {text!r}')
+        values.update(range(start, end + 1, step))
+    return values
+
+
+def parse_trigger(text):
+    """解析触发规则，返回 CronTrigger 或 IntervalTrigger
+
+    Raises:
+        ValueError: 触发规则无效
+    """
+    text = text.strip()
+    if text.startswith('@every'):
+        value = text[len('@every'):].strip()
+        if len(value) < 2 or value[-1] not in INTERVAL_UNITS or not value[:-1].isdigit():
+            raise ValueError(f'间隔应为数字加单位 s/m/h/d，如 @every 15m: {text!r}')
+        return IntervalTrigger(int(value[:-1]) * INTERVAL_UNITS[value[-1]], text)
+    return CronTrigger(CRON_ALIASES.get(text, text))
+
+
+# 创建任务
+def make_job(name, target, trigger, target_type=TARGET_SEQUENCE, priority=0, loops=1, speed=1.0,
+             missed=MISSED_ONCE, enabled=True):
+    """创建定时任务
+
+    Args:
+        name: 任务名称
+        target: 要播放的序列名称或播放列表名称
+        trigger: 触发规则，见 parse_trigger
+        target_type: TARGET_SEQUENCE 或 TARGET_PLAYLIST
+        priority: 优先级，同时到期的任务中数值大的先运行
+        loops: 播放遍数（播放序列时）
+        speed: 播放速度倍数（播放序列时）
+        missed: 错过策略，见 MISSED_POLICIES
+
+    Raises:
+        ValueError: 触发规则或参数无效
+    """
+    parse_trigger(trigger)
+    if target_type not in (TARGET_SEQUENCE, TARGET_PLAYLIST):
+        raise ValueError(f'未知的任务目标类型: {target_type!r}')
+    if missed not in MISSED_POLICIES:
+        raise ValueError(f'未知的错过策略: {missed!r}')
+    return {
+        'name': name,
+        'target': target,
+        'target_type': target_type,
+        'trigger': trigger,
+        'priority': int(priority),
+        'loops': max(int(loops), 1),
+        'speed': playlist.check_speed(speed),
+        'missed': missed,
+        'enabled': bool(enabled),
+        'next_run': None,     # 下一次计划运行的时间（time.time() 读数），由调度器维护
+        'last_run': None,     # 最近一次开始运行的时间
+        'last_result': ''     # 最近一次运行的结果：'finished'、'stopped' 或 'failed: 原因'
+    }
+
+
+# 读取任务文件
+def read_schedule_file(path):
+    """读取任务文件，返回任务列表，文件不存在时返回空列表"""
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    jobs = []
+    for item in data.get('jobs', []):
+        job = make_job(item['name'], item['target'], item['trigger'], item.get('target_type', TARGET_SEQUENCE),
+                       item.get('priority', 0), item.get('loops', 1), item.get('speed', 1.0),
+                       item.get('missed', MISSED_ONCE), item.get('enabled', True))
+        job['next_run'] = item.get('next_run')
+        job['last_run'] = item.get('last_run')
+        job['last_result'] = item.get('last_result', '')
+        jobs.append(job)
+    return jobs
+
+
+# 写入任务文件
+def write_schedule_file(path, jobs):
+    """以当前格式写入任务文件（先写临时文件再替换，写入中断时不会损坏原文件）"""
+    data = {
+        'format_version': SCHEDULE_FORMAT_VERSION,
+        'jobs': jobs
+    }
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(temp_path, path)
+
+
+def count_missed(trigger, next_run, now):
+    """返回 next_run 到 now 之间错过的触发次数，以及 now 之后的下一个触发时间"""
+    missed = 0
+    while next_run is not None and next_run <= now:
+        missed += 1
+        if missed > MAX_CATCH_UP_RUNS:
+            # 错过太多次时不再逐个计算，直接从现在开始
+            return missed, trigger.next_after(now)
+        next_run = trigger.next_after(next_run)
+    return missed, next_run
+
+
+class Scheduler:
+    """定时任务调度器
+
+    - 计划线程用最小堆按下一次运行时间排列任务，在条件变量上等待到堆顶任务到期（添加或删除任务时被唤醒），不轮询
+    - 到期的运行放入就绪堆，按（优先级，到期时间）排序；运行线程依次取出，等引擎空闲后播放，播放结束后才取下一个，
+      因此任务之间（以及与界面启动的播放之间）不会同时操作鼠标键盘
+    - 任务还在就绪堆中等待时又到期，按错过策略合并：'all' 增加补运行次数，其他策略不重复排队
+    """
+
+    def __init__(self, engine, path=None):
+        self.engine = engine
+        self.path = path or utils.schedule_file
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)   # 任务或就绪堆变化时通知
+        self._engine_changed = threading.Condition()      # 引擎状态变化时通知
+        self._jobs = {}           # 名称 -> 任务
+        self._versions = {}       # 名称 -> 版本号：任务被修改或删除后，堆中旧的条目作废
+        self._timers = []         # 计划堆：(下一次运行时间, 序号, 名称, 版本号)
+        self._ready = []          # 就绪堆：(-优先级, 到期时间, 序号, 名称)
+        self._pending_runs = {}   # 名称 -> 就绪堆中等待的运行次数
+        self._counter = itertools.count()
+        self._running = False
+        self._threads = []
+        self.current_job = ''     # 正在运行的任务名称
+        for job in read_schedule_file(self.path):
+            self._jobs[job['name']] = job
+
+    def jobs(self):
+        """返回所有任务的副本（按名称排序）"""
+        with self._lock:
+            return [dict(self._jobs[name]) for name in sorted(self._jobs)]
+
+    def add_job(self, job):
+        """添加或替换任务，并保存任务文件"""
+        with self._lock:
+            job = dict(job, next_run=None)
+            self._jobs[job['name']] = job
+            if self._running:
+                self._schedule(job, time.time())
+            self._save()
+            self._changed.notify_all()
+        utils.logger.info("定时任务已添加: %s（%s）", job['name'], job['trigger'])
+
+    def remove_job(self, name):
+        """删除任务，返回是否存在"""
+        with self._lock:
+            if self._jobs.pop(name, None) is None:
+                return False
+            self._versions[name] = self._versions.get(name, 0) + 1
+            self._pending_runs.pop(name, None)
+            self._save()
+            self._changed.notify_all()
+        utils.logger.info("定时任务已删除: %s", name)
+        return True
+
+    def _save(self):
+        try:
+            write_schedule_file(self.path, [self._jobs[name] for name in sorted(self._jobs)])
+        except OSError as e:
+            utils.logger.error("保存定时任务失败: %s", e)
+
+    def _schedule(self, job, now):
+        """计算任务的下一次运行时间并放入计划堆（在锁内调用）
+
+        任务保存的下一次运行时间已经过去时，按错过策略放入就绪堆
+        """
+        name = job['name']
+        version = self._versions.get(name, 0) + 1
+        self._versions[name] = version
+        if not job['enabled']:
+            return
+        trigger = parse_trigger(job['trigger'])
+        next_run = job['next_run']
+        if next_run is None:
+            next_run = trigger.next_after(now)
+        elif next_run <= now:
+            missed, next_run = count_missed(trigger, next_run, now)
+            utils.logger.info("定时任务 %s 错过 %d 次运行，错过策略: %s", name, missed, job['missed'])
+            self._enqueue(job, now, missed, missed=True)
+        job['next_run'] = next_run
+        if next_run is not None:
+            heapq.heappush(self._timers, (next_run, next(self._counter), name, version))
+
+    def _enqueue(self, job, due, runs, missed=False):
+        """把到期的运行放入就绪堆（在锁内调用）
+
+        missed 为 True 表示这些运行已经错过了计划时间，按错过策略处理
+        """
+        name = job['name']
+        pending = self._pending_runs.get(name, 0)
+        if pending:
+            # 上一次到期的运行还在等待（输入设备被占用），这次也算错过：只有 'all' 策略累加次数
+            if job['missed'] == MISSED_ALL:
+                self._pending_runs[name] = min(pending + runs, MAX_CATCH_UP_RUNS)
+            return
+        if missed and job['missed'] == MISSED_SKIP:
+            return
+        if job['missed'] != MISSED_ALL:
+            runs = 1
+        self._pending_runs[name] = min(runs, MAX_CATCH_UP_RUNS)
+        heapq.heappush(self._ready, (-job['priority'], due, next(self._counter), name))
+        self._changed.notify_all()
+
+    def start(self):
+        """启动计划线程和运行线程"""
+        with self._lock:
+            if self._running:
+                return
+            self._running = True
+            now = time.time()
+            for job in self._jobs.values():
+                self._schedule(job, now)
+            self._save()
+        self.engine.add_listener(self._on_engine_event)
+        for target in (self._timer_loop, self._run_loop):
+            thread = threading.Thread(target=target)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+        utils.logger.info("定时任务调度器已启动，共 %d 个任务", len(self._jobs))
+
+    def stop(self, stop_playback=False):
+        """停止调度，stop_playback 为 True 时同时停止正在运行的任务"""
+        with self._lock:
+            self._running = False
+            self._changed.notify_all()
+        with self._engine_changed:
+            self._engine_changed.notify_all()
+        self.engine.remove_listener(self._on_engine_event)
+        if stop_playback and self.current_job:
+            self.engine.request_stop()
+        for thread in self._threads:
+            thread.join(1.0)
+        self._threads = []
+
+    def _on_engine_event(self, event, fields):
+        if event == 'state':
+            with self._engine_changed:
+                self._engine_changed.notify_all()
+
+    def _timer_loop(self):
+        """计划线程：等到堆顶任务到期，放入就绪堆并计算下一次运行时间"""
+        with self._lock:
+            while self._running:
+                now = time.time()
+                while self._timers and self._timers[0][0] <= now:
+                    due, _, name, version = heapq.heappop(self._timers)
+                    job = self._jobs.get(name)
+                    if job is None or self._versions.get(name) != version:
+                        continue  # 任务已被修改或删除
+                    trigger = parse_trigger(job['trigger'])
+                    self._enqueue(job, due, 1)
+                    job['next_run'] = trigger.next_after(due)
+                    if job['next_run'] is not None and job['next_run'] <= now:
+                        # 之后的运行时间也已经过去（如系统休眠后），按错过策略处理后从现在开始计划
+                        missed, job['next_run'] = count_missed(trigger, job['next_run'], now)
+                        self._enqueue(job, now, missed, missed=True)
+                    if job['next_run'] is not None:
+                        heapq.heappush(self._timers, (job['next_run'], next(self._counter), name, version))
+                    self._save()
+                timeout = MAX_WAIT_SECONDS
+                if self._timers:
+                    timeout = min(max(self._timers[0][0] - now, 0), MAX_WAIT_SECONDS)
+                self._changed.wait(timeout)
+
+    def _run_loop(self):
+        """运行线程：按优先级依次运行就绪的任务，同一时刻只运行一个"""
+        while True:
+            with self._lock:
+                while self._running and not self._ready:
+                    self._changed.wait()
+                if not self._running:
+                    return
+                _, _, _, name = heapq.heappop(self._ready)
+                runs = self._pending_runs.pop(name, 0)
+                job = self._jobs.get(name)
+                if job is None or runs == 0:
+                    continue
+                job = dict(job)
+            self._run_job(job, runs)
+
+    def _wait_engine_idle(self):
+        """等待引擎空闲，调度器停止时返回 False"""
+        with self._engine_changed:
+            while self._running and not self.engine.is_idle:
+                self._engine_changed.wait(MAX_WAIT_SECONDS)
+        return self._running
+
+    def _run_job(self, job, runs):
+        """运行任务 runs 次（合并为一次播放），结束后记录结果"""
+        name = job['name']
+        try:
+            if job['target_type'] == TARGET_PLAYLIST:
+                items = utils.playlists.get(job['target'])
+                if not items:
+                    raise ValueError(f'播放列表 "{job["target"]}" 不存在或为空')
+                items = items * runs
+            else:
+                items = [playlist.make_item(job['target'], job['loops'] * runs, job['speed'])]
+            compiled = player.compile_playlist(items)
+        except ValueError as e:
+            utils.logger.error("定时任务 %s 无法运行: %s", name, e)
+            self._record_result(name, time.time(), f'failed: {e}')
+            return
+
+        stopped = []
+        started = False
+        while not started:
+            if not self._wait_engine_idle():
+                return
+            self.current_job = name
+            self.engine.loop_count = 0
+            started = self.engine.start(STATE_PLAYING, self._play, compiled, stopped)
+        start_time = time.time()
+        utils.logger.info("定时任务 %s 开始运行（%d 次）", name, runs)
+        self.engine.join()
+        self.current_job = ''
+        result = 'stopped' if stopped else 'finished'
+        utils.logger.info("定时任务 %s 运行结束: %s", name, result)
+        self._record_result(name, start_time, result)
+
+    def _play(self, engine, compiled, stopped):
+        """播放线程：播放编译好的任务，记录是否被停止"""
+        def on_state(event, fields):
+            if event == 'state' and fields['state'] == STATE_STOPPING:
+                stopped.append(True)
+        engine.add_listener(on_state)
+        try:
+            player.play_playlist(engine, compiled)
+        finally:
+            engine.remove_listener(on_state)
+
+    def _record_result(self, name, start_time, result):
+        with self._lock:
+            job = self._jobs.get(name)
+            if job is None:
+                return
+            job['last_run'] = start_time
+            job['last_result'] = result
+            self._save()
+
+
+def _format_time(timestamp):
+    if timestamp is None:
+        return '-'
+    return datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='定时播放序列或播放列表')
+    parser.add_argument('--file', default=None, help='任务文件，默认为程序目录下的 schedule.json')
+    commands = parser.add_subparsers(dest='command', required=True)
+    run = commands.add_parser('run', help='无界面运行定时任务')
+    run.add_argument('--profile', action='store_true', help='每次运行时进行采样性能分析（结果写入 logs/profiles）')
+    commands.add_parser('list', help='列出任务')
+    add = commands.add_parser('add', help='添加或替换任务')
+    add.add_argument('name')
+    target = add.add_mutually_exclusive_group(required=True)
+    target.add_argument('--sequence', help='要播放的序列')
+    target.add_argument('--playlist', help='要播放的播放列表')
+    add.add_argument('--trigger', required=True, help="触发规则，如 '*/15 * * * *'、'@every 15m'")
+    add.add_argument('--priority', type=int, default=0, help='优先级，同时到期时数值大的先运行')
+    add.add_argument('--loops', type=int, default=1, help='播放遍数')
+    add.add_argument('--speed', type=float, default=1.0, help='播放速度倍数')
+    add.add_argument('--missed', choices=MISSED_POLICIES, default=MISSED_ONCE, help='错过策略')
+    add.add_argument('--disabled', action='store_true', help='添加为停用的任务')
+    remove = commands.add_parser('remove', help='删除任务')
+    remove.add_argument('name')
+    show_next = commands.add_parser('next', help='显示触发规则接下来的触发时间')
+    show_next.add_argument('trigger')
+    show_next.add_argument('--count', type=int, default=5)
+    args = parser.parse_args(argv)
+    path = args.file or utils.schedule_file
+
+    try:
+        if args.command == 'next':
+            trigger = parse_trigger(args.trigger)
+            timestamp = time.time()
+            for _ in range(args.count):
+                timestamp = trigger.next_after(timestamp)
+                if timestamp is None:
+                    break
+                print(_format_time(timestamp))
+            return 0
+        if args.command == 'add':
+            if args.sequence:
+                job = make_job(args.name, args.sequence, args.trigger, TARGET_SEQUENCE, args.priority,
+                               args.loops, args.speed, args.missed, not args.disabled)
+            else:
+                job = make_job(args.name, args.playlist, args.trigger, TARGET_PLAYLIST, args.priority,
+                               missed=args.missed, enabled=not args.disabled)
+            jobs = [item for item in read_schedule_file(path) if item['name'] != args.name]
+            write_schedule_file(path, sorted(jobs + [job], key=lambda item: item['name']))
+            print(f'任务 "{args.name}" 已保存')
+            return 0
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+    if args.command == 'remove':
+        jobs = read_schedule_file(path)
+        remaining = [job for job in jobs if job['name'] != args.name]
+        if len(remaining) == len(jobs):
+            print(f'任务 "{args.name}" 不存在', file=sys.stderr)
+            return 1
+        write_schedule_file(path, remaining)
+        print(f'任务 "{args.name}" 已删除')
+        return 0
+    if args.command == 'list':
+        for job in read_schedule_file(path):
+            state = '' if job['enabled'] else '（已停用）'
+            print(f"{job['name']}{state}: {job['target_type']} {job['target']}，触发 {job['trigger']}，"
+                  f"优先级 {job['priority']}，错过策略 {job['missed']}，下次 {_format_time(job['next_run'])}，"
+                  f"上次 {_format_time(job['last_run'])} {job['last_result']}")
+        return 0
+
+    # 无界面运行：使用独立的引擎
+    utils.init_utils()
+    sequence.load_all_sequences()
+    playlist.load_all_playlists()
+    engine = AutomationEngine()
+    engine.profile = args.profile
+    scheduler = Scheduler(engine, path)
+    scheduler.start()
+    try:
+        while True:
+            time.sleep(MAX_WAIT_SECONDS)
+    except KeyboardInterrupt:
+        scheduler.stop(stop_playback=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,232 @@
+# 截图服务
+# 功能：按区域截取屏幕并转换为灰度图，短时间内缓存截图，同一时刻的多个检查（画面同步、图像锚点）共用一次截图；
+#      灰度缓冲区按区域复用，不为每次截图重新分配；记录截图耗时直方图
+import threading
+import time
+
+import numpy as np
+
+# 缓存参数
+DEFAULT_TTL = 0.03       # 截图缓存有效期（秒）
+MAX_CACHED_FRAMES = 8    # 最多缓存的区域截图数
+
+# 截图耗时直方图的桶上界（毫秒），最后一个桶收集更慢的截图
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+# 灰度换算权重（ITU-R BT.601）
+_GRAY_WEIGHTS = (0.299, 0.587, 0.114)
+
+
+def pyautogui_frame_source(region):
+    """默认截图源：用 pyautogui 截取区域 (left, top, width, height)，返回 NumPy 数组
+
+    超出主屏幕的部分被裁掉，返回的图像可能比请求的区域小
+    """
+    # 延迟导入，无界面环境下使用假截图源时不需要 pyautogui
+    import pyautogui
+    screen_width, screen_height = pyautogui.size()
+    left, top, width, height = region
+    width = min(width, screen_width - left)
+    height = min(height, screen_height - top)
+    return np.asarray(pyautogui.screenshot(region=(left, top, width, height)))
+
+
+class FakeFrameSource:
+    """假截图源，用于无界面环境
+
+    按调用顺序依次使用预设的整屏画面（用完后一直保持最后一帧），返回其中请求的区域
+    """
+
+    def __init__(self, frames):
+        self.frames = [np.asarray(frame) for frame in frames]
+        self.calls = 0
+
+    def __call__(self, region):
+        frame = self.frames[min(self.calls, len(self.frames) - 1)]
+        self.calls += 1
+        left, top, width, height = region
+        return frame[top:top + height, left:left + width]
+
+
+class LatencyHistogram:
+    """截图耗时直方图"""
+
+    def __init__(self, bounds_ms=LATENCY_BUCKETS_MS):
+        self.bounds_ms = tuple(bounds_ms)
+        self.clear()
+
+    def clear(self):
+        self.counts = [0] * (len(self.bounds_ms) + 1)
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def add(self, ms):
+        """记录一次耗时（毫秒）"""
+        index = 0
+        while index < len(self.bounds_ms) and ms > self.bounds_ms[index]:
+            index += 1
+        self.counts[index] += 1
+        self.total_ms += ms
+        if ms > self.max_ms:
+            self.max_ms = ms
+
+    def snapshot(self):
+        """返回统计字典，buckets 为 [(上界毫秒或 None, 次数), ...]"""
+        count = sum(self.counts)
+        return {
+            'count': count,
+            'mean_ms': self.total_ms / count if count else 0.0,
+            'max_ms': self.max_ms,
+            'buckets': list(zip(self.bounds_ms + (None,), self.counts))
+        }
+
+
+class _CachedFrame:
+    """一个区域的灰度截图及其复用的缓冲区"""
+
+    def __init__(self, region, gray):
+        self.region = region
+        self.gray = gray
+        self.scratch = np.empty_like(gray)
+        self.captured_at = 0.0
+
+    def contains(self, region):
+        left, top, width, height = region
+        own_left, own_top, own_width, own_height = self.region
+        return (own_left <= left and own_top <= top and
+                left + width <= own_left + own_width and top + height <= own_top + own_height)
+
+    def view(self, region):
+        """返回区域在缓存截图中的只读视图"""
+        left = region[0] - self.region[0]
+        top = region[1] - self.region[1]
+        return self.gray[top:top + region[3], left:left + region[2]]
+
+
+class ScreenCapture:
+    """截图服务
+
+    - 请求的区域被有效期内的某个缓存截图完全包含时，直接返回该截图的视图，不再截图
+    - 否则只截取请求的区域；优先复用同尺寸的过期缓存的缓冲区写入灰度结果，不重新分配
+    - 返回的灰度图是只读视图，内容在缓冲区被复用时会被覆盖，需要保留时由调用方复制
+    """
+
+    def __init__(self, source=None, ttl=DEFAULT_TTL, max_frames=MAX_CACHED_FRAMES, clock=time.perf_counter):
+        self.source = source if source is not None else pyautogui_frame_source
+        self.ttl = ttl
+        self.max_frames = max_frames
+        self.clock = clock
+        self.latency = LatencyHistogram()
+        self.captures = 0
+        self.cache_hits = 0
+        self.allocations = 0
+        self._frames = []
+        self._lock = threading.Lock()
+
+    def set_source(self, source):
+        """替换截图源并清空缓存，返回原来的截图源"""
+        with self._lock:
+            previous = self.source
+            self.source = source
+            self._frames = []
+            return previous
+
+    def grab_gray(self, region, max_age=None):
+        """截取区域的 float32 灰度图
+
+        Args:
+            region: (left, top, width, height)，左上角小于0的部分被裁掉
+            max_age: 可接受的缓存截图最大年龄（秒），默认为 ttl；为0时总是重新截图（截图仍会放入缓存供其他检查共用）
+
+        Returns:
+            numpy.ndarray: 只读灰度图，超出屏幕时可能比请求的区域小
+        """
+        left, top, width, height = (int(v) for v in region)
+        if left < 0:
+            width += left
+            left = 0
+        if top < 0:
+            height += top
+            top = 0
+        region = (left, top, max(width, 0), max(height, 0))
+        if max_age is None:
+            max_age = self.ttl
+        with self._lock:
+            now = self.clock()
+            if max_age > 0:
+                for frame in self._frames:
+                    if now - frame.captured_at <= max_age and frame.contains(region):
+                        self.cache_hits += 1
+                        return frame.view(region)
+            started = self.clock()
+            image = np.asarray(self.source(region))
+            frame = self._frame_for(region, image.shape[:2], now)
+            self._convert(image, frame)
+            finished = self.clock()
+            frame.captured_at = finished
+            self.captures += 1
+            self.latency.add((finished - started) * 1000)
+            return frame.view(region)
+
+    def _frame_for(self, region, shape, now):
+        """取用于保存新截图的缓存项：优先复用同尺寸的过期缓冲区，其次淘汰最旧的缓存"""
+        reusable = None
+        for frame in self._frames:
+            if frame.gray.shape == shape and (frame.region == region or now - frame.captured_at > self.ttl):
+                reusable = frame
+                break
+        if reusable is not None:
+            self._frames.remove(reusable)
+            reusable.region = region
+        else:
+            if len(self._frames) >= self.max_frames:
+                self._frames.pop(0)
+            reusable = _CachedFrame(region, np.empty(shape, dtype=np.float32))
+            self.allocations += 1
+        # 最新的截图放在最后，查找时最旧的在前，淘汰时也从最旧的开始
+        self._frames.append(reusable)
+        return reusable
+
+    @staticmethod
+    def _convert(image, frame):
+        """把截图转换为灰度写入缓存项的缓冲区"""
+        gray = frame.gray
+        gray.flags.writeable = True
+        if image.ndim == 3:
+            np.multiply(image[..., 0], _GRAY_WEIGHTS[0], out=gray, casting='unsafe')
+            for channel in (1, 2):
+                np.multiply(image[..., channel], _GRAY_WEIGHTS[channel], out=frame.scratch, casting='unsafe')
+                np.add(gray, frame.scratch, out=gray)
+        else:
+            np.copyto(gray, image, casting='unsafe')
+        gray.flags.writeable = False
+
+    def invalidate(self):
+        """清空缓存（如执行了会改变画面的操作后）"""
+        with self._lock:
+            for frame in self._frames:
+                frame.captured_at = float('-inf')
+
+    def stats(self):
+        """返回统计字典：截图次数、缓存命中次数、缓冲区分配次数和截图耗时直方图"""
+        with self._lock:
+            return {
+                'captures': self.captures,
+                'cache_hits': self.cache_hits,
+                'allocations': self.allocations,
+                'latency': self.latency.snapshot()
+            }
+
+
+# 全局截图服务
+capture_service = ScreenCapture()
+
+
+def set_frame_source(source):
+    """替换全局截图服务的截图源（如测试时使用 FakeFrameSource），返回原来的截图源"""
+    return capture_service.set_source(source)
+
+
+def grab_gray(region, max_age=None):
+    """用全局截图服务截取区域的灰度图"""
+    return capture_service.grab_gray(region, max_age)
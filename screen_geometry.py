@@ -0,0 +1,271 @@
+# 屏幕配置与坐标换算
+# 功能：录制时把屏幕配置（各显示器在虚拟桌面中的位置和大小、主显示器、缩放比例）保存到序列元数据；
+#      播放前按录制时和当前的屏幕配置，把序列中的坐标换算到当前屏幕，分辨率、DPI 缩放或显示器排列改变后不需要重新录制
+#
+# 换算规则：每个坐标先确定录制时所在的显示器（不在任何显示器内时取最近的），换算为在该显示器中的相对位置，
+#          再映射到当前对应的显示器：主显示器对应主显示器，其余显示器按位置（从左到右、从上到下）依次对应，
+#          当前没有对应显示器时映射到主显示器。坐标和画面同步区域一起用 NumPy 向量化计算。
+#          图像锚点的模板按多个缩放比例匹配，不需要换算。缩放比例只保存不参与换算：显示器区域已是输入坐标系中的区域
+#
+# 换算结果按 (序列名, 屏幕配置) 缓存（已保存的序列和引擎当前的序列分开缓存），序列库发生变化
+# （sequence.library_version() 改变，包括原地编辑操作列表）时整体清空，缓存项同时记住换算所用的原列表，列表被替换时重新换算。
+# 当前屏幕配置缓存 GEOMETRY_CACHE_SECONDS 秒，连续播放时不必每次重新枚举显示器。
+# 录制时的屏幕配置与当前相同、序列没有保存屏幕配置（旧序列）或关闭了 utils.adapt_coordinates 时，原样返回操作列表
+import sys
+import threading
+import time
+
+import numpy as np
+
+import utils
+import op_store
+import sequence
+
+# 序列元数据中保存屏幕配置的字段
+META_KEY = 'screen'
+
+# 当前屏幕配置的缓存时间（秒）
+GEOMETRY_CACHE_SECONDS = 1.0
+
+# 换算后的序列缓存：(范围, 序列名, 屏幕配置键) -> (原操作列表, 录制时的屏幕配置, 换算后的操作列表)
+_adapted = {}
+_adapted_version = None
+_adapted_lock = threading.RLock()
+# 缓存统计：命中次数和换算次数
+adapt_stats = {'hits': 0, 'transforms': 0}
+# 最近一次取得的屏幕配置：(取得时间, 屏幕配置)
+_geometry_cache = None
+
+
+def _windows_monitors():
+    """用 Win32 API 枚举显示器，返回 [(left, top, width, height, 是否主显示器, 缩放比例), ...]"""
+    import ctypes
+    from ctypes import wintypes
+
+    class MONITORINFO(ctypes.Structure):
+        _fields_ = [('cbSize', wintypes.DWORD), ('rcMonitor', wintypes.RECT),
+                    ('rcWork', wintypes.RECT), ('dwFlags', wintypes.DWORD)]
+
+    user32 = ctypes.windll.user32
+    try:
+        shcore = ctypes.windll.shcore
+    except OSError:
+        # Windows 8.1 之前没有按显示器的 DPI
+        shcore = None
+    monitors = []
+
+    def callback(handle, hdc, rect, data):
+        info = MONITORINFO()
+        info.cbSize = ctypes.sizeof(MONITORINFO)
+        if user32.GetMonitorInfoW(handle, ctypes.byref(info)):
+            r = info.rcMonitor
+            scale = 1.0
+            if shcore is not None:
+                dpi_x = ctypes.c_uint()
+                dpi_y = ctypes.c_uint()
+                if shcore.GetDpiForMonitor(handle, 0, ctypes.byref(dpi_x), ctypes.byref(dpi_y)) == 0:
+                    scale = dpi_x.value / 96
+            monitors.append((r.left, r.top, r.right - r.left, r.bottom - r.top, bool(info.dwFlags & 1), scale))
+        return True
+
+    enum_proc = ctypes.WINFUNCTYPE(wintypes.BOOL, wintypes.HMONITOR, wintypes.HDC,
+                                   ctypes.POINTER(wintypes.RECT), wintypes.LPARAM)
+    user32.EnumDisplayMonitors(None, None, enum_proc(callback), 0)
+    return monitors
+
+
+def current_geometry(max_age=GEOMETRY_CACHE_SECONDS):
+    """取当前的屏幕配置
+
+    坐标为虚拟桌面坐标，与录制钩子报告和 pyautogui 使用的坐标一致。Windows 上枚举所有显示器，
+    其他平台（或枚举失败时）只取主显示器的大小。max_age 秒内取得过的配置直接返回（调用方不要修改），为0时总是重新枚举
+
+    Returns:
+        dict: {'monitors': [[left, top, width, height], ...], 'primary': 主显示器下标, 'scales': [缩放比例, ...]}
+    """
+    global _geometry_cache
+    cached = _geometry_cache
+    if cached is not None and time.monotonic() - cached[0] < max_age:
+        return cached[1]
+    monitors = []
+    if sys.platform.startswith('win'):
+        try:
+            monitors = _windows_monitors()
+        except (OSError, AttributeError, ValueError) as e:
+            utils.logger.warning("枚举显示器失败: %s", e)
+    if not monitors:
+        import pyautogui
+        width, height = pyautogui.size()
+        monitors = [(0, 0, width, height, True, 1.0)]
+    primary = next((index for index, monitor in enumerate(monitors) if monitor[4]), 0)
+    geometry = {
+        'monitors': [[int(left), int(top), int(width), int(height)] for left, top, width, height, _, _ in monitors],
+        'primary': primary,
+        'scales': [round(monitor[5], 3) for monitor in monitors]
+    }
+    _geometry_cache = (time.monotonic(), geometry)
+    return geometry
+
+
+def geometry_key(geometry):
+    """屏幕配置的缓存键
+
+    只包含显示器区域和主显示器：坐标换算只用到显示器区域（与输入坐标同一坐标系，缩放改变时系统报告的区域随之改变），
+    缩放比例只作为录制时的信息保存，不参与比较，仅缩放比例不同时不换算
+    """
+    return (tuple(tuple(rect) for rect in geometry['monitors']), geometry.get('primary', 0))
+
+
+def _monitor_order(geometry):
+    """显示器对应顺序：主显示器在前，其余按位置（从左到右、从上到下）"""
+    primary = geometry.get('primary', 0)
+    others = sorted((index for index in range(len(geometry['monitors'])) if index != primary),
+                    key=lambda index: (geometry['monitors'][index][0], geometry['monitors'][index][1]))
+    return [primary] + others
+
+
+def build_mapping(recorded, current):
+    """计算录制时每个显示器对应的当前显示器区域
+
+    Returns:
+        tuple: (录制时的显示器区域数组 (M, 4), 对应的当前显示器区域数组 (M, 4))
+    """
+    source = np.asarray(recorded['monitors'], dtype=np.float64).reshape(-1, 4)
+    target_rects = np.asarray(current['monitors'], dtype=np.float64).reshape(-1, 4)
+    source_order = _monitor_order(recorded)
+    target_order = _monitor_order(current)
+    target = np.empty_like(source)
+    for rank, index in enumerate(source_order):
+        target[index] = target_rects[target_order[rank] if rank < len(target_order) else target_order[0]]
+    return source, target
+
+
+def locate_monitors(xs, ys, source):
+    """返回每个坐标所在的显示器下标数组（不在任何显示器内时为最近的显示器）"""
+    left, top, width, height = (source[:, n] for n in range(4))
+    # 每个坐标到每个显示器的距离（在显示器内为0）
+    dx = np.maximum(np.maximum(left[None, :] - xs[:, None], xs[:, None] - (left + width - 1)[None, :]), 0)
+    dy = np.maximum(np.maximum(top[None, :] - ys[:, None], ys[:, None] - (top + height - 1)[None, :]), 0)
+    return np.argmin(dx * dx + dy * dy, axis=1)
+
+
+def transform_points(xs, ys, source, target):
+    """把录制时的坐标数组换算到当前屏幕
+
+    Args:
+        xs, ys: 坐标数组
+        source, target: build_mapping 的结果
+
+    Returns:
+        tuple: (换算后的 x 数组, y 数组（浮点数）, 各坐标所在的显示器下标数组)
+    """
+    xs = np.asarray(xs, dtype=np.float64)
+    ys = np.asarray(ys, dtype=np.float64)
+    monitor = locate_monitors(xs, ys, source)
+    return ((xs - source[monitor, 0]) * (target[monitor, 2] / source[monitor, 2]) + target[monitor, 0],
+            (ys - source[monitor, 1]) * (target[monitor, 3] / source[monitor, 3]) + target[monitor, 1],
+            monitor)
+
+
+def adapt_operations(operations, meta, geometry=None):
+    """把操作序列中的坐标从录制时的屏幕配置换算到当前屏幕
+
+    需要换算的操作（鼠标操作的坐标、画面同步点的区域）被复制后修改，其余操作与原列表共用，原列表不变。
+
+    Args:
+        operations: 操作列表
+        meta: 序列元数据，其中 META_KEY 字段为录制时的屏幕配置
+        geometry: 当前屏幕配置，默认调用 current_geometry
+
+    Returns:
+        list: 与原列表一一对应的操作列表；不需要换算时原样返回 operations
+    """
+    recorded = meta.get(META_KEY) if meta else None
+    if not utils.adapt_coordinates or not recorded or not recorded.get('monitors') or not operations:
+        return operations
+    if geometry is None:
+        geometry = current_geometry()
+    if geometry_key(recorded) == geometry_key(geometry):
+        return operations
+    source, target = build_mapping(recorded, geometry)
+
+    point_indexes = [index for index, op in enumerate(operations) if 'x' in op]
+    region_indexes = [index for index, op in enumerate(operations) if 'region' in op]
+    adapted = list(operations)
+    if point_indexes:
+        xs = np.fromiter((operations[index]['x'] for index in point_indexes), dtype=np.float64, count=len(point_indexes))
+        ys = np.fromiter((operations[index]['y'] for index in point_indexes), dtype=np.float64, count=len(point_indexes))
+        new_xs, new_ys, _ = transform_points(xs, ys, source, target)
+        for index, x, y in zip(point_indexes, np.rint(new_xs).astype(np.int64).tolist(),
+                               np.rint(new_ys).astype(np.int64).tolist()):
+            op = op_store.copy_op(operations[index])
+            op['x'] = x
+            op['y'] = y
+            adapted[index] = op
+    if region_indexes:
+        regions = np.asarray([operations[index]['region'] for index in region_indexes], dtype=np.float64)
+        # 区域按左上角所在的显示器换算位置和大小
+        left, top, monitor = transform_points(regions[:, 0], regions[:, 1], source, target)
+        width = regions[:, 2] * (target[monitor, 2] / source[monitor, 2])
+        height = regions[:, 3] * (target[monitor, 3] / source[monitor, 3])
+        # 裁剪到目标显示器范围内（录制时超出显示器边缘的区域换算后不能伸到其他显示器或屏幕外）
+        monitor_right = target[monitor, 0] + target[monitor, 2]
+        monitor_bottom = target[monitor, 1] + target[monitor, 3]
+        left = np.clip(np.rint(left), target[monitor, 0], monitor_right - 1)
+        top = np.clip(np.rint(top), target[monitor, 1], monitor_bottom - 1)
+        width = np.clip(np.rint(width), 1, monitor_right - left)
+        height = np.clip(np.rint(height), 1, monitor_bottom - top)
+        new_regions = np.stack([left, top, width, height], axis=1)
+        for index, region in zip(region_indexes, new_regions.astype(np.int64).tolist()):
+            op = op_store.copy_op(adapted[index])
+            op['region'] = region
+            adapted[index] = op
+    utils.logger.info("坐标换算到当前屏幕：%d 个坐标，%d 个区域，录制时显示器 %s，当前 %s",
+                      len(point_indexes), len(region_indexes), recorded['monitors'], geometry['monitors'])
+    return adapted
+
+
+def _adapt_cached(key, original, meta, geometry):
+    """按缓存键取 original 换算后的操作列表，缓存中没有或已失效时换算并缓存（调用方持有 _adapted_lock）"""
+    global _adapted_version
+    version = sequence.library_version()
+    if _adapted_version != version:
+        _adapted.clear()
+        _adapted_version = version
+    recorded = meta.get(META_KEY) if meta else None
+    entry = _adapted.get(key)
+    if entry is not None and entry[0] is original and entry[1] == recorded:
+        adapt_stats['hits'] += 1
+        return entry[2]
+    operations = adapt_operations(original, meta, geometry)
+    if operations is not original:
+        adapt_stats['transforms'] += 1
+    _adapted[key] = (original, recorded, operations)
+    return operations
+
+
+def adapt_sequence(name, geometry=None):
+    """取已保存序列换算到当前屏幕后的操作列表
+
+    按序列名和屏幕配置缓存，同一序列在同一屏幕配置下只换算一次，多次调用返回同一个列表。
+
+    Raises:
+        读取序列失败时抛出原异常（同 sequence.get_sequence_operations）
+    """
+    if geometry is None:
+        geometry = current_geometry()
+    with _adapted_lock:
+        original = sequence.get_sequence_operations(name)
+        return _adapt_cached(('sequence', name, geometry_key(geometry)), original, utils.sequence_metas.get(name, {}),
+                             geometry)
+
+
+def adapt_current(name, operations, meta, geometry=None):
+    """取引擎当前序列（名称 name，可能尚未保存或有未保存的编辑）换算到当前屏幕后的操作列表
+
+    与 adapt_sequence 相同地按序列名和屏幕配置缓存，操作列表被替换、原地编辑或屏幕配置改变时重新换算
+    """
+    if geometry is None:
+        geometry = current_geometry()
+    with _adapted_lock:
+        return _adapt_cached(('current', name, geometry_key(geometry)), operations, meta, geometry)
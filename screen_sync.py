@@ -0,0 +1,152 @@
+# 画面同步
+# 功能：截取屏幕上的小区域并计算感知哈希（dHash），与录制时的参考哈希比较，
+#      用于播放时的“等待画面出现”同步点：画面一旦匹配就继续播放，不再依赖录制时的固定等待
+import time
+
+import numpy as np
+
+import screen_capture
+
+# 操作类型
+OP_WAIT_SCREEN = 'waitscreen'
+
+# 哈希参数
+HASH_SIZE = 8              # dHash 边长，哈希为 HASH_SIZE * HASH_SIZE 位
+DEFAULT_THRESHOLD = 6      # 默认允许的最大汉明距离（64 位中不同的位数）
+DEFAULT_TIMEOUT_US = 10000000  # 默认等待超时（微秒）
+
+# 超时处理方式
+ON_TIMEOUT_STOP = 'stop'          # 停止播放
+ON_TIMEOUT_CONTINUE = 'continue'  # 忽略并继续播放
+
+# 自适应轮询间隔（秒）：画面变化时使用最短间隔，画面静止时逐步放慢
+MIN_POLL_INTERVAL = 0.01
+MAX_POLL_INTERVAL = 0.2
+POLL_BACKOFF = 1.5
+
+# 灰度换算权重（ITU-R BT.601）
+_GRAY_WEIGHTS = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+
+def to_gray(image):
+    """转换为 float32 灰度图（已经是 float32 灰度图时直接返回）"""
+    image = np.asarray(image)
+    if image.ndim == 3:
+        return image[..., :3].astype(np.float32) @ _GRAY_WEIGHTS
+    return image.astype(np.float32, copy=False)
+
+
+def _bin_edges(size, bins):
+    """把长度 size 划分为 bins 段的起点下标，以及每段的长度（至少为1）"""
+    edges = np.linspace(0, size, bins + 1).astype(np.int64)
+    starts = np.minimum(edges[:-1], size - 1)
+    counts = np.maximum(np.diff(edges), 1)
+    return starts, counts
+
+
+def downscale(gray, width, height):
+    """按区域平均把灰度图缩小到 width x height"""
+    rows, row_counts = _bin_edges(gray.shape[0], height)
+    cols, col_counts = _bin_edges(gray.shape[1], width)
+    summed = np.add.reduceat(np.add.reduceat(gray, rows, axis=0), cols, axis=1)
+    return summed / row_counts[:, None] / col_counts[None, :]
+
+
+def region_hash(image):
+    """计算图像的 dHash：缩小为 HASH_SIZE x (HASH_SIZE + 1) 灰度图，比较水平相邻像素的亮度"""
+    gray = to_gray(image)
+    if gray.size == 0:
+        raise ValueError('截图区域为空')
+    small = downscale(gray, HASH_SIZE + 1, HASH_SIZE)
+    bits = small[:, 1:] > small[:, :-1]
+    return int.from_bytes(np.packbits(bits.ravel()).tobytes(), 'big')
+
+
+def hash_to_hex(value):
+    """哈希转换为十六进制字符串（保存到序列文件）"""
+    return f'{value:0{HASH_SIZE * HASH_SIZE // 4}x}'
+
+
+def hex_to_hash(text):
+    """十六进制字符串转换为哈希"""
+    return int(text, 16)
+
+
+def hamming_distance(a, b):
+    """两个哈希之间不同的位数"""
+    return bin(a ^ b).count('1')
+
+
+def make_wait_operation(region, timestamp_us, threshold=DEFAULT_THRESHOLD,
+                        timeout_us=DEFAULT_TIMEOUT_US, on_timeout=ON_TIMEOUT_STOP):
+    """截取区域的当前画面作为参考，创建“等待画面”操作
+
+    Args:
+        region: (left, top, width, height)
+        timestamp_us: 操作时间戳（微秒）
+        threshold: 允许的最大汉明距离
+        timeout_us: 等待超时（微秒，实际时间）
+        on_timeout: 超时处理方式，ON_TIMEOUT_STOP 或 ON_TIMEOUT_CONTINUE
+
+    Returns:
+        dict: 操作
+    """
+    region = [int(v) for v in region]
+    return {
+        'timestamp_us': timestamp_us,
+        'type': OP_WAIT_SCREEN,
+        'region': region,
+        'hash': hash_to_hex(region_hash(screen_capture.grab_gray(region, max_age=0))),
+        'threshold': threshold,
+        'timeout_us': timeout_us,
+        'on_timeout': on_timeout
+    }
+
+
+def wait_for_region(region, reference_hash, threshold=DEFAULT_THRESHOLD, timeout=None,
+                    should_continue=None, clock=time.perf_counter, sleep=time.sleep):
+    """轮询区域直到画面与参考哈希匹配
+
+    画面发生变化（与参考的距离改变）时按最短间隔轮询，画面静止时间隔逐步放慢到 MAX_POLL_INTERVAL。
+    每次轮询都重新截图，截图留在截图服务的缓存中，紧随其后的图像锚点查找可以直接使用。
+
+    Args:
+        region: (left, top, width, height)
+        reference_hash: 参考哈希（整数）
+        threshold: 允许的最大汉明距离
+        timeout: 超时（秒），None 使用 DEFAULT_TIMEOUT_US
+        should_continue: 返回 False 时放弃等待（如播放被停止），默认一直等待
+        clock: 计时函数（秒）
+        sleep: 休眠函数
+
+    Returns:
+        tuple: (是否匹配, 最后一次的汉明距离, 轮询次数, 等待耗时秒数)
+    """
+    if timeout is None:
+        timeout = DEFAULT_TIMEOUT_US / 1000000
+    started = clock()
+    deadline = started + timeout
+    interval = MIN_POLL_INTERVAL
+    last_distance = None
+    polls = 0
+    while True:
+        distance = hamming_distance(region_hash(screen_capture.grab_gray(region, max_age=0)), reference_hash)
+        polls += 1
+        now = clock()
+        if distance <= threshold:
+            return True, distance, polls, now - started
+        if now >= deadline or (should_continue is not None and not should_continue()):
+            return False, distance, polls, now - started
+        if last_distance is not None and distance != last_distance:
+            # 画面正在变化，目标可能马上出现
+            interval = MIN_POLL_INTERVAL
+        elif last_distance is not None:
+            interval = min(interval * POLL_BACKOFF, MAX_POLL_INTERVAL)
+        last_distance = distance
+        sleep(min(interval, deadline - now))
+
+
+def wait_for_operation(op, should_continue=None, clock=time.perf_counter, sleep=time.sleep):
+    """按“等待画面”操作的参数等待，参数和返回值同 wait_for_region"""
+    return wait_for_region(op['region'], hex_to_hash(op['hash']), op.get('threshold', DEFAULT_THRESHOLD),
+                           op.get('timeout_us', DEFAULT_TIMEOUT_US) / 1000000, should_continue, clock, sleep)
@@ -1,9 +1,87 @@
 import json
 import os
 import utils
+import metrics
+import op_store
+from engine import default_engine
+
+# 序列文件格式版本
+# 版本1：文件内容为操作列表，时间戳为浮点秒（'timestamp'）
+# 版本2：文件内容为 {'format_version', 'meta', 'operations'}，时间戳为整数微秒（'timestamp_us'）
+SEQUENCE_FORMAT_VERSION = 2
+
+# 调用子序列的操作类型
+OP_CALL = 'call'
+
+# 创建“调用序列”操作
+def make_call_operation(name, timestamp_us, offset_us=0, dx=0, dy=0):
+    """创建调用另一个已保存序列的操作
+
+    Args:
+        name: 被调用的序列名称
+        timestamp_us: 操作时间戳（微秒）
+        offset_us: 到达该操作后再等待多久开始播放子序列（序列时间，微秒）
+        dx, dy: 子序列中所有坐标的平移量（像素）
+    """
+    return {
+        'timestamp_us': timestamp_us,
+        'type': OP_CALL,
+        'sequence': name,
+        'offset_us': max(int(offset_us), 0),
+        'dx': dx,
+        'dy': dy
+    }
+
+# 转换旧格式操作
+def normalize_operations(operations):
+    """将旧格式的浮点秒时间戳原地转换为整数微秒
+
+    旧时间戳来自 time.time() 差值，其有效精度不高于微秒，四舍五入到微秒不会丢失记录到的时间信息
+    """
+    for op in operations:
+        if 'timestamp_us' not in op:
+            op['timestamp_us'] = utils.seconds_to_us(op.pop('timestamp', 0))
+    return operations
+
+# 序列库版本
+def library_version():
+    """序列库版本：保存、删除、重命名、重新加载序列或原地编辑任何操作列表（op_store 增量）后都会改变
+
+    用于使按序列名缓存的播放计划和坐标换算失效
+    """
+    return (utils.sequences_version, op_store.edit_version)
+
+# 读取序列文件
+def read_sequence_file(path):
+    """读取序列文件，兼容旧格式，返回 (操作列表, 元数据)"""
+    with metrics.span(metrics.SEQUENCE_LOAD_SECONDS):
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    if isinstance(data, list):
+        # 旧格式：没有元数据
+        operations, meta = data, {}
+    else:
+        operations, meta = data.get('operations', []), data.get('meta', {})
+    normalize_operations(operations)
+    meta.setdefault('time_unit', 'us')
+    return operations, meta
+
+# 写入序列文件
+def write_sequence_file(path, operations, meta):
+    """以当前格式写入序列文件"""
+    data = {
+        'format_version': SEQUENCE_FORMAT_VERSION,
+        'meta': meta,
+        'operations': operations
+    }
+    with metrics.span(metrics.SEQUENCE_SAVE_SECONDS):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
 
 # 保存序列
-def save_sequence(name):
+def save_sequence(name, engine=None):
+    if engine is None:
+        engine = default_engine
     if not name:
         return False, '序列名称不能为空'
     
@@ -11,47 +89,72 @@ def save_sequence(name):
     if not os.path.exists(utils.sequences_dir):
         os.makedirs(utils.sequences_dir)
     
-    # 保存到内存
-    utils.sequences[name] = utils.recorded_operations
-    utils.current_sequence = name
+    # 保存到内存：序列库保存副本，之后在界面中编辑当前序列不会修改序列库（保存前对被调用的序列没有影响）
+    utils.sequences[name] = op_store.copy_operations(engine.recorded_operations)
+    utils.sequence_metas[name] = dict(engine.sequence_meta)
+    engine.current_sequence = name
+    utils.sequences_version += 1
     
     # 保存到文件
     try:
-        with open(os.path.join(utils.sequences_dir, f'{name}.json'), 'w', encoding='utf-8') as f:
-            json.dump(utils.recorded_operations, f, ensure_ascii=False, indent=2)
+        write_sequence_file(os.path.join(utils.sequences_dir, f'{name}.json'), engine.recorded_operations, engine.sequence_meta)
         return True, f'序列 "{name}" 已保存'
     except Exception as e:
         return False, f'保存失败: {str(e)}'
 
 # 加载序列
-def load_sequence(name):
+def load_sequence(name, engine=None):
+    if engine is None:
+        engine = default_engine
     if not name:
         return False, '序列名称不能为空'
     
     # 从内存加载
+    # 引擎使用副本，在界面中编辑不会原地修改序列库中缓存的列表
     if name in utils.sequences:
-        utils.recorded_operations = utils.sequences[name]
-        utils.current_sequence = name
+        engine.recorded_operations = op_store.copy_operations(utils.sequences[name])
+        engine.sequence_meta = dict(utils.sequence_metas.get(name, {}))
+        engine.current_sequence = name
         return True, f'序列 "{name}" 已加载'
     
     # 从文件加载
     try:
-        with open(os.path.join(utils.sequences_dir, f'{name}.json'), 'r', encoding='utf-8') as f:
-            utils.recorded_operations = json.load(f)
-        utils.sequences[name] = utils.recorded_operations
-        utils.current_sequence = name
+        operations, meta = read_sequence_file(os.path.join(utils.sequences_dir, f'{name}.json'))
+        utils.sequences[name] = operations
+        utils.sequence_metas[name] = meta
+        engine.recorded_operations = op_store.copy_operations(operations)
+        engine.sequence_meta = dict(meta)
+        engine.current_sequence = name
         return True, f'序列 "{name}" 已从文件加载'
     except Exception as e:
         return False, f'加载失败: {str(e)}'
 
+# 取序列的操作列表
+def get_sequence_operations(name):
+    """取序列的操作列表（不切换当前序列）：优先使用内存中的序列，否则从文件读取并缓存到内存
+
+    Raises:
+        读取文件失败时抛出原异常（如 FileNotFoundError、json.JSONDecodeError）
+    """
+    if name in utils.sequences:
+        return utils.sequences[name]
+    operations, meta = read_sequence_file(os.path.join(utils.sequences_dir, f'{name}.json'))
+    utils.sequences[name] = operations
+    utils.sequence_metas[name] = meta
+    return operations
+
 # 删除序列
-def delete_sequence(name):
+def delete_sequence(name, engine=None):
+    if engine is None:
+        engine = default_engine
     if not name:
         return False, '序列名称不能为空'
     
     # 从内存删除
     if name in utils.sequences:
         del utils.sequences[name]
+    utils.sequence_metas.pop(name, None)
+    utils.sequences_version += 1
     
     # 从文件删除
     try:
@@ -59,8 +162,8 @@ def delete_sequence(name):
             os.remove(os.path.join(utils.sequences_dir, f'{name}.json'))
         
         # 如果当前序列被删除，清空当前序列
-        if utils.current_sequence == name:
-            utils.current_sequence = ""
+        if engine.current_sequence == name:
+            engine.current_sequence = ""
         
         return True, f'序列 "{name}" 已删除'
     except Exception as e:
@@ -69,6 +172,9 @@ def delete_sequence(name):
 # 加载所有序列
 def load_all_sequences():
     utils.sequences = {}
+    utils.sequence_metas = {}
+    utils.sequence_load_errors = {}
+    utils.sequences_version += 1
     
     # 从文件系统加载所有序列
     if os.path.exists(utils.sequences_dir):
@@ -76,14 +182,17 @@ def load_all_sequences():
             if filename.endswith('.json'):
                 name = filename[:-5]  # 移除.json后缀
                 try:
-                    with open(os.path.join(utils.sequences_dir, filename), 'r', encoding='utf-8') as f:
-                        utils.sequences[name] = json.load(f)
-                except:
-                    pass
+                    utils.sequences[name], utils.sequence_metas[name] = read_sequence_file(os.path.join(utils.sequences_dir, filename))
+                except Exception as e:
+                    # 记录无法加载的文件，不影响其他序列（可用 sequence_lint.py 检查详细问题）
+                    utils.sequence_load_errors[name] = str(e)
+                    utils.logger.warning("加载序列文件失败: %s: %s", filename, e)
     return list(utils.sequences.keys())
 
 # 修改序列名称
-def rename_sequence(old_name, new_name):
+def rename_sequence(old_name, new_name, engine=None):
+    if engine is None:
+        engine = default_engine
     if not old_name:
         return False, '旧序列名称不能为空'
     if not new_name:
@@ -95,23 +204,25 @@ def rename_sequence(old_name, new_name):
     if old_name not in utils.sequences:
         # 尝试从文件加载
         try:
-            with open(os.path.join(utils.sequences_dir, f'{old_name}.json'), 'r', encoding='utf-8') as f:
-                utils.sequences[old_name] = json.load(f)
+            utils.sequences[old_name], utils.sequence_metas[old_name] = read_sequence_file(os.path.join(utils.sequences_dir, f'{old_name}.json'))
         except:
             return False, f'序列 "{old_name}" 不存在'
     
     # 获取序列内容
     sequence_content = utils.sequences[old_name]
+    sequence_meta = utils.sequence_metas.pop(old_name, {})
     
     # 从内存中删除旧名称的序列
     del utils.sequences[old_name]
     
     # 将序列保存为新名称
     utils.sequences[new_name] = sequence_content
+    utils.sequence_metas[new_name] = sequence_meta
+    utils.sequences_version += 1
     
     # 如果当前序列是被修改的序列，更新当前序列名称
-    if utils.current_sequence == old_name:
-        utils.current_sequence = new_name
+    if engine.current_sequence == old_name:
+        engine.current_sequence = new_name
     
     # 从文件系统中删除旧文件
     try:
@@ -120,13 +231,13 @@ def rename_sequence(old_name, new_name):
             os.remove(old_file)
         
         # 将序列保存为新文件
-        with open(os.path.join(utils.sequences_dir, f'{new_name}.json'), 'w', encoding='utf-8') as f:
-            json.dump(sequence_content, f, ensure_ascii=False, indent=2)
+        write_sequence_file(os.path.join(utils.sequences_dir, f'{new_name}.json'), sequence_content, sequence_meta)
         
         return True, f'序列已从 "{old_name}" 重命名为 "{new_name}"'
     except Exception as e:
         # 如果文件操作失败，恢复内存中的旧序列
         utils.sequences[old_name] = sequence_content
-        if utils.current_sequence == new_name:
-            utils.current_sequence = old_name
+        utils.sequence_metas[old_name] = sequence_meta
+        if engine.current_sequence == new_name:
+            engine.current_sequence = old_name
         return False, f'重命名失败: {str(e)}'
@@ -0,0 +1,284 @@
+# 序列库检查
+# 功能：用进程池并行检查 sequences 目录下的所有序列文件，发现无法解析的文件、时间戳倒退、未知操作类型、
+#      不成对的按下/释放、超出屏幕的坐标等问题，输出机器可读的检查结果和汇总
+#
+# 用法：python sequence_lint.py [目录] [--jobs N] [--format json|jsonl|text] [--screen 宽x高] [--output 文件]
+#
+# 工作进程只使用标准库（不导入 utils / PyQt5 / pyautogui），启动开销小，适合检查上万个文件
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+# 严重程度
+SEVERITY_ERROR = 'error'      # 文件无法加载或播放会出错
+SEVERITY_WARNING = 'warning'  # 可以播放，但结果可能不符合预期
+
+# 检查项：代码 -> (严重程度, 说明)
+CHECKS = {
+    'invalid-json': (SEVERITY_ERROR, '文件不是有效的 JSON'),
+    'bad-structure': (SEVERITY_ERROR, '文件结构不是序列格式'),
+    'unsupported-version': (SEVERITY_WARNING, '格式版本高于当前程序支持的版本'),
+    'missing-field': (SEVERITY_ERROR, '操作缺少必需字段'),
+    'unknown-type': (SEVERITY_ERROR, '未知的操作类型'),
+    'time-inversion': (SEVERITY_ERROR, '时间戳比前一个操作更早'),
+    'unbalanced-key': (SEVERITY_WARNING, '按键按下/释放不成对'),
+    'unbalanced-button': (SEVERITY_WARNING, '鼠标按下/释放不成对'),
+    'off-screen': (SEVERITY_WARNING, '坐标超出屏幕范围'),
+    'empty-sequence': (SEVERITY_WARNING, '序列没有任何操作'),
+}
+
+# 当前程序支持的最高格式版本（与 sequence.SEQUENCE_FORMAT_VERSION 一致）
+MAX_FORMAT_VERSION = 2
+
+# 元数据中保存录制时屏幕配置的字段（与 screen_geometry.META_KEY 一致）
+SCREEN_META_KEY = 'screen'
+
+# 各操作类型的必需字段（时间戳单独检查）
+REQUIRED_FIELDS = {
+    'mousemove': ('x', 'y'),
+    'mousedown': ('x', 'y', 'button'),
+    'mouseup': ('x', 'y', 'button'),
+    'keydown': ('key', 'base_key'),
+    'keyup': ('key', 'base_key'),
+    'waitscreen': ('region', 'hash'),
+    'call': ('sequence',),
+}
+
+# 文件数少于此值时在当前进程中检查，不启动进程池
+MIN_PARALLEL_FILES = 64
+# 每次分发给工作进程的文件数
+CHUNK_SIZE = 64
+
+
+def _finding(findings, code, index=None, detail=''):
+    """添加一条检查结果"""
+    severity, message = CHECKS[code]
+    if detail:
+        message = f'{message}: {detail}'
+    findings.append({'code': code, 'severity': severity, 'index': index, 'message': message})
+
+
+def _recorded_monitors(meta):
+    """取出元数据中录制时的显示器区域列表 [(left, top, width, height), ...]，没有或格式不对时返回 None"""
+    screen = meta.get(SCREEN_META_KEY) if isinstance(meta, dict) else None
+    rects = screen.get('monitors') if isinstance(screen, dict) else None
+    if not isinstance(rects, list):
+        return None
+    monitors = []
+    for rect in rects:
+        if not (isinstance(rect, list) and len(rect) == 4 and all(isinstance(v, (int, float)) for v in rect)):
+            return None
+        monitors.append(tuple(rect))
+    return monitors or None
+
+
+def _on_monitor(x, y, monitors):
+    """坐标是否落在某个显示器区域内"""
+    return any(left <= x < left + width and top <= y < top + height for left, top, width, height in monitors)
+
+
+def lint_operations(operations, screen_size=None, monitors=None):
+    """检查操作列表，返回检查结果列表（index 为操作下标）
+
+    Args:
+        operations: 操作列表
+        screen_size: (宽, 高)，没有 monitors 时用于检查坐标越界（主显示器左上角为原点）
+        monitors: 录制时的显示器区域列表 [(left, top, width, height), ...]；
+                  给出时坐标不在任何显示器内才算越界（多显示器时坐标可以为负）
+    """
+    findings = []
+    if not operations:
+        _finding(findings, 'empty-sequence')
+        return findings
+    pressed_keys = {}
+    pressed_buttons = {}
+    previous = None
+    for index, op in enumerate(operations):
+        if not isinstance(op, dict):
+            _finding(findings, 'bad-structure', index, '操作不是对象')
+            continue
+        op_type = op.get('type')
+        if op_type not in REQUIRED_FIELDS:
+            _finding(findings, 'unknown-type', index, repr(op_type))
+            continue
+        # 时间戳：新格式为整数微秒，旧格式为浮点秒
+        if 'timestamp_us' in op:
+            timestamp = op['timestamp_us']
+        elif 'timestamp' in op and isinstance(op['timestamp'], (int, float)):
+            timestamp = round(op['timestamp'] * 1000000)
+        else:
+            timestamp = None
+        if not isinstance(timestamp, (int, float)) or isinstance(timestamp, bool):
+            _finding(findings, 'missing-field', index, 'timestamp_us')
+        else:
+            if previous is not None and timestamp < previous:
+                _finding(findings, 'time-inversion', index, f'{timestamp} < {previous}')
+            previous = timestamp
+        missing = [field for field in REQUIRED_FIELDS[op_type] if field not in op]
+        if missing:
+            _finding(findings, 'missing-field', index, ', '.join(missing))
+            continue
+
+        if 'x' in op:
+            x, y = op['x'], op['y']
+            if not isinstance(x, (int, float)) or not isinstance(y, (int, float)):
+                _finding(findings, 'missing-field', index, '坐标不是数字')
+            elif monitors:
+                if not _on_monitor(x, y, monitors):
+                    _finding(findings, 'off-screen', index, f'({x}, {y})')
+            elif x < 0 or y < 0 or (screen_size and (x >= screen_size[0] or y >= screen_size[1])):
+                _finding(findings, 'off-screen', index, f'({x}, {y})')
+
+        # 按下/释放配对（按键按基础键配对，与播放时跟踪按下的按键一致；key 含修饰键，按下和释放时可能不同）
+        if op_type in ('keydown', 'keyup'):
+            counts, code, name = pressed_keys, 'unbalanced-key', op['base_key']
+        elif op_type in ('mousedown', 'mouseup'):
+            counts, code, name = pressed_buttons, 'unbalanced-button', op['button']
+        else:
+            continue
+        if op_type in ('keydown', 'mousedown'):
+            counts[name] = counts.get(name, 0) + 1
+        elif counts.get(name, 0) > 0:
+            counts[name] -= 1
+        else:
+            _finding(findings, code, index, f'{name} 没有对应的按下')
+    for counts, code in ((pressed_keys, 'unbalanced-key'), (pressed_buttons, 'unbalanced-button')):
+        for name, count in counts.items():
+            if count > 0:
+                _finding(findings, code, None, f'{name} 在序列结束时仍处于按下状态')
+    return findings
+
+
+def lint_file(path, screen_size=None):
+    """检查一个序列文件，返回 (路径, 操作数, 检查结果列表)
+
+    文件元数据中保存了录制时的屏幕配置时按录制时的显示器检查坐标越界，旧序列按 screen_size 检查
+    """
+    findings = []
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        _finding(findings, 'invalid-json', None, str(e))
+        return path, 0, findings
+    monitors = None
+    if isinstance(data, list):
+        operations = data
+    elif isinstance(data, dict) and isinstance(data.get('operations'), list):
+        operations = data['operations']
+        monitors = _recorded_monitors(data.get('meta'))
+        version = data.get('format_version')
+        if isinstance(version, int) and version > MAX_FORMAT_VERSION:
+            _finding(findings, 'unsupported-version', None, str(version))
+    else:
+        _finding(findings, 'bad-structure', None, '顶层应为操作列表或包含 operations 的对象')
+        return path, 0, findings
+    findings.extend(lint_operations(operations, screen_size, monitors))
+    return path, len(operations), findings
+
+
+def _lint_file_star(args):
+    """进程池工作函数（参数打包为元组）"""
+    return lint_file(*args)
+
+
+def find_sequence_files(directory):
+    """列出目录下的所有序列文件（按名称排序）"""
+    with os.scandir(directory) as entries:
+        return sorted(entry.path for entry in entries if entry.name.endswith('.json') and entry.is_file())
+
+
+def lint_directory(directory, jobs=None, screen_size=None):
+    """并行检查目录下的所有序列文件
+
+    Returns:
+        tuple: (检查结果列表, 汇总字典)，每条检查结果包含 file 字段
+    """
+    paths = find_sequence_files(directory)
+    tasks = [(path, screen_size) for path in paths]
+    if len(tasks) < MIN_PARALLEL_FILES or jobs == 1:
+        results = map(_lint_file_star, tasks)
+        return _collect(results, len(paths))
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        return _collect(executor.map(_lint_file_star, tasks, chunksize=CHUNK_SIZE), len(paths))
+
+
+def _collect(results, file_count):
+    """汇总各文件的检查结果"""
+    findings = []
+    by_code = {}
+    files_with_errors = 0
+    files_with_warnings = 0
+    operation_count = 0
+    for path, count, file_findings in results:
+        operation_count += count
+        severities = set()
+        for finding in file_findings:
+            finding['file'] = os.path.basename(path)
+            findings.append(finding)
+            by_code[finding['code']] = by_code.get(finding['code'], 0) + 1
+            severities.add(finding['severity'])
+        if SEVERITY_ERROR in severities:
+            files_with_errors += 1
+        elif SEVERITY_WARNING in severities:
+            files_with_warnings += 1
+    summary = {
+        'files': file_count,
+        'operations': operation_count,
+        'findings': len(findings),
+        'files_with_errors': files_with_errors,
+        'files_with_warnings': files_with_warnings,
+        'clean_files': file_count - files_with_errors - files_with_warnings,
+        'by_code': by_code
+    }
+    return findings, summary
+
+
+def _parse_screen(text):
+    """解析 '宽x高' 形式的屏幕尺寸"""
+    width, height = text.lower().split('x')
+    return int(width), int(height)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='检查序列库中的所有序列文件')
+    parser.add_argument('directory', nargs='?', default=None, help='序列目录，默认为程序目录下的 sequences')
+    parser.add_argument('--jobs', type=int, default=None, help='工作进程数，默认为 CPU 核数')
+    parser.add_argument('--format', choices=('json', 'jsonl', 'text'), default='json', help='输出格式')
+    parser.add_argument('--screen', type=_parse_screen, default=None, help='屏幕尺寸（如 1920x1080），用于检查没有保存屏幕配置的旧序列的坐标越界')
+    parser.add_argument('--output', default=None, help='输出文件，默认输出到标准输出')
+    args = parser.parse_args(argv)
+
+    directory = args.directory
+    if directory is None:
+        directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sequences')
+    findings, summary = lint_directory(directory, args.jobs, args.screen)
+
+    out = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+    try:
+        if args.format == 'json':
+            json.dump({'summary': summary, 'findings': findings}, out, ensure_ascii=False, indent=2)
+            out.write('\n')
+        elif args.format == 'jsonl':
+            # 每行一条检查结果，最后一行为汇总
+            for finding in findings:
+                out.write(json.dumps(finding, ensure_ascii=False) + '\n')
+            out.write(json.dumps({'summary': summary}, ensure_ascii=False) + '\n')
+        else:
+            for finding in findings:
+                location = f"#{finding['index'] + 1}" if finding['index'] is not None else '-'
+                out.write(f"{finding['file']} {location} [{finding['severity']}] {finding['code']}: {finding['message']}\n")
+            out.write(f"共 {summary['files']} 个文件，{summary['operations']} 个操作；"
+                      f"错误文件 {summary['files_with_errors']} 个，警告文件 {summary['files_with_warnings']} 个，"
+                      f"检查结果 {summary['findings']} 条\n")
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    # 有错误时返回非零退出码，便于在脚本中使用
+    return 1 if summary['files_with_errors'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,321 @@
+# 播放会话跟踪
+# 功能：每次播放把播放跟踪（log_utils.BinaryTrace）的记录——每个操作的序号、计划时间、实际发送时间、输入后端返回时间和结果——
+#      写入 logs/traces 目录下的二进制环形缓冲文件（只保留最近 capacity 条记录），并提供分析命令：延迟分布、最慢的操作和随时间的漂移。
+#      跟踪文件记录了所播放序列的名称、文件和内容摘要，分析时据此找回对应的操作
+#
+# 文件格式：
+#   文件头 FILE_HEADER：魔数、版本、记录长度、容量、已写入的记录总数、元数据位置和长度
+#   记录区 capacity 条 log_utils.TRACE_RECORD：第 n 条记录写在 n % capacity 处，文件通过 mmap 写入，
+#   程序异常退出时已写入的记录仍然保留
+#   元数据（播放结束时追加在记录区之后）：JSON，包含开始时间、速度、序列列表等
+#
+# 用法：python session_trace.py list                                   列出跟踪文件
+#      python session_trace.py analyze [文件名] [--top 10] [--format text|json]  分析跟踪文件（默认为最新的一个）
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+
+import utils
+import log_utils
+
+# 文件头：(魔数, 版本, 记录长度, 容量, 已写入的记录总数, 元数据位置, 元数据长度)
+MAGIC = b'ASTR'
+VERSION = 2
+FILE_HEADER = struct.Struct('<4sHHIQQI')
+# 记录格式与播放跟踪文件相同
+RECORD = log_utils.TRACE_RECORD
+
+# 跟踪文件扩展名
+TRACE_EXTENSION = '.strace'
+
+# 漂移分析的时间分段数
+DRIFT_WINDOWS = 10
+
+
+def operations_digest(operations):
+    """序列内容摘要，用于分析时确认序列文件没有被修改"""
+    return hashlib.sha1(json.dumps(operations, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+def trace_path(sequence_name=''):
+    """新的跟踪文件路径：logs/traces/时间（到毫秒）[-序列名].strace"""
+    if not os.path.exists(utils.traces_dir):
+        os.makedirs(utils.traces_dir)
+    now = time.time()
+    name = f'{time.strftime("%Y%m%d-%H%M%S", time.localtime(now))}{int(now * 1000) % 1000:03d}'
+    if sequence_name:
+        name += '-' + ''.join(ch if ch.isalnum() or ch in '-_' else '_' for ch in sequence_name)
+    return os.path.join(utils.traces_dir, name + TRACE_EXTENSION)
+
+
+def list_traces():
+    """列出跟踪文件，返回 [(文件名, 大小字节, 修改时间), ...]，最新的在前"""
+    if not os.path.isdir(utils.traces_dir):
+        return []
+    traces = []
+    with os.scandir(utils.traces_dir) as entries:
+        for entry in entries:
+            if entry.name.endswith(TRACE_EXTENSION) and entry.is_file():
+                stat = entry.stat()
+                traces.append((entry.name, stat.st_size, stat.st_mtime))
+    traces.sort(key=lambda item: item[2], reverse=True)
+    return traces
+
+
+def prune_traces(keep):
+    """只保留最新的 keep 个跟踪文件"""
+    for name, _, _ in list_traces()[keep:]:
+        try:
+            os.remove(os.path.join(utils.traces_dir, name))
+        except OSError as e:
+            utils.logger.warning("删除旧的跟踪文件失败: %s: %s", name, e)
+
+
+class SessionTrace:
+    """一次播放的会话跟踪：log_utils.BinaryTrace 的环形缓冲输出
+
+    由播放器在播放开始时创建，作为输出交给播放跟踪；关闭时写入元数据（包括播放跟踪登记的序列及其内容摘要）
+    """
+
+    def __init__(self, path, capacity, meta=None):
+        self.path = path
+        self.capacity = capacity
+        self.count = 0
+        self.meta = dict(meta or {})
+        self._file = open(path, 'w+b')
+        self._file.truncate(FILE_HEADER.size + capacity * RECORD.size)
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        FILE_HEADER.pack_into(self._map, 0, MAGIC, VERSION, RECORD.size, capacity, 0, 0, 0)
+
+    def write(self, record):
+        slot = FILE_HEADER.size + (self.count % self.capacity) * RECORD.size
+        self._map[slot:slot + RECORD.size] = record
+        self.count += 1
+        # 记录写入后再更新总数
+        struct.pack_into('<Q', self._map, 12, self.count)
+
+    def close(self, trace):
+        """写入元数据并关闭文件"""
+        self.meta['start_wall_time'] = trace.start_wall_time
+        self.meta['sequences'] = [{
+            'name': info['name'],
+            'path': os.path.join(utils.sequences_dir, f"{info['name']}.json") if info['name'] else '',
+            'operations': len(info['operations']),
+            'digest': operations_digest(info['operations'])
+        } for info in trace.sequences]
+        self.meta['duration_us'] = trace.duration_us
+        data = json.dumps(self.meta, ensure_ascii=False).encode('utf-8')
+        offset = FILE_HEADER.size + self.capacity * RECORD.size
+        FILE_HEADER.pack_into(self._map, 0, MAGIC, VERSION, RECORD.size, self.capacity, self.count, offset, len(data))
+        self._map.flush()
+        self._map.close()
+        self._file.seek(offset)
+        self._file.write(data)
+        self._file.close()
+
+
+def read_trace(path):
+    """读取跟踪文件
+
+    Returns:
+        tuple: (元数据字典, 记录列表（按写入顺序，只包含环形缓冲中保留的操作记录，字段见 log_utils.unpack_record）,
+                写入的记录总数)
+
+    Raises:
+        ValueError: 不是跟踪文件或版本不支持
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    if len(data) < FILE_HEADER.size:
+        raise ValueError('文件太短，不是跟踪文件')
+    magic, version, record_size, capacity, count, meta_offset, meta_length = FILE_HEADER.unpack_from(data, 0)
+    if magic != MAGIC or version != VERSION or record_size != RECORD.size:
+        raise ValueError('不是跟踪文件或版本不支持')
+    meta = {}
+    if meta_length:
+        meta = json.loads(data[meta_offset:meta_offset + meta_length].decode('utf-8'))
+    kept = min(count, capacity)
+    first = count - kept
+    records = []
+    for n in range(first, count):
+        record = log_utils.unpack_record(RECORD.unpack_from(data, FILE_HEADER.size + (n % capacity) * RECORD.size))
+        if record['event'] != 'start':
+            records.append(record)
+    return meta, records, count
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0
+    return sorted_values[min(int(fraction * len(sorted_values)), len(sorted_values) - 1)]
+
+
+def _load_sequences(meta):
+    """按元数据找回序列文件，返回 {编号: (操作列表, 是否与播放时一致)}"""
+    import sequence
+    loaded = {}
+    for sequence_id, info in enumerate(meta.get('sequences', [])):
+        path = info.get('path')
+        if not path or not os.path.exists(path):
+            continue
+        try:
+            operations, _ = sequence.read_sequence_file(path)
+        except Exception:
+            continue
+        loaded[sequence_id] = (operations, operations_digest(operations) == info.get('digest'))
+    return loaded
+
+
+def describe_operation(op):
+    """操作的简短说明"""
+    if 'key' in op:
+        return f"{op['type']} {op['key']}"
+    if 'x' in op:
+        return f"{op['type']} ({op['x']}, {op['y']})"
+    if 'sequence' in op:
+        return f"{op['type']} {op['sequence']}"
+    return op.get('type', '')
+
+
+def analyze(meta, records, top=10, sequences=None):
+    """分析跟踪记录
+
+    Returns:
+        dict: 延迟分布（lateness_us）、最慢的操作（slowest，按后端耗时）、漂移（drift，按计划时间分段的平均延迟和斜率）
+    """
+    sequences = sequences or {}
+    names = [info.get('name', '') for info in meta.get('sequences', [])]
+    timed = [record for record in records if record['type'] != 'waitscreen']
+    lateness = sorted(record['dispatched_us'] - record['scheduled_us'] for record in timed)
+    result = {
+        'records': len(records),
+        'errors': sum(1 for record in records if record['result'] != 'ok'),
+        'lateness_us': {
+            'mean': sum(lateness) / len(lateness) if lateness else 0,
+            'p50': _percentile(lateness, 0.5),
+            'p90': _percentile(lateness, 0.9),
+            'p99': _percentile(lateness, 0.99),
+            'max': lateness[-1] if lateness else 0,
+            'histogram': {}
+        }
+    }
+    for bound in (100, 500, 1000, 2000, 5000, 10000, 20000, 50000):
+        result['lateness_us']['histogram'][f'<={bound}'] = sum(1 for value in lateness if value <= bound)
+    result['lateness_us']['histogram']['>50000'] = sum(1 for value in lateness if value > 50000)
+
+    # 最慢的操作：按输入后端耗时（返回时间 - 发送时间），鼠标移动路径包含多次移动，不参与排序
+    slowest = []
+    for record in sorted((item for item in timed if item['index'] >= 0), key=lambda item: item['returned_us'] - item['dispatched_us'], reverse=True)[:top]:
+        item = {
+            'sequence': names[record['sequence']] if record['sequence'] < len(names) else '',
+            'index': record['index'],
+            'loop': record['loop'],
+            'type': record['type'],
+            'backend_us': record['returned_us'] - record['dispatched_us'],
+            'lateness_us': record['dispatched_us'] - record['scheduled_us'],
+            'result': record['result']
+        }
+        operations, same = sequences.get(record['sequence'], (None, False))
+        if operations is not None and 0 <= record['index'] < len(operations):
+            item['operation'] = describe_operation(operations[record['index']])
+            if not same:
+                item['operation'] += '（序列文件已修改）'
+        slowest.append(item)
+    result['slowest'] = slowest
+
+    # 漂移：按计划时间等分为若干段，各段的平均延迟；斜率为延迟对计划时间的最小二乘斜率（微秒/秒）
+    drift = []
+    if timed:
+        start = timed[0]['scheduled_us']
+        span = max(timed[-1]['scheduled_us'] - start, 1)
+        windows = [[] for _ in range(DRIFT_WINDOWS)]
+        for record in timed:
+            position = min(int((record['scheduled_us'] - start) * DRIFT_WINDOWS / span), DRIFT_WINDOWS - 1)
+            windows[position].append(record['dispatched_us'] - record['scheduled_us'])
+        for n, values in enumerate(windows):
+            if values:
+                drift.append({'from_s': (start + span * n / DRIFT_WINDOWS) / 1000000,
+                              'count': len(values), 'mean_lateness_us': sum(values) / len(values)})
+    slope = 0.0
+    if len(timed) > 1:
+        xs = [record['scheduled_us'] / 1000000 for record in timed]
+        ys = [record['dispatched_us'] - record['scheduled_us'] for record in timed]
+        mean_x = sum(xs) / len(xs)
+        mean_y = sum(ys) / len(ys)
+        variance = sum((x - mean_x) ** 2 for x in xs)
+        if variance:
+            slope = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / variance
+    result['drift'] = {'windows': drift, 'slope_us_per_s': slope}
+    return result
+
+
+def _resolve(name):
+    """命令行参数中的文件名：省略时为最新的一个"""
+    if name:
+        return name if os.path.isabs(name) or os.path.exists(name) else os.path.join(utils.traces_dir, name)
+    traces = list_traces()
+    if not traces:
+        return None
+    return os.path.join(utils.traces_dir, traces[0][0])
+
+
+def _print_report(path, meta, count, report):
+    kept = report['records']
+    names = '、'.join(info['name'] or '（未保存的序列）' for info in meta.get('sequences', [])) or '-'
+    print(f'{os.path.basename(path)}：序列 {names}，速度 {meta.get("speed", "-")}，'
+          f'记录 {kept} 条（共写入 {count} 条），出错或超时 {report["errors"]} 条')
+    lateness = report['lateness_us']
+    print(f'延迟（微秒）：平均 {lateness["mean"]:.0f}，p50 {lateness["p50"]}，p90 {lateness["p90"]}，'
+          f'p99 {lateness["p99"]}，最大 {lateness["max"]}')
+    for bound, number in lateness['histogram'].items():
+        print(f'  {bound:>8}  {number}')
+    print('最慢的操作（输入后端耗时）：')
+    for item in report['slowest']:
+        print(f'  {item["backend_us"]:>8}微秒  {item["sequence"]} #{item["index"]}（第 {item["loop"] + 1} 遍）'
+              f' {item.get("operation", item["type"])}，延迟 {item["lateness_us"]}微秒，{item["result"]}')
+    drift = report['drift']
+    print(f'漂移：{drift["slope_us_per_s"]:+.1f} 微秒/秒')
+    for window in drift['windows']:
+        print(f'  {window["from_s"]:>8.3f}秒起  {window["count"]:>6} 个  平均延迟 {window["mean_lateness_us"]:.0f}微秒')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='播放会话跟踪')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('list', help='列出跟踪文件')
+    analyze_parser = commands.add_parser('analyze', help='分析跟踪文件')
+    analyze_parser.add_argument('name', nargs='?', default=None, help='跟踪文件，默认为最新的一个')
+    analyze_parser.add_argument('--top', type=int, default=10, help='列出最慢的操作数')
+    analyze_parser.add_argument('--format', choices=('text', 'json'), default='text')
+    args = parser.parse_args(argv)
+
+    if args.command == 'list':
+        for name, size, mtime in list_traces():
+            print(f'{time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(mtime))}  {size / 1024:8.1f} KB  {name}')
+        return 0
+    path = _resolve(args.name)
+    if path is None or not os.path.exists(path):
+        print('没有找到跟踪文件', file=sys.stderr)
+        return 1
+    try:
+        meta, records, count = read_trace(path)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 1
+    report = analyze(meta, records, args.top, _load_sequences(meta))
+    if args.format == 'json':
+        json.dump(dict(report, file=os.path.basename(path), meta=meta, written=count), sys.stdout,
+                  ensure_ascii=False, indent=2)
+        print()
+    else:
+        _print_report(path, meta, count, report)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
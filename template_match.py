@@ -0,0 +1,492 @@
+# 图像锚定点击
+# 功能：录制时在鼠标按下位置截取一小块模板，播放时在录制位置附近的搜索区域内做多尺度模板匹配，
+#      按找到的位置修正本次点击（按下到释放之间的所有鼠标操作）的坐标，窗口移动后仍能点中目标。
+#      匹配只用 NumPy：FFT 计算零均值归一化互相关（ZNCC），先在缩小的图像上粗搜，再在全分辨率上精修。
+import base64
+import threading
+import time
+from collections import OrderedDict, deque
+
+import numpy as np
+
+import screen_capture
+
+# 模板参数
+DEFAULT_TEMPLATE_SIZE = 48     # 模板边长（像素）
+DEFAULT_SEARCH_RADIUS = 160    # 搜索区域在录制位置周围的半径（像素）
+DEFAULT_MIN_SCORE = 0.8        # 认为匹配成功的最低 ZNCC 分数
+MIN_TEMPLATE_STD = 4.0         # 模板灰度标准差下限，更平坦的区域（纯色背景）无法可靠定位
+ANCHOR_SCALES = (0.8, 0.9, 1.0, 1.1, 1.25)  # 搜索的缩放比例（应对界面缩放变化）
+
+# 录制时点击前画面的持续截取（见 PreClickFrames）
+ANCHOR_FRAME_MARGIN = 64       # 每帧在模板周围多截的像素
+ANCHOR_FRAME_INTERVAL = 0.03   # 截图间隔（秒）
+ANCHOR_FRAME_KEEP = 8          # 保留的帧数
+
+# 粗搜与精修
+MIN_COARSE_SIZE = 8            # 粗搜模板的最小边长
+MAX_COARSE_FACTOR = 4          # 粗搜最多缩小的倍数
+SCALE_TIE_SCORE = 0.02         # 分数相差不超过此值时优先选择最接近原始大小的缩放比例（边缘、角点等模板对缩放不敏感）
+
+# 模板金字塔缓存（按模板数据缓存，循环播放时不必重复缩放模板）
+PYRAMID_CACHE_SIZE = 128
+_pyramid_cache = OrderedDict()
+
+
+def resize(gray, width, height):
+    """双线性缩放灰度图"""
+    src_h, src_w = gray.shape
+    ys = np.clip((np.arange(height) + 0.5) * src_h / height - 0.5, 0, src_h - 1)
+    xs = np.clip((np.arange(width) + 0.5) * src_w / width - 0.5, 0, src_w - 1)
+    y0 = ys.astype(np.int64)
+    x0 = xs.astype(np.int64)
+    y1 = np.minimum(y0 + 1, src_h - 1)
+    x1 = np.minimum(x0 + 1, src_w - 1)
+    wy = (ys - y0)[:, None]
+    wx = (xs - x0)[None, :]
+    top = gray[y0][:, x0] * (1 - wx) + gray[y0][:, x1] * wx
+    bottom = gray[y1][:, x0] * (1 - wx) + gray[y1][:, x1] * wx
+    return (top * (1 - wy) + bottom * wy).astype(np.float32)
+
+
+def half(gray):
+    """2x2 区域平均缩小一半（奇数边裁掉最后一行/列）"""
+    h = gray.shape[0] // 2 * 2
+    w = gray.shape[1] // 2 * 2
+    gray = np.asarray(gray, dtype=np.float32)
+    return (gray[0:h:2, 0:w:2] + gray[1:h:2, 0:w:2] + gray[0:h:2, 1:w:2] + gray[1:h:2, 1:w:2]) * 0.25
+
+
+def _fast_length(n):
+    """不小于 n 的、只含因子 2、3、5 的长度（FFT 在这些长度上最快）"""
+    best = 1 << (n - 1).bit_length()
+    power5 = 1
+    while power5 < best:
+        power35 = power5
+        while power35 < best:
+            length = power35
+            while length < n:
+                length *= 2
+            best = min(best, length)
+            power35 *= 3
+        power5 *= 5
+    return best
+
+
+def _integral(values):
+    """积分图（首行首列补零）"""
+    integral = np.zeros((values.shape[0] + 1, values.shape[1] + 1), dtype=np.float64)
+    np.cumsum(np.cumsum(values, axis=0, dtype=np.float64), axis=1, out=integral[1:, 1:])
+    return integral
+
+
+def _window_sums(integral, h, w):
+    """用积分图计算所有 h x w 窗口内的和，结果形状为 (H - h + 1, W - w + 1)"""
+    return integral[h:, w:] - integral[:-h, w:] - integral[h:, :-w] + integral[:-h, :-w]
+
+
+class _SearchImage:
+    """预处理好的搜索图像：频谱和积分图在各缩放比例的模板之间共用
+
+    频谱按补零后的快速 FFT 长度计算，补零不影响有效区域内的互相关结果
+    """
+
+    def __init__(self, gray):
+        self.pixels = np.asarray(gray, dtype=np.float64)
+        self.shape = self.pixels.shape
+        self.fft_shape = (_fast_length(self.shape[0]), _fast_length(self.shape[1]))
+        self.spectrum = np.fft.rfft2(self.pixels, s=self.fft_shape)
+        self.sums = _integral(self.pixels)
+        self.squares = _integral(self.pixels * self.pixels)
+
+
+class _PreparedTemplate:
+    """预处理好的模板：零均值数据、范数，以及按 FFT 尺寸缓存的频谱"""
+
+    def __init__(self, gray):
+        self.height, self.width = gray.shape
+        self.zero_mean = (gray - gray.mean()).astype(np.float64)
+        self.norm = float(np.sqrt(np.sum(self.zero_mean * self.zero_mean)))
+        self._spectra = {}
+
+    def spectrum(self, fft_shape):
+        """模板补零到 fft_shape 后的频谱共轭（同一锚点每次搜索的区域大小相同，缓存后不必重复计算）"""
+        spectrum = self._spectra.get(fft_shape)
+        if spectrum is None:
+            spectrum = np.conj(np.fft.rfft2(self.zero_mean, s=fft_shape))
+            self._spectra[fft_shape] = spectrum
+        return spectrum
+
+
+def ncc_map(image, template):
+    """计算模板在图像每个有效位置的 ZNCC 分数（-1 到 1）
+
+    分子用 FFT 做互相关（模板已零均值，等价于图像窗口去均值后的互相关），
+    分母中图像窗口的方差用积分图计算。
+    """
+    if not isinstance(image, _SearchImage):
+        image = _SearchImage(image)
+    H, W = image.shape
+    h, w = template.height, template.width
+    if H < h or W < w or template.norm == 0:
+        return np.zeros((0, 0))
+    spectrum = image.spectrum * template.spectrum(image.fft_shape)
+    numerator = np.fft.irfft2(spectrum, s=image.fft_shape)[:H - h + 1, :W - w + 1]
+    return _scores(numerator, image.sums, image.squares, template)
+
+
+def _scores(numerator, sums_integral, squares_integral, template):
+    """由互相关分子和图像积分图计算 ZNCC 分数"""
+    h, w = template.height, template.width
+    n = h * w
+    sums = _window_sums(sums_integral, h, w)
+    variance = _window_sums(squares_integral, h, w) - sums * sums / n
+    denominator = np.sqrt(np.maximum(variance, 0)) * template.norm
+    scores = np.zeros_like(numerator)
+    valid = denominator > 1e-6 * template.norm
+    scores[valid] = numerator[valid] / denominator[valid]
+    return scores
+
+
+class TemplatePyramid:
+    """一个模板在各缩放比例下的全分辨率版本，以及缩小 coarse_factor 倍后的粗搜版本
+
+    粗搜倍数取使最小的粗搜模板边长不小于 MIN_COARSE_SIZE 的最大2的幂（不超过 MAX_COARSE_FACTOR），
+    模板太小时为1，即直接在全分辨率上搜索
+    """
+
+    def __init__(self, template, scales=ANCHOR_SCALES):
+        template = np.asarray(template, dtype=np.float32)
+        smallest = min(template.shape) * min(scales)
+        self.coarse_factor = 1
+        while self.coarse_factor < MAX_COARSE_FACTOR and smallest / (self.coarse_factor * 2) >= MIN_COARSE_SIZE:
+            self.coarse_factor *= 2
+        self.levels = []  # [(缩放比例, 全分辨率模板, 粗搜模板), ...]
+        for scale in scales:
+            width = max(int(round(template.shape[1] * scale)), 1)
+            height = max(int(round(template.shape[0] * scale)), 1)
+            full = template if scale == 1 else resize(template, width, height)
+            coarse = full
+            factor = 1
+            while factor < self.coarse_factor:
+                coarse = half(coarse)
+                factor *= 2
+            full = _PreparedTemplate(full)
+            self.levels.append((scale, full, full if coarse is full else _PreparedTemplate(coarse)))
+
+    @property
+    def max_scale(self):
+        return max(scale for scale, _, _ in self.levels)
+
+
+def locate(image, pyramid, min_score=DEFAULT_MIN_SCORE):
+    """在灰度图中查找模板
+
+    先在缩小 coarse_factor 倍的图像上对每个缩放比例做 FFT 全局搜索，
+    再在全分辨率上对每个缩放比例的粗搜位置周围的小窗口精修。
+
+    Returns:
+        tuple: (分数, 左, 上, 缩放比例)，为模板左上角在图像中的位置；没有达到 min_score 时返回 None
+    """
+    image = np.asarray(image, dtype=np.float32)
+    factor = pyramid.coarse_factor
+    coarse_image = image
+    for _ in range(factor.bit_length() - 1):
+        coarse_image = half(coarse_image)
+    coarse_image = _SearchImage(coarse_image)
+
+    results = []
+    margin = factor + 1
+    for scale, full, coarse in pyramid.levels:
+        scores = ncc_map(coarse_image, coarse)
+        if not scores.size:
+            continue
+        y, x = np.unravel_index(np.argmax(scores), scores.shape)
+        score, x, y = float(scores[y, x]), int(x) * factor, int(y) * factor
+        if factor > 1:
+            # 在全分辨率上精修粗搜位置（粗搜分数受模板与缩小网格的对齐影响，不能用来提前淘汰候选）
+            left = max(x - margin, 0)
+            top = max(y - margin, 0)
+            right = min(x + margin + full.width, image.shape[1])
+            bottom = min(y + margin + full.height, image.shape[0])
+            scores = ncc_map(image[top:bottom, left:right], full)
+            if not scores.size:
+                continue
+            dy, dx = np.unravel_index(np.argmax(scores), scores.shape)
+            score, x, y = float(scores[dy, dx]), left + int(dx), top + int(dy)
+        results.append((score, x, y, scale))
+    if not results:
+        return None
+    top_score = max(result[0] for result in results)
+    if top_score < min_score:
+        return None
+    # 分数接近时取最接近原始大小的缩放比例
+    ties = [result for result in results if result[0] >= top_score - SCALE_TIE_SCORE]
+    return min(ties, key=lambda result: (abs(np.log(result[3])), -result[0]))
+
+
+def encode_template(gray):
+    """把 uint8 灰度模板编码为可保存到序列文件的字段"""
+    gray = np.asarray(gray, dtype=np.uint8)
+    return {
+        'width': int(gray.shape[1]),
+        'height': int(gray.shape[0]),
+        'data': base64.b64encode(gray.tobytes()).decode('ascii')
+    }
+
+
+def decode_template(anchor):
+    """从锚点字段解码灰度模板"""
+    data = np.frombuffer(base64.b64decode(anchor['data']), dtype=np.uint8)
+    return data.reshape(anchor['height'], anchor['width']).astype(np.float32)
+
+
+def get_pyramid(anchor):
+    """取锚点模板的金字塔（带缓存）"""
+    key = anchor['data']
+    pyramid = _pyramid_cache.get(key)
+    if pyramid is None:
+        pyramid = TemplatePyramid(decode_template(anchor))
+        _pyramid_cache[key] = pyramid
+        if len(_pyramid_cache) > PYRAMID_CACHE_SIZE:
+            _pyramid_cache.popitem(last=False)
+    else:
+        _pyramid_cache.move_to_end(key)
+    return pyramid
+
+
+def grab_anchor_region(x, y, size=DEFAULT_TEMPLATE_SIZE):
+    """截取以 (x, y) 为中心的模板区域（只截图，不编码）
+
+    截图服务的灰度缓冲区会被复用，这里返回副本，可以交给其他线程稍后用 make_anchor 编码
+
+    Returns:
+        tuple: (left, top, 灰度图)
+    """
+    x = int(round(x))
+    y = int(round(y))
+    left = max(x - size // 2, 0)
+    top = max(y - size // 2, 0)
+    gray = screen_capture.grab_gray((left, top, size, size), max_age=0)
+    return left, top, np.array(gray)
+
+
+class PreClickFrames:
+    """录制时在后台线程中持续截取指针周围的画面，保留最近几帧
+
+    鼠标按下时录制线程用按下之前截取的最近一帧裁出模板，锚点是点击前的画面，
+    钩子回调只写入原始事件，不在其中截图
+    """
+
+    def __init__(self, size=DEFAULT_TEMPLATE_SIZE, margin=ANCHOR_FRAME_MARGIN, interval=ANCHOR_FRAME_INTERVAL,
+                 keep=ANCHOR_FRAME_KEEP, position=None, clock=time.perf_counter_ns):
+        """
+        Args:
+            size: 模板边长
+            margin: 每帧在模板周围多截的像素（截图间隔内指针移动不超过该距离时仍能裁出模板）
+            interval: 截图间隔（秒）
+            keep: 保留的帧数
+            position: 返回当前指针位置的函数，默认为 pyautogui.position
+            clock: 帧时间戳的时钟（纳秒），与录制事件的时间戳一致
+        """
+        self.size = size
+        self.margin = margin
+        self.interval = interval
+        self.position = position
+        self.clock = clock
+        self._frames = deque(maxlen=keep)  # [(截图完成时间, left, top, 请求的边长, 灰度图), ...]
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self.position is None:
+            # 延迟导入，无界面环境下可以传入假的指针位置函数
+            import pyautogui
+            self.position = pyautogui.position
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='anchor-frames', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.capture()
+            except Exception:
+                # 截图失败时不影响录制，下次再试；没有可用的帧时录制线程改为在处理事件时截图
+                pass
+            self._stop.wait(self.interval)
+
+    def capture(self):
+        """截取一帧当前指针周围的画面"""
+        x, y = self.position()
+        span = self.size + 2 * self.margin
+        left = max(int(round(x)) - span // 2, 0)
+        top = max(int(round(y)) - span // 2, 0)
+        gray = np.array(screen_capture.grab_gray((left, top, span, span), max_age=0))
+        with self._lock:
+            self._frames.append((self.clock(), left, top, span, gray))
+
+    def crop(self, x, y, t_ns):
+        """从 t_ns 之前截取的最近一帧中裁出以 (x, y) 为中心的模板区域
+
+        Returns:
+            tuple: ((left, top, 灰度图), 截图完成时间)，没有包含该区域的帧时返回 None
+        """
+        x = int(round(x))
+        y = int(round(y))
+        left = max(x - self.size // 2, 0)
+        top = max(y - self.size // 2, 0)
+        with self._lock:
+            frames = list(self._frames)
+        for captured, frame_left, frame_top, span, gray in reversed(frames):
+            if captured > t_ns:
+                continue
+            if (frame_left <= left and left + self.size <= frame_left + span
+                    and frame_top <= top and top + self.size <= frame_top + span):
+                region = gray[top - frame_top:top - frame_top + self.size, left - frame_left:left - frame_left + self.size]
+                return (left, top, region.copy()), captured
+        return None
+
+
+def make_anchor(x, y, grabbed, search_radius=DEFAULT_SEARCH_RADIUS, min_score=DEFAULT_MIN_SCORE):
+    """用 grab_anchor_region 的结果生成锚点字段
+
+    Returns:
+        dict: 锚点字段（模板、点击位置在模板中的坐标、搜索参数）；区域太平坦无法定位时返回 None
+    """
+    left, top, gray = grabbed
+    if gray.size == 0 or gray.std() < MIN_TEMPLATE_STD:
+        return None
+    anchor = encode_template(np.rint(gray))
+    anchor.update({
+        'cx': int(round(x)) - left,
+        'cy': int(round(y)) - top,
+        'search_radius': search_radius,
+        'min_score': min_score
+    })
+    return anchor
+
+
+def capture_anchor(x, y, size=DEFAULT_TEMPLATE_SIZE, search_radius=DEFAULT_SEARCH_RADIUS,
+                   min_score=DEFAULT_MIN_SCORE):
+    """截取以 (x, y) 为中心的模板，生成锚点字段
+
+    Returns:
+        dict: 锚点字段（模板、点击位置在模板中的坐标、搜索参数）；区域太平坦无法定位时返回 None
+    """
+    return make_anchor(x, y, grab_anchor_region(x, y, size), search_radius, min_score)
+
+
+def find_anchor(anchor, x, y):
+    """在录制位置 (x, y) 附近查找锚点模板
+
+    Returns:
+        tuple: (新的 x, 新的 y, 分数)，没有找到时返回 None
+    """
+    pyramid = get_pyramid(anchor)
+    radius = anchor.get('search_radius', DEFAULT_SEARCH_RADIUS)
+    scale = pyramid.max_scale
+    left = max(int(round(x - anchor['cx'] * scale)) - radius, 0)
+    top = max(int(round(y - anchor['cy'] * scale)) - radius, 0)
+    width = int(np.ceil(anchor['width'] * scale)) + 2 * radius
+    height = int(np.ceil(anchor['height'] * scale)) + 2 * radius
+    gray = screen_capture.grab_gray((left, top, width, height))
+    result = locate(gray, pyramid, anchor.get('min_score', DEFAULT_MIN_SCORE))
+    if result is None:
+        return None
+    score, match_left, match_top, match_scale = result
+    return (left + match_left + anchor['cx'] * match_scale,
+            top + match_top + anchor['cy'] * match_scale,
+            score)
+
+
+def _synthetic_screen(rng, width, height):
+    """生成合成截图：渐变背景上随机分布的色块（按钮、面板）、类似文字的小笔画和少量噪声"""
+    screen = np.empty((height, width), dtype=np.float32)
+    screen[:] = np.linspace(40, 90, width, dtype=np.float32)[None, :]
+    for _ in range(400):
+        w, h = rng.integers(8, 120, size=2)
+        left, top = rng.integers(0, width - w), rng.integers(0, height - h)
+        screen[top:top + h, left:left + w] = rng.integers(0, 256)
+    # 1到5像素的小笔画
+    count = 20000
+    sizes = rng.integers(1, 6, size=(count, 2))
+    lefts = rng.integers(0, width - 5, size=count)
+    tops = rng.integers(0, height - 5, size=count)
+    values = rng.integers(0, 256, size=count)
+    for dy in range(5):
+        for dx in range(5):
+            inside = (dx < sizes[:, 0]) & (dy < sizes[:, 1])
+            screen[tops[inside] + dy, lefts[inside] + dx] = values[inside]
+    screen += rng.normal(0, 2, screen.shape).astype(np.float32)
+    return np.clip(screen, 0, 255).astype(np.uint8)
+
+
+def benchmark(iterations=100, width=1920, height=1080, seed=0):
+    """在合成截图上测试定位耗时和准确度
+
+    每次迭代生成一张截图，在随机位置截取模板，再把整张截图平移一个随机距离（模拟窗口移动）并叠加噪声，
+    然后在原位置附近查找两次模板：第一次需要构建模板金字塔（冷缓存），第二次使用缓存（循环播放时的情况）。
+
+    Returns:
+        dict: 冷/热缓存耗时（毫秒）的均值和 P95，命中率（误差不超过1像素）和未找到次数
+    """
+    rng = np.random.default_rng(seed)
+    previous = screen_capture.capture_service.source
+    cold = []
+    warm = []
+    hits = 0
+    misses = 0
+    try:
+        for _ in range(iterations):
+            screen = _synthetic_screen(rng, width, height)
+            x = int(rng.integers(300, width - 300))
+            y = int(rng.integers(300, height - 300))
+            screen_capture.set_frame_source(screen_capture.FakeFrameSource([screen]))
+            anchor = capture_anchor(x, y)
+            if anchor is None:
+                continue
+            dx, dy = (int(v) for v in rng.integers(-100, 101, size=2))
+            moved = np.roll(screen, (dy, dx), axis=(0, 1)).astype(np.float32)
+            moved += rng.normal(0, 3, moved.shape).astype(np.float32)
+            screen_capture.set_frame_source(screen_capture.FakeFrameSource([np.clip(moved, 0, 255)]))
+            for timings in (cold, warm):
+                # 每次都重新截图，只有模板金字塔在两次查找之间缓存
+                screen_capture.capture_service.invalidate()
+                started = time.perf_counter()
+                found = find_anchor(anchor, x, y)
+                timings.append((time.perf_counter() - started) * 1000)
+            if found is None:
+                misses += 1
+            elif abs(found[0] - (x + dx)) <= 1 and abs(found[1] - (y + dy)) <= 1:
+                hits += 1
+    finally:
+        screen_capture.set_frame_source(previous)
+    cold = np.array(cold)
+    warm = np.array(warm)
+    return {
+        'iterations': len(warm),
+        'cold_mean_ms': float(cold.mean()),
+        'cold_p95_ms': float(np.percentile(cold, 95)),
+        'warm_mean_ms': float(warm.mean()),
+        'warm_p95_ms': float(np.percentile(warm, 95)),
+        'hit_rate': hits / len(warm),
+        'misses': misses
+    }
+
+
+if __name__ == '__main__':
+    # 运行合成截图基准测试：python template_match.py
+    result = benchmark()
+    print(f"定位 {result['iterations']} 次（搜索半径 {DEFAULT_SEARCH_RADIUS} 像素，模板 {DEFAULT_TEMPLATE_SIZE} 像素，"
+          f"{len(ANCHOR_SCALES)} 个缩放比例）")
+    print(f"冷缓存：平均 {result['cold_mean_ms']:.2f}毫秒，P95 {result['cold_p95_ms']:.2f}毫秒")
+    print(f"热缓存：平均 {result['warm_mean_ms']:.2f}毫秒，P95 {result['warm_p95_ms']:.2f}毫秒")
+    print(f"命中率 {result['hit_rate']:.1%}，未找到 {result['misses']} 次")
@@ -0,0 +1,83 @@
+# 引擎等待的停止/暂停响应测试
+import threading
+import time
+
+from engine import AutomationEngine, STATE_PLAYING, STOP_LATENCY_BUDGET, measure_stop_latency
+
+
+def _start_waiting(engine, seconds):
+    """在引擎的工作线程中等待 seconds 秒，返回记录 (wait_until 的返回值, 返回时刻) 的列表"""
+    returned = []
+
+    def worker(engine):
+        returned.append((engine.sleep(seconds), time.perf_counter()))
+        engine.finish()
+
+    assert engine.start(STATE_PLAYING, worker)
+    # 等工作线程进入等待
+    time.sleep(0.05)
+    return returned
+
+
+def test_stop_interrupts_long_wait():
+    engine = AutomationEngine()
+    returned = _start_waiting(engine, 30.0)
+    requested = time.perf_counter()
+    assert engine.request_stop()
+    assert engine.join(5)
+    reached, at = returned[0]
+    assert reached is False
+    assert at - requested < STOP_LATENCY_BUDGET
+
+
+def test_stop_during_pause_returns_immediately():
+    engine = AutomationEngine()
+    returned = _start_waiting(engine, 30.0)
+    assert engine.pause()
+    time.sleep(0.05)
+    assert not returned
+    requested = time.perf_counter()
+    engine.request_stop()
+    assert engine.join(5)
+    reached, at = returned[0]
+    assert reached is False
+    assert at - requested < STOP_LATENCY_BUDGET
+
+
+def test_pause_does_not_count_towards_wait():
+    engine = AutomationEngine()
+    paused_calls = []
+    engine.on_pause = lambda: paused_calls.append('pause')
+    engine.on_resume = lambda: paused_calls.append('resume')
+    started = time.perf_counter()
+    returned = _start_waiting(engine, 0.2)
+    assert engine.pause()
+    time.sleep(0.3)
+    # 暂停期间等待没有结束
+    assert not returned
+    assert engine.resume()
+    assert engine.join(5)
+    reached, at = returned[0]
+    assert reached is True
+    assert at - started >= 0.2 + 0.3 - 0.02
+    assert paused_calls == ['pause', 'resume']
+
+
+def test_wait_until_reaches_deadline_precisely():
+    engine = AutomationEngine()
+    returned = []
+
+    def worker(engine):
+        deadline = engine.clock() + 0.1
+        engine.wait_until(deadline)
+        returned.append(engine.clock() - deadline)
+        engine.finish()
+
+    engine.start(STATE_PLAYING, worker)
+    assert engine.join(5)
+    assert 0 <= returned[0] < 0.01
+
+
+def test_measure_stop_latency_within_budget():
+    result = measure_stop_latency(trials=10, wait_seconds=5.0)
+    assert result['within_budget'], result
@@ -0,0 +1,21 @@
+# 鼠标移动插值测试
+import pytest
+
+import interpolation
+
+
+@pytest.mark.parametrize('mode', interpolation.INTERPOLATION_MODES)
+def test_samples_stay_between_keyframes(mode):
+    keyframes = [(0, 0, 0), (100000, 100, 0), (200000, 100, 100)]
+    samples = interpolation.sample_path(keyframes, mode, 60)
+    assert samples[0] == (0, 0, 0)
+    assert samples[-1] == (200000, 100, 100)
+    # 拐角处不越过关键帧（y 不会为负，x 不会超过 100）
+    for _, x, y in samples:
+        assert 0 <= x <= 100
+        assert 0 <= y <= 100
+
+
+def test_default_mode_is_linear():
+    samples = interpolation.sample_path([(0, 0, 0), (100000, 100, 50)], rate_hz=20)
+    assert samples == [(0, 0, 0), (50000, 50, 25), (100000, 100, 50)]
@@ -0,0 +1,73 @@
+# 画面同步点测试（使用假截图源，不需要屏幕）
+import numpy as np
+import pytest
+
+import screen_capture
+import screen_sync
+
+
+@pytest.fixture
+def frames():
+    """用给定的整屏画面作为截图源，测试结束后恢复"""
+    previous = screen_capture.capture_service.source
+
+    def use(*screens):
+        source = screen_capture.FakeFrameSource(screens)
+        screen_capture.set_frame_source(source)
+        return source
+
+    yield use
+    screen_capture.set_frame_source(previous)
+
+
+class FakeClock:
+    """假时钟：sleep 只推进时间，不真正休眠"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def clock(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def _screen(seed):
+    return np.random.default_rng(seed).integers(0, 255, (200, 300, 3)).astype(np.uint8)
+
+
+def test_wait_matches_when_region_appears(frames):
+    target = _screen(1)
+    frames(target)
+    op = screen_sync.make_wait_operation((20, 30, 64, 48), 0, timeout_us=1000000)
+    # 前三次截图还是别的画面，之后出现目标画面
+    source = frames(_screen(2), _screen(3), _screen(4), target)
+    fake = FakeClock()
+    matched, distance, polls, waited = screen_sync.wait_for_operation(op, clock=fake.clock, sleep=fake.sleep)
+    assert matched
+    assert distance <= op['threshold']
+    assert polls == 4 == source.calls
+    assert waited < 1.0
+
+
+def test_wait_times_out(frames):
+    frames(_screen(1))
+    op = screen_sync.make_wait_operation((0, 0, 32, 32), 0, timeout_us=500000)
+    frames(np.zeros((200, 300, 3), dtype=np.uint8))
+    fake = FakeClock()
+    matched, _, polls, waited = screen_sync.wait_for_operation(op, clock=fake.clock, sleep=fake.sleep)
+    assert not matched
+    assert waited == pytest.approx(0.5)
+    # 画面静止时轮询间隔逐步放慢
+    assert polls < 0.5 / screen_sync.MIN_POLL_INTERVAL
+
+
+def test_wait_stops_when_cancelled(frames):
+    frames(_screen(1))
+    op = screen_sync.make_wait_operation((0, 0, 32, 32), 0)
+    frames(_screen(2))
+    fake = FakeClock()
+    matched, _, polls, _ = screen_sync.wait_for_operation(op, lambda: False, fake.clock, fake.sleep)
+    assert not matched
+    assert polls == 1
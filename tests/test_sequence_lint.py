@@ -0,0 +1,35 @@
+# 序列库检查测试
+import json
+
+import sequence_lint
+
+
+def _codes(findings):
+    return [finding['code'] for finding in findings]
+
+
+def _click(x, y, timestamp_us=0):
+    return [{'type': 'mousedown', 'timestamp_us': timestamp_us, 'x': x, 'y': y, 'button': 'left'},
+            {'type': 'mouseup', 'timestamp_us': timestamp_us + 1000, 'x': x, 'y': y, 'button': 'left'}]
+
+
+def test_negative_coordinates_on_recorded_monitor(tmp_path):
+    # 副显示器在主显示器左侧
+    meta = {'screen': {'monitors': [[0, 0, 1920, 1080], [-1280, 0, 1280, 1024]], 'primary': 0}}
+    operations = _click(-500, 300) + _click(-500, 1050, 2000)
+    path = tmp_path / 'multi.json'
+    path.write_text(json.dumps({'format_version': 2, 'meta': meta, 'operations': operations}), encoding='utf-8')
+    _, count, findings = sequence_lint.lint_file(str(path), (1920, 1080))
+    assert count == 4
+    # 只有落在两个显示器之外的第二次点击越界
+    assert _codes(findings) == ['off-screen', 'off-screen']
+    assert [finding['index'] for finding in findings] == [2, 3]
+
+
+def test_old_sequence_checks_primary_screen(tmp_path):
+    path = tmp_path / 'old.json'
+    path.write_text(json.dumps(_click(-5, 10) + _click(1900, 1100, 2000)), encoding='utf-8')
+    _, _, findings = sequence_lint.lint_file(str(path))
+    assert [finding['index'] for finding in findings] == [0, 1]
+    _, _, findings = sequence_lint.lint_file(str(path), (1920, 1080))
+    assert [finding['index'] for finding in findings] == [0, 1, 2, 3]
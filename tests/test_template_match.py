@@ -0,0 +1,58 @@
+# 图像锚定测试（使用假截图源，不需要屏幕）
+import numpy as np
+import pytest
+
+import screen_capture
+import template_match
+
+
+@pytest.fixture
+def frames():
+    """用给定的整屏画面作为截图源，测试结束后恢复"""
+    previous = screen_capture.capture_service.source
+
+    def use(*screens):
+        source = screen_capture.FakeFrameSource(screens)
+        screen_capture.set_frame_source(source)
+        return source
+
+    yield use
+    screen_capture.set_frame_source(previous)
+
+
+def _screen(seed, width=800, height=600):
+    return np.random.default_rng(seed).integers(0, 255, (height, width)).astype(np.float32)
+
+
+def test_find_anchor_after_window_moves(frames):
+    screen = _screen(0)
+    frames(screen)
+    anchor = template_match.capture_anchor(400, 300)
+    assert anchor is not None
+    frames(np.roll(screen, (25, -40), axis=(0, 1)))
+    found = template_match.find_anchor(anchor, 400, 300)
+    assert found is not None
+    x, y, score = found
+    assert (round(x), round(y)) == (360, 325)
+    assert score > template_match.DEFAULT_MIN_SCORE
+
+
+def test_flat_region_has_no_anchor(frames):
+    frames(np.full((600, 800), 128, dtype=np.float32))
+    assert template_match.capture_anchor(400, 300) is None
+
+
+def test_pre_click_frames_use_frame_before_press(frames):
+    before = _screen(1)
+    frames(before)
+    buffer = template_match.PreClickFrames(48, position=lambda: (410, 290), clock=iter([100, 200]).__next__)
+    buffer.capture()
+    frames(np.zeros((600, 800), dtype=np.float32))
+    buffer.capture()
+    # 按下时刻在第二帧之前：使用第一帧（点击前的画面）
+    (left, top, gray), captured = buffer.crop(400, 300, 150)
+    assert captured == 100
+    assert (left, top) == (376, 276)
+    assert np.array_equal(gray, before[276:324, 376:424])
+    # 指针离截取区域太远时没有可用的帧
+    assert buffer.crop(700, 100, 150) is None
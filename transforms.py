@@ -0,0 +1,106 @@
+# 操作序列时间变换
+# 功能：基于 NumPy 对整个序列的时间戳做向量化变换（平移、缩放、压缩空闲间隔、排序校验），
+#      每个变换返回 op_store 增量列表，可直接记录到编辑历史，也可在脚本中直接调用
+from operator import itemgetter
+
+import numpy as np
+
+import op_store
+
+# 取时间戳字段的函数
+_get_timestamp = itemgetter('timestamp_us')
+
+
+def timestamps_array(operations, start=0, end=None):
+    """以 int64 数组取出 operations[start:end] 的时间戳（微秒）"""
+    if end is None:
+        end = len(operations)
+    return np.fromiter(map(_get_timestamp, operations[start:end]), dtype=np.int64, count=max(end - start, 0))
+
+
+def _write_timestamps(operations, start, old, new):
+    """把新时间戳写回操作，只写入首个到最后一个发生变化的区段，返回增量列表
+
+    增量中直接保存 int64 数组（每个时间戳8字节），比保存 Python 整数列表更省内存
+    """
+    changed = np.flatnonzero(old != new)
+    if changed.size == 0:
+        return []
+    first = int(changed[0])
+    last = int(changed[-1]) + 1
+    delta = (op_store.DELTA_TIMESTAMPS, start + first, old[first:last].copy(), new[first:last])
+    op_store.apply_delta(operations, delta)
+    return [delta]
+
+
+def shift_after(operations, index, delta_us):
+    """把 index 及之后所有操作的时间戳平移 delta_us 微秒"""
+    old = timestamps_array(operations, index)
+    return _write_timestamps(operations, index, old, old + int(delta_us))
+
+
+def scale_range(operations, start, end, factor):
+    """以 operations[start] 为基准把 [start, end) 区间内的时间按 factor 缩放
+
+    区间之后的操作整体平移区间时长的变化量，保持与区间末尾的原有间隔。
+    """
+    if factor <= 0:
+        raise ValueError('缩放倍数必须大于0')
+    old = timestamps_array(operations, start)
+    if old.size == 0:
+        return []
+    length = min(end, len(operations)) - start
+    if length <= 0:
+        return []
+    new = old.copy()
+    base = old[0]
+    new[:length] = base + np.rint((old[:length] - base) * factor).astype(np.int64)
+    if length < old.size:
+        new[length:] += new[length - 1] - old[length - 1]
+    return _write_timestamps(operations, start, old, new)
+
+
+def clamp_gaps(operations, max_gap_us, start=0, end=None):
+    """把 [start, end) 区间内相邻操作之间超过 max_gap_us 的间隔压缩为 max_gap_us
+
+    区间之后的操作整体前移，保持各自的原有间隔。
+    """
+    if max_gap_us < 0:
+        raise ValueError('最大间隔不能为负数')
+    if end is None:
+        end = len(operations)
+    old = timestamps_array(operations, start)
+    if old.size < 2:
+        return []
+    length = min(end, len(operations)) - start
+    if length < 2:
+        return []
+    gaps = np.diff(old)
+    gaps[:length - 1] = np.minimum(gaps[:length - 1], max_gap_us)
+    new = np.empty_like(old)
+    new[0] = old[0]
+    np.cumsum(gaps, out=new[1:])
+    new[1:] += old[0]
+    return _write_timestamps(operations, start, old, new)
+
+
+def find_time_inversions(operations):
+    """返回时间戳比前一个操作更早的操作下标数组（空数组表示时间单调不减）"""
+    timestamps = timestamps_array(operations)
+    return np.flatnonzero(np.diff(timestamps) < 0) + 1
+
+
+def sort_by_time(operations):
+    """按时间戳稳定排序操作序列，已经有序时不做任何修改"""
+    timestamps = timestamps_array(operations)
+    if timestamps.size < 2 or not np.any(np.diff(timestamps) < 0):
+        return []
+    order = np.argsort(timestamps, kind='stable')
+    old_ops = list(operations)
+    new_ops = [old_ops[i] for i in order.tolist()]
+    deltas = [
+        (op_store.DELTA_REMOVE, [(0, old_ops)]),
+        (op_store.DELTA_INSERT, [(0, new_ops)])
+    ]
+    op_store.apply_deltas(operations, deltas)
+    return deltas
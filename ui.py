@@ -1,7 +1,7 @@
 # 导入系统模块
 import sys
-# 导入线程模块，用于后台执行录制和播放操作
-import threading
+# 导入 Future，用于把控制服务的加载请求交给界面线程并取回结果
+import concurrent.futures
 
 # 从 PyQt5 导入 UI 组件
 from PyQt5.QtWidgets import (
@@ -37,12 +37,32 @@ import utils
 from recorder import start_recording, stop_recording
 
 # 从播放模块导入函数
-from player import play_operations, stop_playback
+from player import play_operations, stop_playback, compile_playlist, play_playlist, toggle_pause
 
 # 从序列管理模块导入函数
 from sequence import save_sequence, load_sequence, delete_sequence, load_all_sequences, rename_sequence
+from sequence import OP_CALL, make_call_operation
 # 从录制模块导入修饰键常量
 from recorder import MODIFIER_KEYS
+# 导入操作序列批量编辑模块
+import op_store
+# 导入编辑历史模块
+from history import EditHistory
+# 导入时间变换模块
+import transforms
+# 导入画面同步模块
+import screen_sync
+
+import playlist
+
+# 导入录制/播放引擎
+from engine import default_engine, STATE_RECORDING, STATE_PLAYING
+
+import control_server
+
+import scheduler
+
+import profiler
 
 # 主窗口类，继承自 QMainWindow
 class MainWindow(QMainWindow):
@@ -53,6 +73,23 @@ class MainWindow(QMainWindow):
         # 调用父类 QMainWindow 的初始化方法
         super().__init__()
         
+        # 录制/播放引擎，持有录制和播放的运行状态
+        self.engine = default_engine
+        
+        # 本机控制服务（启用时其他程序可以通过它控制同一个引擎）
+        # load 命令通过信号交给界面线程执行，与界面中的加载一样刷新操作列表和撤销历史
+        self.control_server = None
+        if utils.control_server_enabled:
+            utils.control_signals.load_requested.connect(self.on_control_load)
+            self.control_server = control_server.start_in_thread(self.engine, port=utils.control_server_port,
+                                                                 load_handler=self._request_control_load)
+        
+        # 定时任务（启用时与界面共用同一个引擎，界面播放期间到期的任务等播放结束后再运行）
+        self.scheduler = None
+        if utils.scheduler_enabled:
+            self.scheduler = scheduler.Scheduler(self.engine)
+            self.scheduler.start()
+        
         # 初始化用户界面
         self.initUI()
         
@@ -224,11 +261,33 @@ class MainWindow(QMainWindow):
         record_buttons.addWidget(self.start_record_btn)
         record_buttons.addWidget(self.stop_record_btn)
         
+        # 鼠标移动采样模式布局
+        capture_layout = QHBoxLayout()
+        capture_layout.setSpacing(15)
+        capture_layout.setContentsMargins(0, 0, 0, 0)
+        # 采样模式下拉框
+        self.capture_mode_combo = QComboBox()
+        self.capture_mode_combo.addItem('自适应采样', 'adaptive')
+        self.capture_mode_combo.addItem('固定频率采样', 'fixed')
+        self.capture_mode_combo.addItem('全部记录', 'all')
+        self.capture_mode_combo.setCurrentIndex(self.capture_mode_combo.findData(utils.capture_mode))
+        self.capture_mode_combo.setMinimumSize(180, 35)  # 设置最小大小
+        self.capture_mode_combo.setSizePolicy(QSizePolicy.Preferred, QSizePolicy.Fixed)  # 设置大小策略
+        # 添加到采样模式布局
+        capture_layout.addWidget(QLabel('移动采样：'))
+        capture_layout.addWidget(self.capture_mode_combo)
+        # 图像锚定复选框：录制时在按下位置截取模板，播放时按模板位置修正点击
+        self.anchor_checkbox = QCheckBox('点击图像锚定')
+        self.anchor_checkbox.setChecked(utils.anchor_clicks)
+        capture_layout.addWidget(self.anchor_checkbox)
+        capture_layout.addStretch()
+        
         # 添加按钮布局和提示信息到录制控制布局
         record_layout.addLayout(record_buttons)
         hint_label = QLabel('提示：按esc可停止录制')
         hint_label.setStyleSheet('color: #999999; font-size: 12px;')
         record_layout.addWidget(hint_label)
+        record_layout.addLayout(capture_layout)
         
         # 设置录制控制分组的布局
         record_group.setLayout(record_layout)
@@ -259,17 +318,39 @@ class MainWindow(QMainWindow):
         self.stop_play_btn.setEnabled(False)
         # 设置按钮对象名
         self.stop_play_btn.setObjectName('stop_play_btn')
+        # 暂停/继续按钮
+        self.pause_play_btn = QPushButton('暂停')
+        self.pause_play_btn.setMinimumSize(90, 30)  # 减小按钮大小
+        self.pause_play_btn.setSizePolicy(QSizePolicy.Minimum, QSizePolicy.Fixed)  # 设置大小策略
+        # 初始禁用暂停按钮
+        self.pause_play_btn.setEnabled(False)
+        
+        # 播放列表按钮
+        self.playlist_btn = QPushButton('播放列表')
+        self.playlist_btn.setMinimumSize(90, 30)  # 减小按钮大小
+        self.playlist_btn.setSizePolicy(QSizePolicy.Minimum, QSizePolicy.Fixed)  # 设置大小策略
+        
+        # 性能分析按钮
+        self.profile_btn = QPushButton('性能分析')
+        self.profile_btn.setMinimumSize(90, 30)  # 减小按钮大小
+        self.profile_btn.setSizePolicy(QSizePolicy.Minimum, QSizePolicy.Fixed)  # 设置大小策略
         
         # 连接按钮点击信号
         self.play_btn.clicked.connect(self.on_play)
         self.stop_play_btn.clicked.connect(self.on_stop_play)
+        self.pause_play_btn.clicked.connect(self.on_pause_play)
+        self.playlist_btn.clicked.connect(self.on_playlist)
+        self.profile_btn.clicked.connect(self.on_profiles)
         
         # 添加按钮到布局
         play_buttons.addWidget(self.play_btn)
         play_buttons.addWidget(self.stop_play_btn)
+        play_buttons.addWidget(self.pause_play_btn)
+        play_buttons.addWidget(self.playlist_btn)
+        play_buttons.addWidget(self.profile_btn)
         
         # 添加按esc键停止播放的说明
-        play_hint_label = QLabel('提示：按esc键可停止播放')
+        play_hint_label = QLabel('提示：按esc键可停止播放，按F9键可暂停/继续播放')
         play_hint_label.setStyleSheet('color: #999999; font-size: 12px;')
         
         # 循环设置布局
@@ -332,12 +413,52 @@ class MainWindow(QMainWindow):
         speed_layout.addWidget(self.speed_combo)
         speed_layout.addStretch()
         
+        # 空闲间隔上限配置布局
+        idle_layout = QHBoxLayout()
+        idle_layout.setSpacing(15)
+        idle_layout.setContentsMargins(0, 0, 0, 0)
+        # 空闲间隔上限下拉框，数据为微秒
+        self.idle_gap_combo = QComboBox()
+        self.idle_gap_combo.addItem('按原始间隔', 0)
+        self.idle_gap_combo.addItem('最长等待0.5秒', 500000)
+        self.idle_gap_combo.addItem('最长等待1秒', 1000000)
+        self.idle_gap_combo.addItem('最长等待2秒', 2000000)
+        self.idle_gap_combo.addItem('最长等待5秒', 5000000)
+        self.idle_gap_combo.setMinimumSize(180, 35)  # 设置最小大小
+        self.idle_gap_combo.setSizePolicy(QSizePolicy.Preferred, QSizePolicy.Fixed)  # 设置大小策略
+        
+        # 添加到空闲间隔布局
+        idle_layout.addWidget(QLabel('空闲间隔：'))
+        idle_layout.addWidget(self.idle_gap_combo)
+        idle_layout.addStretch()
+        
+        # 鼠标移动插值配置布局
+        interpolation_layout = QHBoxLayout()
+        interpolation_layout.setSpacing(15)
+        interpolation_layout.setContentsMargins(0, 0, 0, 0)
+        # 插值模式下拉框
+        self.interpolation_combo = QComboBox()
+        self.interpolation_combo.addItem('平滑曲线', 'catmull_rom')
+        self.interpolation_combo.addItem('贝塞尔平滑', 'bezier')
+        self.interpolation_combo.addItem('直线', 'linear')
+        self.interpolation_combo.addItem('不插值', 'exact')
+        self.interpolation_combo.setCurrentIndex(self.interpolation_combo.findData(utils.interpolation_mode))
+        self.interpolation_combo.setMinimumSize(180, 35)  # 设置最小大小
+        self.interpolation_combo.setSizePolicy(QSizePolicy.Preferred, QSizePolicy.Fixed)  # 设置大小策略
+        
+        # 添加到插值布局
+        interpolation_layout.addWidget(QLabel('移动插值：'))
+        interpolation_layout.addWidget(self.interpolation_combo)
+        interpolation_layout.addStretch()
+        
         # 将所有布局添加到播放控制布局
         play_layout.addLayout(play_buttons)
         play_layout.addWidget(play_hint_label)
         play_layout.addLayout(loop_layout)
         play_layout.addLayout(loop_config_layout)
         play_layout.addLayout(speed_layout)
+        play_layout.addLayout(idle_layout)
+        play_layout.addLayout(interpolation_layout)
         
         # 设置播放控制分组的布局
         play_group.setLayout(play_layout)
@@ -526,11 +647,35 @@ class MainWindow(QMainWindow):
         self.copy_operation_btn.setMinimumSize(70, 25)
         self.copy_operation_btn.setSizePolicy(QSizePolicy.Minimum, QSizePolicy.Fixed)
         self.copy_operation_btn.setStyleSheet('background-color: #FF9800; color: white;')
+        # 移动操作按钮
+        self.move_operation_btn = QPushButton('移动')
+        self.move_operation_btn.setMinimumSize(70, 25)
+        self.move_operation_btn.setSizePolicy(QSizePolicy.Minimum, QSizePolicy.Fixed)
+        self.move_operation_btn.setStyleSheet('background-color: #795548; color: white;')
         # 删除操作按钮
         self.delete_operation_btn = QPushButton('删除')
         self.delete_operation_btn.setMinimumSize(70, 25)
         self.delete_operation_btn.setSizePolicy(QSizePolicy.Minimum, QSizePolicy.Fixed)
         self.delete_operation_btn.setStyleSheet('background-color: #f44336; color: white;')
+        # 撤销按钮
+        self.undo_btn = QPushButton('撤销')
+        self.undo_btn.setMinimumSize(70, 25)
+        self.undo_btn.setSizePolicy(QSizePolicy.Minimum, QSizePolicy.Fixed)
+        self.undo_btn.setStyleSheet('background-color: #607D8B; color: white;')
+        self.undo_btn.setShortcut('Ctrl+Z')
+        self.undo_btn.setEnabled(False)
+        # 重做按钮
+        self.redo_btn = QPushButton('重做')
+        self.redo_btn.setMinimumSize(70, 25)
+        self.redo_btn.setSizePolicy(QSizePolicy.Minimum, QSizePolicy.Fixed)
+        self.redo_btn.setStyleSheet('background-color: #607D8B; color: white;')
+        self.redo_btn.setShortcut('Ctrl+Y')
+        self.redo_btn.setEnabled(False)
+        # 时间调整按钮
+        self.retime_btn = QPushButton('时间调整')
+        self.retime_btn.setMinimumSize(70, 25)
+        self.retime_btn.setSizePolicy(QSizePolicy.Minimum, QSizePolicy.Fixed)
+        self.retime_btn.setStyleSheet('background-color: #009688; color: white;')
         # 清空操作按钮
         self.clear_btn = QPushButton('清空')
         self.clear_btn.setMinimumSize(70, 25)
@@ -545,17 +690,36 @@ class MainWindow(QMainWindow):
         self.edit_operation_btn.clicked.connect(self.on_edit_operation)
         self.copy_operation_btn.clicked.connect(self.on_copy_operation)
         self.delete_operation_btn.clicked.connect(self.on_delete_operation)
+        self.move_operation_btn.clicked.connect(self.on_move_operation)
+        self.undo_btn.clicked.connect(self.on_undo)
+        self.redo_btn.clicked.connect(self.on_redo)
+        self.retime_btn.clicked.connect(self.on_retime_operations)
+        # 连接操作项点击事件（只连接一次）
+        self.operations_list.itemClicked.connect(self.on_operation_clicked)
         
         # 添加按钮到布局
         operations_buttons.addWidget(self.add_operation_btn)
         operations_buttons.addWidget(self.edit_operation_btn)
         operations_buttons.addWidget(self.copy_operation_btn)
+        operations_buttons.addWidget(self.move_operation_btn)
         operations_buttons.addWidget(self.delete_operation_btn)
-        operations_buttons.addWidget(self.clear_btn)
+        
+        # 第二行按钮布局
+        operations_buttons_2 = QHBoxLayout()
+        operations_buttons_2.setSpacing(8)
+        operations_buttons_2.addWidget(self.undo_btn)
+        operations_buttons_2.addWidget(self.redo_btn)
+        operations_buttons_2.addWidget(self.retime_btn)
+        operations_buttons_2.addStretch()
+        operations_buttons_2.addWidget(self.clear_btn)
         
         # 添加到操作序列布局
         operations_layout.addWidget(self.operations_list)
         operations_layout.addLayout(operations_buttons)
+        operations_layout.addLayout(operations_buttons_2)
+        
+        # 编辑历史，以增量记录每次编辑，用于撤销/重做
+        self.history = EditHistory(utils.history_memory_budget)
         
         # 设置操作序列分组的布局
         operations_group.setLayout(operations_layout)
@@ -602,6 +766,7 @@ class MainWindow(QMainWindow):
         
         # 加载序列列表
         # 启动时从文件加载已保存的序列
+        self.shown_load_errors = {}  # 已经提示过的序列加载错误
         try:
             self.load_sequences_list()
         except Exception as e:
@@ -610,6 +775,15 @@ class MainWindow(QMainWindow):
     
     def on_start_record(self):
         """开始录制操作"""
+        # 更新录制设置
+        utils.capture_mode = self.capture_mode_combo.currentData()  # 鼠标移动采样模式
+        utils.anchor_clicks = self.anchor_checkbox.isChecked()      # 点击图像锚定
+        
+        # 启动录制线程（引擎正在录制或播放时不能开始）
+        if not self.engine.start(STATE_RECORDING, start_recording):
+            QMessageBox.warning(self, '错误', '正在录制或播放，请先停止')
+            return
+        
         # 更新按钮状态
         self.start_record_btn.setEnabled(False)  # 禁用开始录制按钮
         self.stop_record_btn.setEnabled(True)    # 启用停止录制按钮
@@ -622,14 +796,6 @@ class MainWindow(QMainWindow):
         
         # 最小化窗口，方便用户操作
         self.showMinimized()
-        
-        # 启动录制线程
-        # 创建线程，目标函数为 start_recording
-        recording_thread = threading.Thread(target=start_recording)
-        # 设置为守护线程，主程序退出时自动退出
-        recording_thread.daemon = True
-        # 启动线程
-        recording_thread.start()
     
     def on_stop_record(self):
         """停止录制操作"""
@@ -654,8 +820,15 @@ class MainWindow(QMainWindow):
     def on_play(self):
         """开始播放操作"""
         # 更新播放设置
-        utils.is_looping = self.loop_checkbox.isChecked()  # 设置是否循环播放
+        self.engine.is_looping = self.loop_checkbox.isChecked()  # 设置是否循环播放
         utils.playback_speed = self.speed_combo.currentData()  # 获取播放速度
+        utils.interpolation_mode = self.interpolation_combo.currentData()  # 获取鼠标移动插值模式
+        utils.max_idle_gap_us = self.idle_gap_combo.currentData()  # 获取空闲间隔上限
+        
+        # 启动播放线程，目标函数为 play_operations（引擎正在录制或播放时不能开始）
+        if not self.engine.start(STATE_PLAYING, play_operations):
+            QMessageBox.warning(self, '错误', '正在录制或播放，请先停止')
+            return
         
         # 更新按钮状态
         self.play_btn.setEnabled(False)           # 禁用播放按钮
@@ -664,14 +837,303 @@ class MainWindow(QMainWindow):
         
         # 最小化窗口，方便操作执行
         self.showMinimized()
+    
+    def on_playlist(self):
+        """编辑并播放播放列表"""
+        from PyQt5.QtWidgets import QDialog
+        
+        sequences = load_all_sequences()
+        playlist.load_all_playlists()
+        items = []
+        
+        # 创建播放列表对话框
+        dialog = QDialog(self)
+        dialog.setWindowTitle('播放列表')
+        dialog.setMinimumWidth(500)
+        
+        layout = QVBoxLayout(dialog)
         
-        # 启动播放线程
-        # 创建线程，目标函数为 play_operations
-        playback_thread = threading.Thread(target=play_operations)
-        # 设置为守护线程
-        playback_thread.daemon = True
-        # 启动线程
-        playback_thread.start()
+        # 已保存的播放列表
+        saved_layout = QHBoxLayout()
+        saved_combo = QComboBox()
+        load_btn = QPushButton('加载')
+        delete_btn = QPushButton('删除')
+        saved_layout.addWidget(QLabel('已保存:'))
+        saved_layout.addWidget(saved_combo, 1)
+        saved_layout.addWidget(load_btn)
+        saved_layout.addWidget(delete_btn)
+        layout.addLayout(saved_layout)
+        
+        # 播放列表项
+        items_list = QListWidget()
+        layout.addWidget(items_list)
+        
+        # 添加项：序列、遍数、速度、开始前等待
+        add_layout = QHBoxLayout()
+        sequence_combo = QComboBox()
+        sequence_combo.addItems(sequences)
+        loops_input = QLineEdit('1')
+        loops_input.setPlaceholderText('遍数')
+        speed_combo = QComboBox()
+        for index in range(self.speed_combo.count()):
+            speed_combo.addItem(self.speed_combo.itemText(index), self.speed_combo.itemData(index))
+        speed_combo.setCurrentIndex(self.speed_combo.findData(1.0))
+        delay_input = QLineEdit('0')
+        delay_input.setPlaceholderText('等待（秒）')
+        add_btn = QPushButton('添加')
+        add_layout.addWidget(sequence_combo, 1)
+        add_layout.addWidget(QLabel('遍数:'))
+        add_layout.addWidget(loops_input)
+        add_layout.addWidget(speed_combo)
+        add_layout.addWidget(QLabel('等待(秒):'))
+        add_layout.addWidget(delay_input)
+        add_layout.addWidget(add_btn)
+        layout.addLayout(add_layout)
+        
+        # 调整顺序
+        order_layout = QHBoxLayout()
+        up_btn = QPushButton('上移')
+        down_btn = QPushButton('下移')
+        remove_btn = QPushButton('移除')
+        order_layout.addWidget(up_btn)
+        order_layout.addWidget(down_btn)
+        order_layout.addWidget(remove_btn)
+        order_layout.addStretch()
+        layout.addLayout(order_layout)
+        
+        # 保存和播放
+        bottom_layout = QHBoxLayout()
+        name_input = QLineEdit()
+        name_input.setPlaceholderText('播放列表名称')
+        save_btn = QPushButton('保存')
+        start_btn = QPushButton('播放')
+        bottom_layout.addWidget(name_input, 1)
+        bottom_layout.addWidget(save_btn)
+        bottom_layout.addWidget(start_btn)
+        layout.addLayout(bottom_layout)
+        
+        def refresh_saved():
+            saved_combo.clear()
+            saved_combo.addItem('选择播放列表')
+            saved_combo.addItems(sorted(utils.playlists))
+        
+        def refresh_items(selected=None):
+            items_list.clear()
+            for item in items:
+                items_list.addItem(playlist.describe_item(item))
+            if selected is not None and 0 <= selected < len(items):
+                items_list.setCurrentRow(selected)
+        
+        def on_add():
+            if not sequence_combo.currentText():
+                QMessageBox.warning(dialog, '错误', '没有可添加的序列')
+                return
+            try:
+                loops = int(loops_input.text())
+                delay = float(delay_input.text() or 0)
+            except ValueError:
+                QMessageBox.warning(dialog, '错误', '遍数必须是整数，等待时间必须是数字')
+                return
+            if loops < 1 or delay < 0:
+                QMessageBox.warning(dialog, '错误', '遍数至少为1，等待时间不能为负')
+                return
+            items.append(playlist.make_item(sequence_combo.currentText(), loops, speed_combo.currentData(),
+                                            utils.seconds_to_us(delay)))
+            refresh_items(len(items) - 1)
+        
+        def on_move(step):
+            row = items_list.currentRow()
+            target = row + step
+            if row < 0 or not 0 <= target < len(items):
+                return
+            items[row], items[target] = items[target], items[row]
+            refresh_items(target)
+        
+        def on_remove():
+            row = items_list.currentRow()
+            if row >= 0:
+                del items[row]
+                refresh_items(min(row, len(items) - 1))
+        
+        def on_load():
+            name = saved_combo.currentText()
+            if name not in utils.playlists:
+                QMessageBox.warning(dialog, '错误', '请选择要加载的播放列表')
+                return
+            items[:] = [dict(item) for item in utils.playlists[name]]
+            name_input.setText(name)
+            refresh_items()
+        
+        def on_delete():
+            name = saved_combo.currentText()
+            if name not in utils.playlists:
+                QMessageBox.warning(dialog, '错误', '请选择要删除的播放列表')
+                return
+            if QMessageBox.question(dialog, '确认', f'确定要删除播放列表 "{name}" 吗？',
+                                    QMessageBox.Yes | QMessageBox.No) == QMessageBox.Yes:
+                success, message = playlist.delete_playlist(name)
+                if success:
+                    refresh_saved()
+                else:
+                    QMessageBox.warning(dialog, '错误', message)
+        
+        def on_save():
+            success, message = playlist.save_playlist(name_input.text().strip(), [dict(item) for item in items])
+            if success:
+                QMessageBox.information(dialog, '成功', message)
+                refresh_saved()
+            else:
+                QMessageBox.warning(dialog, '错误', message)
+        
+        def on_start():
+            if not items:
+                QMessageBox.warning(dialog, '错误', '播放列表为空')
+                return
+            # 在界面线程中加载并编译所有项，出错时不开始播放
+            utils.interpolation_mode = self.interpolation_combo.currentData()  # 获取鼠标移动插值模式
+            utils.max_idle_gap_us = self.idle_gap_combo.currentData()  # 获取空闲间隔上限
+            try:
+                compiled = compile_playlist(items)
+            except ValueError as e:
+                QMessageBox.warning(dialog, '错误', str(e))
+                return
+            # 启动播放线程
+            if not self.engine.start(STATE_PLAYING, play_playlist, compiled):
+                QMessageBox.warning(dialog, '错误', '正在录制或播放，请先停止')
+                return
+            dialog.accept()
+            
+            # 更新按钮状态
+            self.play_btn.setEnabled(False)           # 禁用播放按钮
+            self.stop_play_btn.setEnabled(True)       # 启用停止按钮
+            self.start_record_btn.setEnabled(False)   # 禁用开始录制按钮
+            
+            # 最小化窗口，方便操作执行
+            self.showMinimized()
+        
+        add_btn.clicked.connect(on_add)
+        up_btn.clicked.connect(lambda: on_move(-1))
+        down_btn.clicked.connect(lambda: on_move(1))
+        remove_btn.clicked.connect(on_remove)
+        load_btn.clicked.connect(on_load)
+        delete_btn.clicked.connect(on_delete)
+        save_btn.clicked.connect(on_save)
+        start_btn.clicked.connect(on_start)
+        
+        refresh_saved()
+        # 正在播放时只能编辑，不能再开始播放
+        start_btn.setEnabled(not self.engine.is_playing)
+        dialog.exec_()
+    
+    def on_profiles(self):
+        """设置采样性能分析，查看已保存的性能分析文件"""
+        import os
+        from PyQt5.QtWidgets import QDialog
+        
+        dialog = QDialog(self)
+        dialog.setWindowTitle('性能分析')
+        dialog.setMinimumWidth(500)
+        
+        layout = QVBoxLayout(dialog)
+        
+        # 是否在录制和播放时采样
+        profile_checkbox = QCheckBox('录制和播放时进行采样性能分析')
+        profile_checkbox.setChecked(self.engine.profile)
+        layout.addWidget(profile_checkbox)
+        hint_label = QLabel('结果以折叠栈格式保存在 logs/profiles 目录，可用 flamegraph.pl 或 speedscope 查看')
+        hint_label.setStyleSheet('color: #999999; font-size: 12px;')
+        layout.addWidget(hint_label)
+        
+        # 已保存的性能分析文件（最新的在前）
+        profiles_list = QListWidget()
+        layout.addWidget(profiles_list)
+        summary_text = QTextEdit()
+        summary_text.setReadOnly(True)
+        summary_text.setMaximumHeight(160)
+        layout.addWidget(summary_text)
+        
+        buttons_layout = QHBoxLayout()
+        open_btn = QPushButton('打开')
+        open_dir_btn = QPushButton('打开目录')
+        refresh_btn = QPushButton('刷新')
+        close_btn = QPushButton('关闭')
+        buttons_layout.addWidget(open_btn)
+        buttons_layout.addWidget(open_dir_btn)
+        buttons_layout.addWidget(refresh_btn)
+        buttons_layout.addStretch()
+        buttons_layout.addWidget(close_btn)
+        layout.addLayout(buttons_layout)
+        
+        def refresh():
+            profiles_list.clear()
+            for name, size, mtime in profiler.list_profiles():
+                item = QListWidgetItem(f'{name}（{size / 1024:.1f} KB）')
+                item.setData(Qt.UserRole, name)
+                profiles_list.addItem(item)
+            summary_text.clear()
+        
+        def selected_path():
+            item = profiles_list.currentItem()
+            if item is None:
+                return None
+            return os.path.join(utils.profiles_dir, item.data(Qt.UserRole))
+        
+        def on_select():
+            # 显示自身耗时最多的函数
+            path = selected_path()
+            if path is None:
+                return
+            try:
+                samples = profiler.read_profile(path)
+            except OSError as e:
+                summary_text.setPlainText(f'读取失败: {e}')
+                return
+            total = sum(samples.values()) or 1
+            lines = [f'共 {total} 个采样，自身 / 总计 / 函数：']
+            for frame, self_count, total_count in profiler.top_functions(samples, 10):
+                lines.append(f'{self_count / total:.1%} / {total_count / total:.1%}  {frame}')
+            summary_text.setPlainText('\n'.join(lines))
+        
+        def on_open():
+            path = selected_path()
+            if path is None:
+                QMessageBox.warning(dialog, '错误', '请先选择性能分析文件')
+                return
+            try:
+                profiler.open_path(path)
+            except OSError as e:
+                QMessageBox.warning(dialog, '错误', f'打开失败: {e}')
+        
+        def on_open_dir():
+            if not os.path.exists(utils.profiles_dir):
+                os.makedirs(utils.profiles_dir)
+            try:
+                profiler.open_path(utils.profiles_dir)
+            except OSError as e:
+                QMessageBox.warning(dialog, '错误', f'打开失败: {e}')
+        
+        def on_toggle(checked):
+            self.engine.profile = checked
+            utils.logger.info("采样性能分析已%s", '开启' if checked else '关闭')
+        
+        profile_checkbox.toggled.connect(on_toggle)
+        profiles_list.currentItemChanged.connect(lambda *args: on_select())
+        profiles_list.itemDoubleClicked.connect(lambda *args: on_open())
+        open_btn.clicked.connect(on_open)
+        open_dir_btn.clicked.connect(on_open_dir)
+        refresh_btn.clicked.connect(refresh)
+        close_btn.clicked.connect(dialog.accept)
+        
+        refresh()
+        dialog.exec_()
+    
+    def on_pause_play(self):
+        """暂停或继续播放"""
+        paused = toggle_pause(self.engine)
+        self.pause_play_btn.setText('继续' if paused else '暂停')
+        if not paused:
+            # 继续播放时最小化窗口，与开始播放时一致
+            self.showMinimized()
     
     def on_stop_play(self):
         """停止播放操作"""
@@ -694,10 +1156,13 @@ class MainWindow(QMainWindow):
         self.activateWindow()    # 激活窗口
 
         # 重置循环次数
-        utils.loop_count = 0
+        self.engine.loop_count = 0
 
-        # 播放完成，弹出提示
-        QMessageBox.information(self, '播放完成', '操作序列播放已完成！')
+        # 播放完成，弹出提示（附带空闲间隔压缩节省的时间）
+        message = '操作序列播放已完成！'
+        if self.engine.playback_idle_saved_seconds > 0:
+            message += f'\n空闲间隔压缩每轮节省 {self.engine.playback_idle_saved_seconds:.1f} 秒'
+        QMessageBox.information(self, '播放完成', message)
         
         # 更新按钮状态
         self.play_btn.setEnabled(True)           # 启用播放按钮
@@ -718,17 +1183,27 @@ class MainWindow(QMainWindow):
         self.load_btn.setEnabled(True)           # 启用加载按钮
         self.delete_btn.setEnabled(True)         # 启用删除按钮
         
+        # 录制产生了新的操作序列，清空撤销栈
+        self._reset_undo()
+        
         # 更新操作列表，显示录制的操作
         self.update_operations_list()
         
-        # 显示录制完成提示
-        QMessageBox.information(self, '录制完成', '操作序列录制已完成！')
+        # 显示录制完成提示（附带鼠标移动采样统计）
+        message = '操作序列录制已完成！'
+        move_stats = self.engine.capture_stats.get('moves')
+        if move_stats and move_stats['seen']:
+            message += (f"\n鼠标移动：收到 {move_stats['seen']} 个，记录 {move_stats['recorded']} 个，"
+                        f"节省 {move_stats['saved_ratio']:.1%}")
+        if self.engine.capture_stats.get('dropped'):
+            message += f"\n警告：采集队列已满，丢弃了 {self.engine.capture_stats['dropped']} 个事件"
+        QMessageBox.information(self, '录制完成', message)
     
     def on_loop_changed(self, state):
         """循环设置变化时的处理"""
         # 更新循环状态
         # 当复选框被选中时，state == Qt.Checked 为 True
-        utils.is_looping = state == Qt.Checked
+        self.engine.is_looping = state == Qt.Checked
     
     def on_loop_count_changed(self, text):
         """循环次数变化时的处理"""
@@ -737,13 +1212,13 @@ class MainWindow(QMainWindow):
             count = int(text)
             # 确保循环次数大于0
             if count > 0:
-                utils.max_loop_count = count
+                self.engine.max_loop_count = count
             else:
                 # 输入无效时，默认为1
-                utils.max_loop_count = 1
+                self.engine.max_loop_count = 1
         except ValueError:
             # 转换失败时，默认为1
-            utils.max_loop_count = 1
+            self.engine.max_loop_count = 1
     
     def on_save_sequence(self):
         """保存序列操作"""
@@ -789,14 +1264,34 @@ class MainWindow(QMainWindow):
         if success:
             # 加载成功
             QMessageBox.information(self, '成功', message)
+            # 清空撤销栈
+            self._reset_undo()
             # 更新操作列表
             self.update_operations_list()
             # 更新当前序列标签
-            self.current_sequence_label.setText(f'当前序列：{utils.current_sequence}')
+            self.current_sequence_label.setText(f'当前序列：{self.engine.current_sequence}')
         else:
             # 加载失败
             QMessageBox.warning(self, '错误', message)
     
+    def _request_control_load(self, name):
+        """控制服务的 load 命令（在控制服务线程中调用）：发送信号由界面线程加载，返回结果的 Future"""
+        future = concurrent.futures.Future()
+        utils.control_signals.load_requested.emit(name, future)
+        return future
+    
+    def on_control_load(self, name, future):
+        """在界面线程中执行控制服务的 load 命令"""
+        try:
+            success, message = load_sequence(name)
+            if success:
+                self._reset_undo()
+                self.update_operations_list()
+                self.current_sequence_label.setText(f'当前序列：{self.engine.current_sequence}')
+            future.set_result((success, message))
+        except Exception as e:
+            future.set_exception(e)
+    
     def on_delete_sequence(self):
         """删除序列操作"""
         # 获取选中的序列名称
@@ -822,7 +1317,7 @@ class MainWindow(QMainWindow):
                 # 重新加载序列列表
                 self.load_sequences_list()
                 # 更新当前序列标签
-                self.current_sequence_label.setText(f'当前序列：{utils.current_sequence}')
+                self.current_sequence_label.setText(f'当前序列：{self.engine.current_sequence}')
             else:
                 # 删除失败
                 QMessageBox.warning(self, '错误', message)
@@ -862,7 +1357,7 @@ class MainWindow(QMainWindow):
                 # 重新加载序列列表
                 self.load_sequences_list()
                 # 更新当前序列标签
-                self.current_sequence_label.setText(f'当前序列：{utils.current_sequence}')
+                self.current_sequence_label.setText(f'当前序列：{self.engine.current_sequence}')
             else:
                 # 修改失败
                 QMessageBox.warning(self, '错误', message)
@@ -873,16 +1368,22 @@ class MainWindow(QMainWindow):
         if QMessageBox.question(self, '确认', '确定要清空所有操作记录吗？', 
                                QMessageBox.Yes | QMessageBox.No) == QMessageBox.Yes:
             # 用户确认清空
-            # 清空操作列表
-            utils.recorded_operations = []
+            state_before = self._sequence_state()
+            # 清空操作列表（换成新的列表，不影响已加载到内存的序列），记录为可撤销的删除
+            old_operations = self.engine.recorded_operations
+            self.engine.recorded_operations = []
+            self.engine.sequence_meta = {}
             # 清空当前序列
-            utils.current_sequence = ""
+            self.engine.current_sequence = ""
+            if old_operations:
+                self._record_edit('清空', [(op_store.DELTA_REMOVE, [(0, old_operations)])],
+                                  state_before, self._sequence_state())
             # 清空操作列表控件
             self.operations_list.clear()
             # 清空操作详情文本框
             self.detail_text.clear()
             # 更新当前序列标签
-            self.current_sequence_label.setText(f'当前序列：{utils.current_sequence}')
+            self.current_sequence_label.setText(f'当前序列：{self.engine.current_sequence}')
     
     def load_sequences_list(self):
         """加载序列列表"""
@@ -906,6 +1407,14 @@ class MainWindow(QMainWindow):
         self.rename_combo.addItem('选择序列')
         for seq in sequences:
             self.rename_combo.addItem(seq)
+        
+        # 提示无法读取的序列文件（同样的错误只提示一次）
+        if utils.sequence_load_errors and utils.sequence_load_errors != self.shown_load_errors:
+            self.shown_load_errors = dict(utils.sequence_load_errors)
+            names = '\n'.join(sorted(utils.sequence_load_errors)[:10])
+            QMessageBox.warning(self, '序列加载失败',
+                                f'以下 {len(utils.sequence_load_errors)} 个序列文件无法读取：\n{names}\n\n'
+                                f'详细信息见日志，或运行 python sequence_lint.py 检查整个序列库')
     
     def update_operations_list(self):
         """更新操作列表"""
@@ -913,12 +1422,14 @@ class MainWindow(QMainWindow):
         self.operations_list.clear()
         
         # 遍历录制的操作列表
-        for i, op in enumerate(utils.recorded_operations):
+        for i, op in enumerate(self.engine.recorded_operations):
             # 根据操作类型生成显示文本
             if op['type'] == 'mousemove':
                 item_text = f'{i+1}. 鼠标移动到 ({int(op["x"])}, {int(op["y"])})'
             elif op['type'] == 'mousedown':
                 item_text = f'{i+1}. 鼠标按下 ({int(op["x"])}, {int(op["y"])})'
+                if 'anchor' in op:
+                    item_text += ' [图像锚定]'
             elif op['type'] == 'mouseup':
                 item_text = f'{i+1}. 鼠标释放 ({int(op["x"])}, {int(op["y"])})'
             elif op['type'] == 'keydown':
@@ -931,6 +1442,13 @@ class MainWindow(QMainWindow):
                     item_text = f'{i+1}. 组合键释放: {op["key"]}'
                 else:
                     item_text = f'{i+1}. 按键释放: {op["key"]}'
+            elif op['type'] == screen_sync.OP_WAIT_SCREEN:
+                left, top, width, height = op['region']
+                item_text = f'{i+1}. 等待画面 ({left}, {top}, {width}x{height})'
+            elif op['type'] == OP_CALL:
+                item_text = f'{i+1}. 调用序列: {op["sequence"]}'
+                if op.get('dx') or op.get('dy'):
+                    item_text += f' 平移 ({op.get("dx", 0)}, {op.get("dy", 0)})'
             else:
                 item_text = f'{i+1}. 未知操作'
             
@@ -940,9 +1458,6 @@ class MainWindow(QMainWindow):
             item.setData(Qt.UserRole, op)
             # 添加列表项到控件
             self.operations_list.addItem(item)
-        
-        # 连接点击事件到处理函数
-        self.operations_list.itemClicked.connect(self.on_operation_clicked)
     
     def on_operation_clicked(self, item):
         """操作项点击事件处理"""
@@ -966,8 +1481,23 @@ class MainWindow(QMainWindow):
         # 添加按钮信息（如果有）
         if 'button' in op:
             detail += f"按钮: {op['button']}\n"
+        # 添加图像锚点信息（如果有）
+        if 'anchor' in op:
+            anchor = op['anchor']
+            detail += f"图像锚点: {anchor['width']}x{anchor['height']}，搜索半径 {anchor['search_radius']} 像素\n"
+        # 添加画面同步信息（如果有）
+        if op['type'] == screen_sync.OP_WAIT_SCREEN:
+            detail += f"区域: {tuple(op['region'])}\n"
+            detail += f"参考哈希: {op['hash']}（允许差异 {op.get('threshold', screen_sync.DEFAULT_THRESHOLD)} 位）\n"
+            on_timeout = '停止播放' if op.get('on_timeout') == screen_sync.ON_TIMEOUT_STOP else '继续播放'
+            detail += f"超时: {utils.us_to_seconds(op.get('timeout_us', screen_sync.DEFAULT_TIMEOUT_US)):.1f}秒后{on_timeout}\n"
+        # 添加调用序列信息（如果有）
+        if op['type'] == OP_CALL:
+            detail += f"调用序列: {op['sequence']}\n"
+            detail += f"时间偏移: {utils.us_to_seconds(op.get('offset_us', 0)):.3f}秒\n"
+            detail += f"坐标平移: ({op.get('dx', 0)}, {op.get('dy', 0)})\n"
         # 添加时间戳信息
-        detail += f"时间戳: {op['timestamp']:.2f}秒"
+        detail += f"时间戳: {utils.us_to_seconds(op['timestamp_us']):.3f}秒"
         
         # 更新详情文本框
         self.detail_text.setText(detail)
@@ -975,37 +1505,41 @@ class MainWindow(QMainWindow):
     def update_status(self):
         """更新状态信息"""
         # 更新录制状态
-        recording_text = f'{"正在录制" if utils.is_recording else "未录制"}'
+        recording_text = f'{"正在录制" if self.engine.is_recording else "未录制"}'
         if self.recording_status.text() != recording_text:
             self.recording_status.setText(recording_text)
             self.animate_widget(self.recording_status)
         
         # 更新播放状态
-        playback_text = f'{"正在播放" if utils.is_playing else "未播放"}'
+        playback_text = f'{"正在播放" if self.engine.is_playing else "未播放"}'
+        if self.engine.is_playing and self.engine.playlist_status:
+            playback_text = f'正在播放 {self.engine.playlist_status}'
+        if self.engine.is_paused:
+            playback_text = playback_text.replace('正在播放', '已暂停', 1)
         if self.playback_status.text() != playback_text:
             self.playback_status.setText(playback_text)
             self.animate_widget(self.playback_status)
         
         # 更新循环状态
-        loop_text = f'{"开启" if utils.is_looping else "关闭"}'
+        loop_text = f'{"开启" if self.engine.is_looping else "关闭"}'
         if self.loop_status.text() != loop_text:
             self.loop_status.setText(loop_text)
             self.animate_widget(self.loop_status)
         
         # 更新循环次数
-        loop_count_text = f'循环次数：{utils.loop_count}'
+        loop_count_text = f'循环次数：{self.engine.loop_count}'
         if self.loop_count_label.text() != loop_count_text:
             self.loop_count_label.setText(loop_count_text)
             self.animate_widget(self.loop_count_label)
         
         # 更新当前序列信息
-        sequence_text = f'当前序列：{utils.current_sequence or "无"}'
+        sequence_text = f'当前序列：{self.engine.current_sequence or "无"}'
         if self.current_sequence_label.text() != sequence_text:
             self.current_sequence_label.setText(sequence_text)
             self.animate_widget(self.current_sequence_label)
         
         # 更新按钮状态
-        if utils.is_recording:
+        if self.engine.is_recording:
             if self.start_record_btn.isEnabled():
                 self.start_record_btn.setEnabled(False)
                 self.animate_widget(self.start_record_btn)
@@ -1022,30 +1556,40 @@ class MainWindow(QMainWindow):
             if self.stop_record_btn.isEnabled():
                 self.stop_record_btn.setEnabled(False)
                 self.animate_widget(self.stop_record_btn)
-            play_enabled = not utils.is_playing and len(utils.recorded_operations) > 0
+            play_enabled = not self.engine.is_playing and len(self.engine.recorded_operations) > 0
             if self.play_btn.isEnabled() != play_enabled:
                 self.play_btn.setEnabled(play_enabled)
                 self.animate_widget(self.play_btn)
         
-        if utils.is_playing:
+        if self.engine.is_playing:
             if self.play_btn.isEnabled():
                 self.play_btn.setEnabled(False)
                 self.animate_widget(self.play_btn)
             if not self.stop_play_btn.isEnabled():
                 self.stop_play_btn.setEnabled(True)
                 self.animate_widget(self.stop_play_btn)
+            if not self.pause_play_btn.isEnabled():
+                self.pause_play_btn.setEnabled(True)
+                self.animate_widget(self.pause_play_btn)
+            pause_text = '继续' if self.engine.is_paused else '暂停'
+            if self.pause_play_btn.text() != pause_text:
+                self.pause_play_btn.setText(pause_text)
             if self.start_record_btn.isEnabled():
                 self.start_record_btn.setEnabled(False)
                 self.animate_widget(self.start_record_btn)
         else:
-            play_enabled = len(utils.recorded_operations) > 0
+            play_enabled = len(self.engine.recorded_operations) > 0
             if self.play_btn.isEnabled() != play_enabled:
                 self.play_btn.setEnabled(play_enabled)
                 self.animate_widget(self.play_btn)
             if self.stop_play_btn.isEnabled():
                 self.stop_play_btn.setEnabled(False)
                 self.animate_widget(self.stop_play_btn)
-            if not self.start_record_btn.isEnabled() and not utils.is_recording:
+            if self.pause_play_btn.isEnabled():
+                self.pause_play_btn.setEnabled(False)
+                self.pause_play_btn.setText('暂停')
+                self.animate_widget(self.pause_play_btn)
+            if not self.start_record_btn.isEnabled() and not self.engine.is_recording:
                 self.start_record_btn.setEnabled(True)
                 self.animate_widget(self.start_record_btn)
     
@@ -1095,7 +1639,7 @@ class MainWindow(QMainWindow):
         type_layout = QHBoxLayout()
         type_label = QLabel('操作类型:')
         self.operation_type_combo = QComboBox()
-        self.operation_type_combo.addItems(['鼠标移动', '鼠标按下', '鼠标释放', '按键按下', '按键释放'])
+        self.operation_type_combo.addItems(['鼠标移动', '鼠标按下', '鼠标释放', '按键按下', '按键释放', '等待画面', '调用序列'])
         type_layout.addWidget(type_label)
         type_layout.addWidget(self.operation_type_combo)
         layout.addLayout(type_layout)
@@ -1108,7 +1652,7 @@ class MainWindow(QMainWindow):
         timestamp_layout = QHBoxLayout()
         timestamp_label = QLabel('时间戳:')
         self.timestamp_input = QLineEdit()
-        self.timestamp_input.setPlaceholderText('输入时间戳')
+        self.timestamp_input.setPlaceholderText('输入时间戳（秒）')
         timestamp_layout.addWidget(timestamp_label)
         timestamp_layout.addWidget(self.timestamp_input)
         layout.addLayout(timestamp_layout)
@@ -1134,6 +1678,14 @@ class MainWindow(QMainWindow):
             self.y_input = None
             self.button_combo = None
             self.key_input = None
+            self.region_input = None
+            self.threshold_input = None
+            self.timeout_input = None
+            self.on_timeout_combo = None
+            self.call_combo = None
+            self.offset_input = None
+            self.dx_input = None
+            self.dy_input = None
             
             operation_type = self.operation_type_combo.currentText()
             
@@ -1173,6 +1725,63 @@ class MainWindow(QMainWindow):
                 key_layout.addWidget(key_label)
                 key_layout.addWidget(self.key_input)
                 self.params_layout.addLayout(key_layout)
+            elif operation_type == '等待画面':
+                # 画面同步参数：确认后截取该区域的当前画面作为参考
+                region_layout = QHBoxLayout()
+                region_label = QLabel('区域:')
+                self.region_input = QLineEdit()
+                self.region_input.setPlaceholderText('左,上,宽,高（确认时截取当前画面）')
+                region_layout.addWidget(region_label)
+                region_layout.addWidget(self.region_input)
+                self.params_layout.addLayout(region_layout)
+                
+                threshold_layout = QHBoxLayout()
+                threshold_label = QLabel('允许差异:')
+                self.threshold_input = QLineEdit()
+                self.threshold_input.setPlaceholderText(f'哈希不同的位数（默认{screen_sync.DEFAULT_THRESHOLD}）')
+                threshold_layout.addWidget(threshold_label)
+                threshold_layout.addWidget(self.threshold_input)
+                self.params_layout.addLayout(threshold_layout)
+                
+                timeout_layout = QHBoxLayout()
+                timeout_label = QLabel('超时:')
+                self.timeout_input = QLineEdit()
+                self.timeout_input.setPlaceholderText(f'秒（默认{utils.us_to_seconds(screen_sync.DEFAULT_TIMEOUT_US):.0f}）')
+                self.on_timeout_combo = QComboBox()
+                self.on_timeout_combo.addItem('超时停止播放', screen_sync.ON_TIMEOUT_STOP)
+                self.on_timeout_combo.addItem('超时继续播放', screen_sync.ON_TIMEOUT_CONTINUE)
+                timeout_layout.addWidget(timeout_label)
+                timeout_layout.addWidget(self.timeout_input)
+                timeout_layout.addWidget(self.on_timeout_combo)
+                self.params_layout.addLayout(timeout_layout)
+            elif operation_type == '调用序列':
+                # 调用序列参数：被调用的已保存序列、开始前的时间偏移和坐标平移
+                call_layout = QHBoxLayout()
+                call_label = QLabel('序列:')
+                self.call_combo = QComboBox()
+                self.call_combo.addItems(sorted(utils.sequences))
+                call_layout.addWidget(call_label)
+                call_layout.addWidget(self.call_combo)
+                self.params_layout.addLayout(call_layout)
+                
+                offset_layout = QHBoxLayout()
+                offset_label = QLabel('时间偏移:')
+                self.offset_input = QLineEdit()
+                self.offset_input.setPlaceholderText('秒（默认0）')
+                offset_layout.addWidget(offset_label)
+                offset_layout.addWidget(self.offset_input)
+                self.params_layout.addLayout(offset_layout)
+                
+                translate_layout = QHBoxLayout()
+                translate_label = QLabel('坐标平移:')
+                self.dx_input = QLineEdit()
+                self.dx_input.setPlaceholderText('X（默认0）')
+                self.dy_input = QLineEdit()
+                self.dy_input.setPlaceholderText('Y（默认0）')
+                translate_layout.addWidget(translate_label)
+                translate_layout.addWidget(self.dx_input)
+                translate_layout.addWidget(self.dy_input)
+                self.params_layout.addLayout(translate_layout)
         
         # 初始更新参数输入字段
         update_params()
@@ -1195,7 +1804,7 @@ class MainWindow(QMainWindow):
             # 创建操作对象
             timestamp = float(self.timestamp_input.text()) if self.timestamp_input.text() else 0
             operation = {
-                'timestamp': timestamp,
+                'timestamp_us': utils.seconds_to_us(timestamp),
                 'type': ''
             }
             
@@ -1230,9 +1839,45 @@ class MainWindow(QMainWindow):
                 # 使用辅助函数处理按键参数
                 key_params = self._process_key_operation(key_value)
                 operation.update(key_params)
+            elif operation_type == '等待画面':
+                try:
+                    region = [int(v) for v in self.region_input.text().replace('，', ',').split(',')]
+                    if len(region) != 4 or region[2] <= 0 or region[3] <= 0:
+                        raise ValueError
+                except ValueError:
+                    QMessageBox.warning(self, '错误', '区域格式应为：左,上,宽,高')
+                    return
+                threshold = int(self.threshold_input.text()) if self.threshold_input.text() else screen_sync.DEFAULT_THRESHOLD
+                timeout_us = utils.seconds_to_us(self.timeout_input.text()) if self.timeout_input.text() else screen_sync.DEFAULT_TIMEOUT_US
+                # 隐藏窗口后截取参考画面，避免截到本程序的窗口
+                self.hide()
+                QApplication.processEvents()
+                time.sleep(0.3)
+                try:
+                    operation = screen_sync.make_wait_operation(region, operation['timestamp_us'], threshold,
+                                                                timeout_us, self.on_timeout_combo.currentData())
+                except Exception as e:
+                    utils.logger.error("截取参考画面失败: %s", e)
+                    QMessageBox.warning(self, '错误', f'截取参考画面失败: {e}')
+                    return
+                finally:
+                    self.show()
+            elif operation_type == '调用序列':
+                if not self.call_combo.currentText():
+                    QMessageBox.warning(self, '错误', '没有可调用的已保存序列')
+                    return
+                try:
+                    offset_us = utils.seconds_to_us(self.offset_input.text()) if self.offset_input.text() else 0
+                    dx = float(self.dx_input.text()) if self.dx_input.text() else 0
+                    dy = float(self.dy_input.text()) if self.dy_input.text() else 0
+                except ValueError:
+                    QMessageBox.warning(self, '错误', '时间偏移和坐标平移必须是数字')
+                    return
+                operation = make_call_operation(self.call_combo.currentText(), operation['timestamp_us'], offset_us, dx, dy)
             
             # 添加到操作列表
-            utils.recorded_operations.append(operation)
+            deltas = op_store.insert_operation(self.engine.recorded_operations, len(self.engine.recorded_operations), operation)
+            self._record_edit('添加', deltas)
             
             # 更新操作列表
             self.update_operations_list()
@@ -1251,8 +1896,9 @@ class MainWindow(QMainWindow):
             return
         
         selected_item = selected_items[0]
-        operation = selected_item.data(Qt.UserRole)
         operation_index = self.operations_list.row(selected_item)
+        # 编辑副本，确认后只把变化的字段作为补丁写回
+        operation = op_store.copy_op(self.engine.recorded_operations[operation_index])
         
         # 创建编辑操作对话框
         dialog = QDialog(self)
@@ -1270,7 +1916,9 @@ class MainWindow(QMainWindow):
             'mousedown': '鼠标按下',
             'mouseup': '鼠标释放',
             'keydown': '按键按下',
-            'keyup': '按键释放'
+            'keyup': '按键释放',
+            screen_sync.OP_WAIT_SCREEN: '等待画面',
+            OP_CALL: '调用序列'
         }
         type_value.setText(type_map.get(operation['type'], '未知操作'))
         type_layout.addWidget(type_label)
@@ -1285,8 +1933,8 @@ class MainWindow(QMainWindow):
         timestamp_layout = QHBoxLayout()
         timestamp_label = QLabel('时间戳:')
         timestamp_input = QLineEdit()
-        timestamp_input.setText(str(operation.get('timestamp', 0)))
-        timestamp_input.setPlaceholderText('输入时间戳')
+        timestamp_input.setText(str(utils.us_to_seconds(operation.get('timestamp_us', 0))))
+        timestamp_input.setPlaceholderText('输入时间戳（秒）')
         timestamp_layout.addWidget(timestamp_label)
         timestamp_layout.addWidget(timestamp_input)
         params_layout.addLayout(timestamp_layout)
@@ -1331,6 +1979,58 @@ class MainWindow(QMainWindow):
             key_layout.addWidget(key_label)
             key_layout.addWidget(key_input)
             params_layout.addLayout(key_layout)
+        elif operation['type'] == screen_sync.OP_WAIT_SCREEN:
+            # 画面同步参数（区域和参考画面在添加时确定，这里只修改匹配条件）
+            threshold_layout = QHBoxLayout()
+            threshold_label = QLabel('允许差异:')
+            threshold_input = QLineEdit()
+            threshold_input.setText(str(operation.get('threshold', screen_sync.DEFAULT_THRESHOLD)))
+            threshold_layout.addWidget(threshold_label)
+            threshold_layout.addWidget(threshold_input)
+            params_layout.addLayout(threshold_layout)
+            
+            timeout_layout = QHBoxLayout()
+            timeout_label = QLabel('超时（秒）:')
+            timeout_input = QLineEdit()
+            timeout_input.setText(str(utils.us_to_seconds(operation.get('timeout_us', screen_sync.DEFAULT_TIMEOUT_US))))
+            on_timeout_combo = QComboBox()
+            on_timeout_combo.addItem('超时停止播放', screen_sync.ON_TIMEOUT_STOP)
+            on_timeout_combo.addItem('超时继续播放', screen_sync.ON_TIMEOUT_CONTINUE)
+            on_timeout_combo.setCurrentIndex(on_timeout_combo.findData(operation.get('on_timeout', screen_sync.ON_TIMEOUT_STOP)))
+            timeout_layout.addWidget(timeout_label)
+            timeout_layout.addWidget(timeout_input)
+            timeout_layout.addWidget(on_timeout_combo)
+            params_layout.addLayout(timeout_layout)
+        elif operation['type'] == OP_CALL:
+            # 调用序列参数
+            call_layout = QHBoxLayout()
+            call_label = QLabel('序列:')
+            call_combo = QComboBox()
+            call_combo.setEditable(True)
+            call_combo.addItems(sorted(utils.sequences))
+            call_combo.setCurrentText(operation.get('sequence', ''))
+            call_layout.addWidget(call_label)
+            call_layout.addWidget(call_combo)
+            params_layout.addLayout(call_layout)
+            
+            offset_layout = QHBoxLayout()
+            offset_label = QLabel('时间偏移（秒）:')
+            offset_input = QLineEdit()
+            offset_input.setText(str(utils.us_to_seconds(operation.get('offset_us', 0))))
+            offset_layout.addWidget(offset_label)
+            offset_layout.addWidget(offset_input)
+            params_layout.addLayout(offset_layout)
+            
+            translate_layout = QHBoxLayout()
+            translate_label = QLabel('坐标平移:')
+            dx_input = QLineEdit()
+            dx_input.setText(str(operation.get('dx', 0)))
+            dy_input = QLineEdit()
+            dy_input.setText(str(operation.get('dy', 0)))
+            translate_layout.addWidget(translate_label)
+            translate_layout.addWidget(dx_input)
+            translate_layout.addWidget(dy_input)
+            params_layout.addLayout(translate_layout)
         
         # 按钮盒
         button_box = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
@@ -1341,7 +2041,7 @@ class MainWindow(QMainWindow):
         # 显示对话框
         if dialog.exec_() == QDialog.Accepted:
             # 更新时间戳
-            operation['timestamp'] = float(timestamp_input.text()) if timestamp_input.text() else 0
+            operation['timestamp_us'] = utils.seconds_to_us(timestamp_input.text()) if timestamp_input.text() else 0
             
             # 更新操作参数
             if operation['type'] in ['mousemove', 'mousedown', 'mouseup']:
@@ -1356,70 +2056,203 @@ class MainWindow(QMainWindow):
                 # 使用辅助函数处理按键参数
                 key_params = self._process_key_operation(key_value)
                 operation.update(key_params)
+            elif operation['type'] == screen_sync.OP_WAIT_SCREEN:
+                if threshold_input.text():
+                    operation['threshold'] = int(threshold_input.text())
+                if timeout_input.text():
+                    operation['timeout_us'] = utils.seconds_to_us(timeout_input.text())
+                operation['on_timeout'] = on_timeout_combo.currentData()
+            elif operation['type'] == OP_CALL:
+                if call_combo.currentText():
+                    operation['sequence'] = call_combo.currentText()
+                operation['offset_us'] = max(utils.seconds_to_us(offset_input.text()), 0) if offset_input.text() else 0
+                operation['dx'] = float(dx_input.text()) if dx_input.text() else 0
+                operation['dy'] = float(dy_input.text()) if dy_input.text() else 0
             
             # 更新操作列表
-            utils.recorded_operations[operation_index] = operation
+            deltas = op_store.patch_operation(self.engine.recorded_operations, operation_index, operation)
+            self._record_edit('编辑', deltas)
             self.update_operations_list()
             
             # 显示成功提示
             QMessageBox.information(self, '成功', '操作已更新')
     
+    def _selected_ranges(self):
+        """返回选中操作的升序半开区间列表"""
+        # 直接从选择模型取行号，避免对每个列表项调用 row()（每次 O(n)）
+        rows = [index.row() for index in self.operations_list.selectionModel().selectedRows()]
+        return op_store.indices_to_ranges(rows)
+    
+    def _sequence_state(self):
+        """返回需要随撤销/重做一起恢复的序列状态"""
+        return {'current_sequence': self.engine.current_sequence, 'sequence_meta': self.engine.sequence_meta}
+    
+    def _apply_sequence_state(self, state):
+        """恢复序列状态"""
+        if state is not None:
+            self.engine.current_sequence = state['current_sequence']
+            self.engine.sequence_meta = state['sequence_meta']
+            self.current_sequence_label.setText(f'当前序列：{self.engine.current_sequence or "无"}')
+    
+    def _update_history_buttons(self):
+        """根据编辑历史更新撤销/重做按钮"""
+        self.undo_btn.setEnabled(self.history.can_undo())
+        self.undo_btn.setToolTip(f'撤销：{self.history.undo_label()}' if self.history.can_undo() else '')
+        self.redo_btn.setEnabled(self.history.can_redo())
+        self.redo_btn.setToolTip(f'重做：{self.history.redo_label()}' if self.history.can_redo() else '')
+    
+    def _reset_undo(self):
+        """操作序列被整体替换时清空编辑历史"""
+        self.history.clear()
+        self._update_history_buttons()
+    
+    def _record_edit(self, label, deltas, state_before=None, state_after=None):
+        """记录一次已经应用的编辑，用于撤销/重做"""
+        self.history.record(label, deltas, state_before, state_after)
+        self._update_history_buttons()
+    
     def on_copy_operation(self):
         """复制操作"""
-        import copy
-        import time
-        
         # 检查是否有选中的操作
-        selected_items = self.operations_list.selectedItems()
-        if not selected_items:
+        ranges = self._selected_ranges()
+        if not ranges:
             QMessageBox.warning(self, '错误', '请先选择要复制的操作')
             return
         
-        # 获取选中操作的索引并排序
-        selected_indices = [self.operations_list.row(item) for item in selected_items]
-        selected_indices.sort()
-        
-        # 复制选中的操作
-        copied_operations = []
-        for index in selected_indices:
-            operation = utils.recorded_operations[index]
-            # 深拷贝操作对象
-            copied_operation = copy.deepcopy(operation)
-            # 更新时间戳
-            copied_operation['timestamp'] = time.time() - utils.start_time if hasattr(utils, 'start_time') else 0
-            copied_operations.append(copied_operation)
-        
-        # 将复制的操作添加到操作列表末尾
-        for operation in copied_operations:
-            utils.recorded_operations.append(operation)
+        # 将选中的操作复制到操作列表末尾，副本沿用原操作之间的时间间隔接在最后一个操作之后
+        deltas = op_store.duplicate_ranges(self.engine.recorded_operations, ranges)
+        self._record_edit('复制', deltas)
+        count = sum(end - start for start, end in ranges)
         
         # 更新操作列表
         self.update_operations_list()
         
         # 显示成功提示
-        QMessageBox.information(self, '成功', f'已复制 {len(copied_operations)} 个操作')
+        QMessageBox.information(self, '成功', f'已复制 {count} 个操作')
+    
+    def on_move_operation(self):
+        """移动操作"""
+        from PyQt5.QtWidgets import QInputDialog
+        
+        # 检查是否有选中的操作
+        ranges = self._selected_ranges()
+        if not ranges:
+            QMessageBox.warning(self, '错误', '请先选择要移动的操作')
+            return
+        
+        # 输入目标位置（移动到第几个操作之前，从1开始，最大值表示移动到末尾）
+        total = len(self.engine.recorded_operations)
+        position, ok = QInputDialog.getInt(self, '移动操作', f'移动到第几个操作之前（1-{total + 1}）:', 1, 1, total + 1)
+        if not ok:
+            return
+        
+        try:
+            deltas = op_store.move_ranges(self.engine.recorded_operations, ranges, position - 1)
+        except ValueError as e:
+            QMessageBox.warning(self, '错误', str(e))
+            return
+        self._record_edit('移动', deltas)
+        
+        # 更新操作列表
+        self.update_operations_list()
     
     def on_delete_operation(self):
         """删除操作"""
         # 检查是否有选中的操作
-        selected_items = self.operations_list.selectedItems()
-        if not selected_items:
+        ranges = self._selected_ranges()
+        if not ranges:
             QMessageBox.warning(self, '错误', '请先选择要删除的操作')
             return
-        
-        # 获取选中操作的索引并排序（从后往前删除）
-        selected_indices = [self.operations_list.row(item) for item in selected_items]
-        selected_indices.sort(reverse=True)
+        count = sum(end - start for start, end in ranges)
         
         # 显示确认对话框
-        if QMessageBox.question(self, '确认', f'确定要删除选中的 {len(selected_items)} 个操作吗？', 
+        if QMessageBox.question(self, '确认', f'确定要删除选中的 {count} 个操作吗？', 
                                QMessageBox.Yes | QMessageBox.No) == QMessageBox.Yes:
-            # 从操作列表中移除（从后往前删除避免索引变化）
-            for index in selected_indices:
-                del utils.recorded_operations[index]
+            # 按区间一次性删除
+            deltas = op_store.delete_ranges(self.engine.recorded_operations, ranges)
+            self._record_edit('删除', deltas)
             
             # 更新操作列表
             self.update_operations_list()
             
             # 显示成功提示
-            QMessageBox.information(self, '成功', f'已删除 {len(selected_items)} 个操作')
+            QMessageBox.information(self, '成功', f'已删除 {count} 个操作')
+    
+    def on_undo(self):
+        """撤销最近一次编辑"""
+        entry = self.history.undo(self.engine.recorded_operations)
+        if entry is None:
+            return
+        self._apply_sequence_state(entry.state_before)
+        self._update_history_buttons()
+        
+        # 更新操作列表
+        self.update_operations_list()
+        self.detail_text.clear()
+    
+    def on_redo(self):
+        """重做最近一次撤销的编辑"""
+        entry = self.history.redo(self.engine.recorded_operations)
+        if entry is None:
+            return
+        self._apply_sequence_state(entry.state_after)
+        self._update_history_buttons()
+        
+        # 更新操作列表
+        self.update_operations_list()
+        self.detail_text.clear()
+    
+    def on_retime_operations(self):
+        """时间调整：平移、缩放、压缩空闲间隔、排序校验"""
+        from PyQt5.QtWidgets import QInputDialog
+        
+        operations = self.engine.recorded_operations
+        if not operations:
+            QMessageBox.warning(self, '错误', '当前没有操作')
+            return
+        
+        actions = ['平移选中操作及之后的时间', '缩放选中区间的时间', '压缩过长的空闲间隔', '按时间排序并校验']
+        action, ok = QInputDialog.getItem(self, '时间调整', '调整方式:', actions, 0, False)
+        if not ok:
+            return
+        
+        ranges = self._selected_ranges()
+        deltas = []
+        if action == actions[0]:
+            # 从第一个选中的操作开始平移
+            if not ranges:
+                QMessageBox.warning(self, '错误', '请先选择起始操作')
+                return
+            seconds, ok = QInputDialog.getDouble(self, '时间调整', '平移秒数（负数表示提前）:', 0.0, -86400.0, 86400.0, 3)
+            if not ok:
+                return
+            deltas = transforms.shift_after(operations, ranges[0][0], utils.seconds_to_us(seconds))
+        elif action == actions[1]:
+            # 缩放从第一个到最后一个选中操作之间的区间
+            if not ranges:
+                QMessageBox.warning(self, '错误', '请先选择要缩放的操作')
+                return
+            factor, ok = QInputDialog.getDouble(self, '时间调整', '时间缩放倍数（小于1加快，大于1减慢）:', 1.0, 0.01, 100.0, 3)
+            if not ok:
+                return
+            deltas = transforms.scale_range(operations, ranges[0][0], ranges[-1][1], factor)
+        elif action == actions[2]:
+            # 有选中操作时只压缩选中区间，否则压缩整个序列
+            seconds, ok = QInputDialog.getDouble(self, '时间调整', '最大空闲间隔（秒）:', 1.0, 0.0, 3600.0, 3)
+            if not ok:
+                return
+            if ranges:
+                deltas = transforms.clamp_gaps(operations, utils.seconds_to_us(seconds), ranges[0][0], ranges[-1][1])
+            else:
+                deltas = transforms.clamp_gaps(operations, utils.seconds_to_us(seconds))
+        else:
+            inversions = transforms.find_time_inversions(operations)
+            if len(inversions) == 0:
+                QMessageBox.information(self, '校验', '时间戳已按顺序排列')
+                return
+            deltas = transforms.sort_by_time(operations)
+            QMessageBox.information(self, '校验', f'发现 {len(inversions)} 处时间倒序（首个位于第 {int(inversions[0]) + 1} 个操作），已重新排序')
+        
+        self._record_edit(action, deltas)
+        # 更新操作列表
+        self.update_operations_list()
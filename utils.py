@@ -3,6 +3,8 @@ import os
 import logging
 from PyQt5.QtCore import QObject, pyqtSignal
 import pyautogui
+import metrics
+import log_utils
 
 # 获取程序所在目录的绝对路径
 import sys
@@ -18,6 +20,22 @@ logs_dir = os.path.join(PROGRAM_DIR, "logs")
 if not os.path.exists(logs_dir):
     os.makedirs(logs_dir)
 
+# 性能分析文件目录（见 profiler.py）
+profiles_dir = os.path.join(logs_dir, "profiles")
+# 播放会话跟踪文件目录（见 session_trace.py）
+traces_dir = os.path.join(logs_dir, "traces")
+
+# 日志配置
+log_rotation = 'size'         # 日志轮转方式：'size' 按大小，'time' 按时间（见 log_rotate_when），'none' 不轮转
+log_max_bytes = 10 * 1024 * 1024  # 按大小轮转时单个日志文件的最大字节数
+log_rotate_when = 'midnight'  # 按时间轮转的周期（如 'midnight' 每天零点，'H' 每小时）
+log_backup_count = 5          # 保留的历史日志文件数，更早的被删除
+log_structured = False        # 是否以 JSON 行格式写入日志文件（logs/automation.jsonl），默认为文本格式（logs/automation.log）
+playback_trace = False        # 是否把播放中每个操作的事件以紧凑二进制格式写入 logs/playback.trace（见 log_utils.py）
+session_trace = False         # 是否为每次播放记录会话跟踪文件 logs/traces/*.strace，用 session_trace.py analyze 分析
+session_trace_capacity = 65536  # 会话跟踪文件的环形缓冲记录数，超出后覆盖最早的记录
+session_trace_keep = 20       # 保留的会话跟踪文件数，更早的被删除
+
 # 日志格式
 log_format = '%(asctime)s - %(name)s - %(levelname)s - %(filename)s:%(lineno)d - %(message)s'
 
@@ -25,10 +43,16 @@ log_format = '%(asctime)s - %(name)s - %(levelname)s - %(filename)s:%(lineno)d -
 logger = logging.getLogger('desktop_automation')
 logger.setLevel(logging.DEBUG)
 
-# 文件处理器
-file_handler = logging.FileHandler(os.path.join(logs_dir, 'automation.log'), encoding='utf-8')
+# 文件处理器（按配置轮转）
+if log_structured:
+    file_handler = log_utils.make_file_handler(os.path.join(logs_dir, 'automation.jsonl'), log_rotation,
+                                               log_max_bytes, log_backup_count, log_rotate_when)
+    file_handler.setFormatter(log_utils.JsonLinesFormatter())
+else:
+    file_handler = log_utils.make_file_handler(os.path.join(logs_dir, 'automation.log'), log_rotation,
+                                               log_max_bytes, log_backup_count, log_rotate_when)
+    file_handler.setFormatter(logging.Formatter(log_format))
 file_handler.setLevel(logging.DEBUG)
-file_handler.setFormatter(logging.Formatter(log_format))
 
 # 控制台处理器（可选，保留以便在开发时查看）
 console_handler = logging.StreamHandler()
@@ -41,34 +65,51 @@ if not logger.handlers:
     logger.addHandler(console_handler)
 
 # 全局变量
-# 全局录制/播放控制标志
-is_recording = False          # 是否正在录制操作
-is_playing = False            # 是否正在播放操作
-recorded_operations = []      # 存储录制到的操作序列
-recording_thread = None       # 录制线程对象
-playback_thread = None        # 播放线程对象
-recording_start_time = 0      # 录制开始时间（用于计算相对时间戳）
-is_looping = False            # 是否启用循环播放
-loop_count = 0                # 当前循环次数
-current_sequence = ""         # 当前选中的序列名称
+# 录制/播放的运行状态（是否正在录制或播放、当前操作序列、循环计数、修饰键状态等）由 engine.AutomationEngine 持有，
+# 这里只保留序列库和配置
 sequences = {}                # 已加载的序列字典，键为序列名，值为操作列表
+sequence_metas = {}           # 已加载序列的元数据字典，键为序列名，值为元数据字典
+sequence_load_errors = {}     # 最近一次加载序列库时无法读取的序列：名称 -> 错误信息
+sequences_version = 0         # 序列库版本号：保存、删除、重命名或重新加载序列时加1，与 op_store.edit_version 一起用于使按序列的缓存失效（见 sequence.library_version）
+playlists = {}                # 已保存的播放列表：名称 -> 项列表
 sequences_dir = os.path.join(PROGRAM_DIR, "sequences")   # 存放序列文件的目录名
+playlists_dir = os.path.join(PROGRAM_DIR, "playlists")   # 存放播放列表文件的目录名
 playback_speed = 1.0          # 默认播放速度（倍率，1.0 为正常速度）
-
-# 修饰键状态跟踪
-modifier_keys = {
-    'ctrl': False,
-    'shift': False,
-    'alt': False,
-    'win': False
-}
+capture_queue_capacity = 65536  # 录制采集队列容量（每个监听线程一个队列，满时丢弃新事件）
+capture_mode = 'adaptive'     # 鼠标移动采样模式：'all' 全部记录，'fixed' 固定频率上限，'adaptive' 自适应
+capture_max_hz = 125          # 鼠标移动采样频率上限（次/秒，0 表示不限制）
+capture_min_distance = 2      # 鼠标移动最小记录距离（像素），更小的移动视为抖动
+interpolation_mode = 'linear'  # 播放鼠标移动的插值模式：'exact'、'linear'、'catmull_rom'、'bezier'
+playback_refresh_hz = 120     # 播放鼠标移动路径的目标刷新率（次/秒）
+batch_quantum_us = 2000       # 播放批次量子（微秒）：计划时间在同一量子内的操作合并为一个批次背靠背发送
+chord_settle_us = 10000       # 播放组合键时修饰键与基础键之间的延时（微秒），部分程序在修饰键和基础键同时到达时识别不到组合键
+history_memory_budget = 64 * 1024 * 1024  # 编辑历史（撤销/重做）的估算内存预算（字节）
+max_idle_gap_us = 0           # 播放时相邻操作之间的最大等待时间（微秒，0 表示按原始间隔播放）
+anchor_clicks = False         # 录制时是否在鼠标按下位置截取图像锚点，播放时按图像位置修正点击坐标
+anchor_template_size = 48     # 图像锚点模板边长（像素）
+anchor_search_radius = 160    # 播放时在录制位置周围搜索锚点的半径（像素）
+adapt_coordinates = True      # 播放前是否按序列保存的屏幕配置把坐标换算到当前屏幕（分辨率、缩放或显示器排列改变时，见 screen_geometry.py）
+control_server_enabled = False  # 是否在界面程序中启动本机控制服务（见 control_server.py）
+control_server_port = 8765    # 本机控制服务监听的回环端口
+control_server_token = ''     # 控制服务令牌；为空时使用每个用户自动生成的令牌文件（见 control_server.py），监听非回环地址时必须设置
+scheduler_enabled = False     # 是否在界面程序中运行定时任务（见 scheduler.py）
+schedule_file = os.path.join(PROGRAM_DIR, "schedule.json")  # 定时任务文件
+metrics_enabled = False       # 是否记录运行指标（见 metrics.py），开启后每次录制/播放结束时写入 logs 目录
 
 # 配置
 pyautogui.FAILSAFE = True  # 启用安全模式，移动鼠标到左上角可停止操作
 pyautogui.PAUSE = 0.01  # 操作之间的暂停时间
 
-# 循环次数配置
-max_loop_count = 1  # 默认循环1次
+# 时间戳单位：操作中的 'timestamp_us' 字段为相对录制开始的整数微秒
+US_PER_SECOND = 1000000
+
+def seconds_to_us(seconds):
+    """将浮点秒转换为整数微秒（四舍五入）"""
+    return int(round(float(seconds) * US_PER_SECOND))
+
+def us_to_seconds(us):
+    """将整数微秒转换为浮点秒"""
+    return us / US_PER_SECOND
 
 # 信号类
 class PlaybackSignals(QObject):
@@ -77,16 +118,30 @@ class PlaybackSignals(QObject):
 class RecordingSignals(QObject):
     stopped = pyqtSignal()
 
+class ControlSignals(QObject):
+    # 控制服务请求加载序列：(序列名, concurrent.futures.Future)，由界面线程加载并刷新界面，结果 (成功, 消息) 写入 Future
+    load_requested = pyqtSignal(str, object)
+
 # 信号实例
 playback_signals = PlaybackSignals()
 recording_signals = RecordingSignals()
+control_signals = ControlSignals()
 
 # 确保序列目录存在
 def ensure_sequences_dir():
     if not os.path.exists(sequences_dir):
         os.makedirs(sequences_dir)
 
+# 写入运行指标
+def write_metrics():
+    """把运行指标写入日志目录下的 metrics.prom 和 metrics.json"""
+    try:
+        metrics.write_files(logs_dir)
+    except OSError as e:
+        logger.error("写入运行指标失败: %s", e)
+
 # 初始化函数
 def init_utils():
     ensure_sequences_dir()
+    metrics.set_enabled(metrics_enabled)
     logger.info("应用程序启动，日志系统初始化完成")